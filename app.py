@@ -3,23 +3,80 @@ FastAPI backend phục vụ inference cho VideoMAE.
 Chạy server:
 
     uvicorn app:app --reload
+
+torch / transformers / PyAV chỉ được import khi load model (chạy nền sau startup),
+nên server nhận kết nối gần như ngay lập tức; `/ready` trả 200 khi model đã sẵn sàng.
 """
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import os
 import tempfile
-from pathlib import Path
-from typing import Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple, Union
 
-import requests
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
+import anyio
+import httpx
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
-from inference_service import load_inference_components, predict_from_path
+from batching import BatchInfo, MicroBatcher
+from inference_pool import InferencePool, QueueFullError
+from metrics import (
+    BATCH_SIZE,
+    BYTES_RECEIVED,
+    CACHE_LOOKUPS,
+    CASCADE_STAGE,
+    DEDUP_LOOKUPS,
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    INFLIGHT,
+    REGISTRY,
+    REQUEST_SECONDS,
+    REQUESTS_TOTAL,
+    STAGE_SECONDS,
+    memory_usage,
+)
+from prediction_cache import PredictionCache, cache_key, model_fingerprint
+from remote_video import PartialVideo, RangeFetchUnavailable, fetch_partial_video
+from video_fetcher import VideoFetcher
 
 CHUNK_SIZE = 2 * 1024 * 1024  # 2MB
 MAX_FILE_SIZE_MB = 300
+MAX_BATCH_SIZE = int(os.environ.get("VIDEOMAE_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("VIDEOMAE_MAX_BATCH_WAIT_MS", "10"))
+INFERENCE_WORKERS = int(os.environ.get("VIDEOMAE_INFERENCE_WORKERS", "2"))
+MAX_PENDING_REQUESTS = int(os.environ.get("VIDEOMAE_MAX_PENDING", "32"))
+RETRY_AFTER_S = int(os.environ.get("VIDEOMAE_RETRY_AFTER_S", "1"))
+CACHE_MAX_MB = float(os.environ.get("VIDEOMAE_CACHE_MAX_MB", "64"))
+CACHE_DB_PATH = os.environ.get("VIDEOMAE_CACHE_DB") or None
+SPOOL_MAX_MB = float(os.environ.get("VIDEOMAE_SPOOL_MAX_MB", "64"))
+MAX_BATCH_ITEMS = int(os.environ.get("VIDEOMAE_MAX_BATCH_ITEMS", "32"))
+SEGMENT_PREFETCH = int(os.environ.get("VIDEOMAE_SEGMENT_PREFETCH", "16"))
+# Số stream /predict/segments decode cùng lúc (executor riêng, không dùng pool của /predict)
+SEGMENT_STREAMS = int(os.environ.get("VIDEOMAE_SEGMENT_STREAMS", "2"))
+MAX_SEGMENT_WINDOW_S = 60.0
+HTTP_CONNECT_TIMEOUT_S = float(os.environ.get("VIDEOMAE_HTTP_CONNECT_TIMEOUT_S", "10"))
+HTTP_READ_TIMEOUT_S = float(os.environ.get("VIDEOMAE_HTTP_READ_TIMEOUT_S", "60"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("VIDEOMAE_HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_PER_HOST = int(os.environ.get("VIDEOMAE_HTTP_MAX_PER_HOST", "8"))
+COMPILE_MODE = os.environ.get("VIDEOMAE_COMPILE", "none").lower()
+WARMUP_STEPS = int(os.environ.get("VIDEOMAE_WARMUP_STEPS", "0"))
+RANGE_FETCH = os.environ.get("VIDEOMAE_RANGE_FETCH", "1") != "0"
+RANGE_MIN_MB = float(os.environ.get("VIDEOMAE_RANGE_MIN_MB", "8"))
+# Index near-duplicate (0 = tắt): trả lại nhãn của video gần giống đã phân loại trước đó
+DEDUP_MAX_ITEMS = int(os.environ.get("VIDEOMAE_DEDUP_MAX_ITEMS", "0"))
+DEDUP_MAX_DISTANCE = int(os.environ.get("VIDEOMAE_DEDUP_MAX_DISTANCE", "16"))
+DEDUP_PATH = os.environ.get("VIDEOMAE_DEDUP_PATH") or None
+# Cascade: model rẻ chạy trước, chỉ video có độ tin cậy < ngưỡng mới chạy model đầy đủ (trống = tắt)
+CASCADE_MODEL_PATH = os.environ.get("VIDEOMAE_CASCADE_MODEL_PATH") or None
+CASCADE_THRESHOLD = float(os.environ.get("VIDEOMAE_CASCADE_THRESHOLD", "0.95"))
 
 app = FastAPI(
     title="Video Sentiment Service",
@@ -28,44 +85,69 @@ app = FastAPI(
 )
 
 
-def _cleanup_file(path: Optional[str]) -> None:
-    if path and os.path.exists(path):
+def _close_buffer(buffer: Optional[Union[BinaryIO, PartialVideo]]) -> None:
+    if buffer is not None:
         try:
-            os.remove(path)
+            buffer.close()
         except OSError:
             pass
 
 
-async def _download_video(video_url: str) -> str:
+async def _download_video(video_url: str) -> Tuple[BinaryIO, str]:
     """
-    Tải video từ URL bất đồng bộ (chạy requests trong thread).
+    Tải video từ URL qua client httpx dùng chung vào buffer trong bộ nhớ.
+    Chỉ tràn ra file tạm khi video lớn hơn SPOOL_MAX_MB.
+    Trả về (buffer đã seek về đầu, sha256 của nội dung).
     """
+    digest = hashlib.sha256()
+    buffer = tempfile.SpooledTemporaryFile(max_size=int(SPOOL_MAX_MB * 1024 * 1024))
+    try:
+        with STAGE_SECONDS.time(stage="download"):
+            total_bytes = await _get_fetcher().fetch(video_url, buffer, digest)
+        buffer.seek(0)
+    except BaseException:
+        buffer.close()
+        raise
+    BYTES_RECEIVED.inc(total_bytes, source="url")
+    return buffer, digest.hexdigest()
 
-    def _download_sync() -> str:
-        response = requests.get(video_url, stream=True, timeout=120)
-        response.raise_for_status()
-        total_bytes = 0
-        suffix = Path(video_url).suffix or ".mp4"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            for chunk in response.iter_content(CHUNK_SIZE):
-                if not chunk:
-                    continue
-                total_bytes += len(chunk)
-                if total_bytes > MAX_FILE_SIZE_MB * 1024 * 1024:
-                    raise ValueError("Kích thước video vượt quá giới hạn 300MB.")
-                tmp.write(chunk)
-        return tmp.name
 
-    return await asyncio.to_thread(_download_sync)
+async def _fetch_video(video_url: str) -> Tuple[Union[BinaryIO, PartialVideo], str]:
+    """
+    Lấy video từ URL để phân loại một clip: với MP4 lớn trên server hỗ trợ Range
+    chỉ tải index + các GOP chứa frames cần lấy (`remote_video.PartialVideo`),
+    các trường hợp còn lại tải toàn bộ như `_download_video`.
+    Trả về (nguồn video cho preprocess_video, khoá nội dung cho cache).
+    """
+    if RANGE_FETCH:
+        started = time.perf_counter()
+        try:
+            partial = await fetch_partial_video(
+                _get_fetcher(), video_url, min_size=int(RANGE_MIN_MB * 1024 * 1024)
+            )
+        except RangeFetchUnavailable:
+            pass
+        else:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="download_range")
+            BYTES_RECEIVED.inc(partial.fetched_bytes, source="url_range")
+            # Frames được lấy theo index của container nên tách không gian khoá với sha256 cả file
+            return partial, f"range:{partial.content_key}"
+    return await _download_video(video_url)
 
 
-async def _save_upload_file(upload: UploadFile) -> str:
+async def _read_upload_file(upload: UploadFile, detach: bool = False) -> Tuple[BinaryIO, str]:
     """
-    Lưu file upload về đĩa để inference.
+    Kiểm tra kích thước + tính sha256 của file upload, rồi trả lại chính file
+    upload (đã seek về đầu) để decode trực tiếp, không copy sang file tạm.
+
+    Với `detach=True` nội dung được chép sang buffer riêng (trong bộ nhớ, tràn ra
+    đĩa khi lớn hơn SPOOL_MAX_MB) để dùng tiếp sau khi request đã trả response
+    (streaming), lúc FastAPI có thể đã đóng file upload.
     """
-    suffix = Path(upload.filename or "upload.mp4").suffix or ".mp4"
     total_bytes = 0
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    digest = hashlib.sha256()
+    buffer = tempfile.SpooledTemporaryFile(max_size=int(SPOOL_MAX_MB * 1024 * 1024)) if detach else None
+    started = time.perf_counter()
     try:
         while True:
             chunk = await upload.read(CHUNK_SIZE)
@@ -74,42 +156,476 @@ async def _save_upload_file(upload: UploadFile) -> str:
             total_bytes += len(chunk)
             if total_bytes > MAX_FILE_SIZE_MB * 1024 * 1024:
                 raise ValueError("Kích thước video vượt quá giới hạn 300MB.")
-            tmp.write(chunk)
+            digest.update(chunk)
+            if buffer is not None:
+                buffer.write(chunk)
+    except BaseException:
+        _close_buffer(buffer)
+        raise
     finally:
-        tmp.close()
         await upload.seek(0)
-    return tmp.name
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="upload_read")
+    BYTES_RECEIVED.inc(total_bytes, source="upload")
+    if buffer is not None:
+        buffer.seek(0)
+        return buffer, digest.hexdigest()
+    return upload.file, digest.hexdigest()
+
+
+def _get_fetcher() -> VideoFetcher:
+    fetcher = getattr(app.state, "fetcher", None)
+    if fetcher is None:
+        fetcher = VideoFetcher(
+            max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+            connect_timeout=HTTP_CONNECT_TIMEOUT_S,
+            read_timeout=HTTP_READ_TIMEOUT_S,
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_per_host=HTTP_MAX_PER_HOST,
+            chunk_size=CHUNK_SIZE,
+        )
+        app.state.fetcher = fetcher
+    return fetcher
+
+
+def _get_pool() -> InferencePool:
+    pool = getattr(app.state, "pool", None)
+    if pool is None:
+        pool = InferencePool(
+            max_workers=INFERENCE_WORKERS,
+            max_pending=MAX_PENDING_REQUESTS,
+            retry_after_s=RETRY_AFTER_S,
+        )
+        app.state.pool = pool
+    return pool
+
+
+def _observe_batch(batch_size: int, forward_s: float) -> None:
+    BATCH_SIZE.observe(batch_size)
+    STAGE_SECONDS.observe(forward_s, stage="forward")
+
+
+def _observe_cheap_batch(batch_size: int, forward_s: float) -> None:
+    STAGE_SECONDS.observe(forward_s, stage="forward_cheap")
+
+
+def _inflight_counts() -> dict:
+    pool = getattr(app.state, "pool", None)
+    batcher = getattr(app.state, "batcher", None)
+    return {
+        ("admitted",): pool.stats()["pending"] if pool is not None else 0,
+        ("batch_queue",): batcher.stats()["queued"] if batcher is not None else 0,
+    }
+
+
+INFLIGHT.set_function(_inflight_counts)
+
+
+async def _prepare_model(processor, model, num_frames: int = 16, suffix: str = ""):
+    """
+    Compile (VIDEOMAE_COMPILE) cho các batch size mà batcher có thể tạo ra rồi chạy
+    warmup (VIDEOMAE_WARMUP_STEPS forward cho mỗi batch size) trước khi nhận request.
+    `suffix` phân biệt model rẻ của cascade trong metric và `/health` (vd. "_cheap").
+    """
+    from model_warmup import compile_model, input_shape, warmup
+
+    clip_shape = input_shape(processor, num_frames)
+    batch_sizes = list(range(1, MAX_BATCH_SIZE + 1))
+    started = time.perf_counter()
+    model = await asyncio.to_thread(compile_model, model, COMPILE_MODE, clip_shape, batch_sizes)
+    compile_s = time.perf_counter() - started
+    # torch.compile chỉ tạo graph ở lần gọi đầu nên cần ít nhất một lượt warmup
+    steps = max(WARMUP_STEPS, 1) if COMPILE_MODE != "none" else WARMUP_STEPS
+    warmup_s = await asyncio.to_thread(warmup, model, clip_shape, batch_sizes, steps)
+    if COMPILE_MODE != "none":
+        STAGE_SECONDS.observe(compile_s, stage=f"compile{suffix}")
+    if warmup_s is not None:
+        STAGE_SECONDS.observe(warmup_s, stage=f"warmup{suffix}")
+    setattr(app.state, f"warmup{suffix}", {
+        "compile": COMPILE_MODE,
+        "compile_s": round(compile_s, 3),
+        "warmup_steps": steps,
+        "warmup_s": round(warmup_s, 3) if warmup_s is not None else None,
+    })
+    return model
+
+
+def _import_inference_service():
+    """Import các module nặng (torch, transformers, PyAV, OpenCV) và đo thời gian import."""
+    started = time.perf_counter()
+    import inference_service
+
+    return inference_service, time.perf_counter() - started
+
+
+async def _load_components() -> None:
+    """
+    Load model và dựng mọi thành phần phục vụ (cache, index near-duplicate, batcher).
+    Chỉ gọi khi giữ `load_lock`; `app.state.ready` được bật sau cùng, khi tất cả đã sẵn sàng.
+    """
+    service, import_s = await asyncio.to_thread(_import_inference_service)
+    STAGE_SECONDS.observe(import_s, stage="import")
+    started = time.perf_counter()
+    processor, model = await asyncio.to_thread(service.load_inference_components)
+    load_s = time.perf_counter() - started
+    STAGE_SECONDS.observe(load_s, stage="model_load")
+    # /embed cần encoder PyTorch gốc (model compile/ONNX chỉ trả logits)
+    embedding_model = model if hasattr(model, "videomae") else None
+    model = await _prepare_model(processor, model)
+    fingerprint = await asyncio.to_thread(model_fingerprint, service.DEFAULT_MODEL_PATH)
+    # Logits của hai backend chỉ gần bằng nhau nên không dùng chung kết quả cache
+    fingerprint = f"{fingerprint}-{service.BACKEND}"
+    cascade = None
+    if CASCADE_MODEL_PATH:
+        cascade = await _load_cascade(service, processor, model)
+        cheap_fingerprint = await asyncio.to_thread(model_fingerprint, CASCADE_MODEL_PATH)
+        fingerprint = f"{fingerprint}-cascade-{cheap_fingerprint}-{CASCADE_THRESHOLD:g}"
+    if getattr(app.state, "cache", None) is None:
+        app.state.cache = PredictionCache(
+            max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+            db_path=CACHE_DB_PATH,
+        )
+    if DEDUP_MAX_ITEMS > 0 and getattr(app.state, "dedup", None) is None:
+        from near_duplicate import NearDuplicateIndex
+
+        app.state.dedup = await asyncio.to_thread(
+            NearDuplicateIndex,
+            max_items=DEDUP_MAX_ITEMS,
+            max_distance=DEDUP_MAX_DISTANCE,
+            path=DEDUP_PATH,
+            model_fingerprint=fingerprint,
+        )
+    if getattr(app.state, "batcher", None) is None:
+        app.state.batcher = MicroBatcher(
+            lambda pixel_values: service.predict_batch(pixel_values, model),
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=MAX_BATCH_WAIT_MS,
+            on_batch=_observe_batch,
+        )
+        await app.state.batcher.start()
+    if cascade is not None and getattr(app.state, "cheap_batcher", None) is None:
+        app.state.cheap_batcher = MicroBatcher(
+            lambda pixel_values: service.predict_batch(pixel_values, cascade.cheap.model),
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=MAX_BATCH_WAIT_MS,
+            on_batch=_observe_cheap_batch,
+        )
+        await app.state.cheap_batcher.start()
+    app.state.embedding_model = embedding_model
+    app.state.cascade = cascade
+    app.state.processor = processor
+    app.state.model = model
+    app.state.model_fingerprint = fingerprint
+    app.state.backend = service.BACKEND
+    app.state.startup.update(import_s=round(import_s, 3), model_load_s=round(load_s, 3))
+    app.state.ready = True
+
+
+async def _load_cascade(service, processor, model):
+    """Load model rẻ (VIDEOMAE_CASCADE_MODEL_PATH) và ghép với model đầy đủ thành cascade."""
+    from cascade import Cascade, CascadeStage, same_input, stage_num_frames
+
+    cheap_processor, cheap_model = await asyncio.to_thread(service.load_inference_components, CASCADE_MODEL_PATH)
+    cheap_frames = stage_num_frames(CASCADE_MODEL_PATH)
+    # Model rẻ chạy trên mọi request nên cũng cần compile + warmup như model chính
+    cheap_model = await _prepare_model(cheap_processor, cheap_model, cheap_frames, suffix="_cheap")
+    return Cascade(
+        CascadeStage(cheap_processor, cheap_model, cheap_frames),
+        CascadeStage(processor, model, stage_num_frames(service.DEFAULT_MODEL_PATH)),
+        threshold=CASCADE_THRESHOLD,
+        shared_input=same_input(CASCADE_MODEL_PATH, service.DEFAULT_MODEL_PATH),
+    )
 
 
 async def _ensure_components_loaded():
     """
-    Đảm bảo processor + model đã được load (dùng cho startup và lazy-load).
+    Đảm bảo model và các thành phần phục vụ đã sẵn sàng (dùng cho startup và lazy-load).
+    Các lời gọi đồng thời chờ chung một lần load dưới `load_lock`.
     """
-    processor = getattr(app.state, "processor", None)
-    model = getattr(app.state, "model", None)
-    if processor is None or model is None:
-        processor, model = await asyncio.to_thread(load_inference_components)
-        app.state.processor = processor
-        app.state.model = model
+    if getattr(app.state, "ready", False):
+        return
+    async with app.state.load_lock:
+        if getattr(app.state, "ready", False):
+            return
+        try:
+            await _load_components()
+        except Exception as exc:
+            app.state.load_error = str(exc)
+            raise
+        app.state.load_error = None
+        app.state.startup["ready_s"] = round(time.perf_counter() - app.state.startup_started, 3)
+
+
+async def _load_in_background() -> None:
+    try:
+        await _ensure_components_loaded()
+    except Exception:
+        # Lỗi được báo qua /ready; request tiếp theo sẽ thử load lại
+        pass
 
 
 @app.on_event("startup")
 async def startup_event():
-    await _ensure_components_loaded()
+    """
+    Không chờ load model: server nhận kết nối ngay, model được load nền.
+    Request đến sớm chờ lần load đó; orchestrator nên dùng `/ready` làm readiness probe.
+    """
+    app.state.load_lock = asyncio.Lock()
+    app.state.ready = False
+    app.state.load_error = None
+    app.state.startup_started = time.perf_counter()
+    app.state.startup = {}
+    app.state.load_task = asyncio.create_task(_load_in_background())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """
-    Giải phóng reference (Torch sẽ tự GC).
+    Dừng batcher, pool và giải phóng reference (Torch sẽ tự GC).
     """
+    app.state.ready = False
+    load_task = getattr(app.state, "load_task", None)
+    if load_task is not None and not load_task.done():
+        load_task.cancel()
+    for name in ("batcher", "cheap_batcher"):
+        batcher = getattr(app.state, name, None)
+        if batcher is not None:
+            await batcher.stop()
+    pool = getattr(app.state, "pool", None)
+    if pool is not None:
+        pool.shutdown()
+    segment_executor = getattr(app.state, "segment_executor", None)
+    if segment_executor is not None:
+        segment_executor.shutdown(wait=False, cancel_futures=True)
+    cache = getattr(app.state, "cache", None)
+    if cache is not None:
+        cache.close()
+    dedup = getattr(app.state, "dedup", None)
+    if dedup is not None:
+        dedup.save()
+    fetcher = getattr(app.state, "fetcher", None)
+    if fetcher is not None:
+        await fetcher.aclose()
+    app.state.fetcher = None
+    app.state.cache = None
+    app.state.dedup = None
+    app.state.batcher = None
+    app.state.cheap_batcher = None
+    app.state.cascade = None
+    app.state.pool = None
+    app.state.segment_executor = None
     app.state.processor = None
     app.state.model = None
+    app.state.embedding_model = None
+
+
+@app.middleware("http")
+async def _record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Dùng path template của route để tránh label không giới hạn (404, scan, ...)
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=str(status))
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Metrics dạng Prometheus: latency theo stage, bytes nhận, độ phân giải frame, hàng đợi, RSS.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _worker_memory() -> Optional[dict]:
+    """RSS/PSS của worker đang trả lời (mỗi worker uvicorn là một process riêng)."""
+    try:
+        usage = memory_usage()
+    except OSError:
+        return None
+    return {"pid": os.getpid(), **{f"{key}_bytes": value for key, value in usage.items()}}
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    batcher = getattr(app.state, "batcher", None)
+    pool = getattr(app.state, "pool", None)
+    cache = getattr(app.state, "cache", None)
+    dedup = getattr(app.state, "dedup", None)
+    cascade = getattr(app.state, "cascade", None)
+    return {
+        "status": "ok",
+        "backend": getattr(app.state, "backend", None),
+        "warmup": getattr(app.state, "warmup", None),
+        "warmup_cheap": getattr(app.state, "warmup_cheap", None),
+        "memory": _worker_memory(),
+        "batching": batcher.stats() if batcher is not None else None,
+        "pool": pool.stats() if pool is not None else None,
+        "cache": cache.stats() if cache is not None else None,
+        "near_duplicate": dedup.stats() if dedup is not None else None,
+        "cascade": cascade.stats() if cascade is not None else None,
+    }
+
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 khi model đã load, warmup xong và cache/batcher đã dựng; 503 khi đang load hoặc load lỗi.
+    `/health` chỉ là liveness probe, luôn trả ok khi process còn phục vụ được.
+    """
+    ready = getattr(app.state, "ready", False)
+    payload = {
+        "ready": ready,
+        "error": getattr(app.state, "load_error", None),
+        "startup": getattr(app.state, "startup", None),
+    }
+    return JSONResponse(payload, status_code=200 if ready else 503)
+
+
+def _to_http_error(exc: Exception) -> HTTPException:
+    """
+    Chuyển exception trong pipeline inference thành HTTPException tương ứng.
+    """
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, QueueFullError):
+        return HTTPException(
+            status_code=503,
+            detail=str(exc),
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    if isinstance(exc, ValueError):
+        return HTTPException(status_code=400, detail=str(exc))
+    if isinstance(exc, httpx.HTTPError):
+        return HTTPException(status_code=502, detail=f"Lỗi tải video: {exc}")
+    if isinstance(exc, FileNotFoundError):
+        return HTTPException(status_code=500, detail=str(exc))
+    return HTTPException(status_code=500, detail=f"Lỗi nội bộ: {exc}")
+
+
+def _find_duplicate(pixel_values) -> Tuple[object, Optional[Tuple[dict, int]]]:
+    """
+    Tính fingerprint frame của clip và tra index near-duplicate (chạy trên pool).
+    Trả về (fingerprint, (kết quả, khoảng cách Hamming) của video trùng hoặc None);
+    fingerprint là None khi clip quá ít chi tiết (frame đen / một màu) để tra hay thêm vào index.
+    """
+    import torch
+
+    from inference_service import format_prediction
+    from near_duplicate import frame_fingerprint, is_informative
+
+    clip = pixel_values.numpy()
+    if not is_informative(clip):
+        return None, None
+    fingerprint = frame_fingerprint(clip)
+    match = app.state.dedup.lookup(fingerprint)
+    if match is None:
+        return fingerprint, None
+    probs, distance = match
+    return fingerprint, (format_prediction(torch.from_numpy(probs)), distance)
+
+
+async def _run_cascade(cascade, inputs) -> Tuple[object, BatchInfo, str]:
+    """Chạy model rẻ; chuyển lên model đầy đủ khi độ tin cậy dưới ngưỡng. Trả về (probs, batch, stage)."""
+    probs, batch_info = await app.state.cheap_batcher.submit(inputs.cheap)
+    stage = "cheap"
+    if not cascade.accept(probs):
+        pixel_values = await app.state.pool.run(inputs.full)
+        probs, batch_info = await app.state.batcher.submit(pixel_values)
+        stage = "full"
+    cascade.record(stage)
+    CASCADE_STAGE.inc(stage=stage)
+    return probs, batch_info, stage
+
+
+async def _cache_get(key: str) -> Optional[dict]:
+    """Tra cache; tầng SQLite (nếu bật) chạy trên thread để không chặn event loop."""
+    cache = app.state.cache
+    if cache.has_disk:
+        return await asyncio.to_thread(cache.get, key)
+    return cache.get(key)
+
+
+async def _cache_put(key: str, result: dict) -> None:
+    cache = app.state.cache
+    if cache.has_disk:
+        await asyncio.to_thread(cache.put, key, result)
+    else:
+        cache.put(key, result)
+
+
+async def _classify(video_source: Union[BinaryIO, PartialVideo], content_hash: str) -> Tuple[dict, bool, Optional[BatchInfo]]:
+    """
+    Tra cache theo nội dung, nếu miss thì decode + preprocess trên pool, tra index
+    near-duplicate (nếu bật) rồi mới đưa vào batcher.
+    Trả về (kết quả, cache_hit, thông tin batch).
+    """
+    key = cache_key(content_hash, app.state.model_fingerprint)
+    result = await _cache_get(key)
+    if result is not None:
+        CACHE_LOOKUPS.inc(result="hit")
+        return result, True, None
+    CACHE_LOOKUPS.inc(result="miss")
+    from inference_service import format_prediction, preprocess_video
+
+    stats: dict = {}
+    cascade = getattr(app.state, "cascade", None)
+    if cascade is not None:
+        # Decode một lần; input của model đầy đủ chỉ được tạo khi cần chuyển stage
+        inputs = await app.state.pool.run(cascade.prepare, video_source, stats=stats)
+        pixel_values = inputs.cheap
+    else:
+        inputs = None
+        pixel_values = await app.state.pool.run(preprocess_video, video_source, app.state.processor, stats=stats)
+    STAGE_SECONDS.observe(stats["decode_s"], stage="decode")
+    STAGE_SECONDS.observe(stats["preprocess_s"], stage="preprocess")
+    if "source_height" in stats:
+        FRAME_HEIGHT.observe(stats["source_height"])
+        FRAME_WIDTH.observe(stats["source_width"])
+    dedup = getattr(app.state, "dedup", None)
+    if dedup is not None:
+        fingerprint, duplicate = await app.state.pool.run(_find_duplicate, pixel_values)
+        if fingerprint is None:
+            DEDUP_LOOKUPS.inc(result="skipped")
+        else:
+            DEDUP_LOOKUPS.inc(result="hit" if duplicate is not None else "miss")
+        if duplicate is not None:
+            result, distance = duplicate
+            # Không ghi vào cache theo nội dung: nhãn mượn từ video khác không được thành kết quả
+            # vĩnh viễn của file này (kết quả chỉ được cache khi chính model chạy trên nó)
+            return dict(result, near_duplicate={"distance": distance}), True, None
+    if inputs is not None:
+        probs, batch_info, stage = await _run_cascade(cascade, inputs)
+    else:
+        probs, batch_info = await app.state.batcher.submit(pixel_values)
+        stage = None
+    STAGE_SECONDS.observe(batch_info.queue_ms / 1000.0, stage="queue")
+    result = format_prediction(probs)
+    if stage is not None:
+        result["cascade_stage"] = stage
+    await _cache_put(key, result)
+    if dedup is not None and fingerprint is not None:
+        await app.state.pool.run(dedup.add, fingerprint, probs.numpy())
+    return result, False, batch_info
+
+
+def _prediction_payload(result: dict, cache_hit: bool, batch_info: Optional[BatchInfo]) -> dict:
+    return {
+        "label": result["label_name"],
+        "label_index": result["label_index"],
+        "confidence": result["confidence"],
+        "probabilities": result["probabilities"],
+        "cache_hit": cache_hit,
+        "near_duplicate": result.get("near_duplicate"),
+        "cascade_stage": result.get("cascade_stage"),
+        "batch_size": batch_info.batch_size if batch_info else None,
+        "queue_ms": round(batch_info.queue_ms, 3) if batch_info else None,
+    }
 
 
 @app.post("/predict")
@@ -125,36 +641,346 @@ async def predict_endpoint(
     if video_url and video_file:
         raise HTTPException(status_code=400, detail="Chỉ chọn một trong video_url hoặc video_file.")
 
-    temp_path = None
+    buffer = None
     try:
-        await _ensure_components_loaded()
-        if video_url:
-            temp_path = await _download_video(video_url)
-        else:
-            assert video_file is not None
-            temp_path = await _save_upload_file(video_file)
+        async with _get_pool().admit():
+            await _ensure_components_loaded()
+            if video_url:
+                buffer, content_hash = await _fetch_video(video_url)
+                video_source = buffer
+            else:
+                assert video_file is not None
+                video_source, content_hash = await _read_upload_file(video_file)
+
+            result, cache_hit, batch_info = await _classify(video_source, content_hash)
+        payload = _prediction_payload(result, cache_hit, batch_info)
+        payload["source"] = "url" if video_url else "upload"
+        return JSONResponse(payload)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise _to_http_error(exc) from exc
+    finally:
+        _close_buffer(buffer)
+
+
+def _embed_clip(pixel_values) -> Tuple[list, object, Optional[Tuple[dict, int]]]:
+    """Embedding đã pool + fingerprint frame (+ video trùng nếu bật index) của một clip."""
+    from inference_service import embed_batch
+    from near_duplicate import frame_fingerprint
+
+    embedding = embed_batch(pixel_values, app.state.embedding_model)[0]
+    fingerprint, duplicate = None, None
+    if getattr(app.state, "dedup", None) is not None:
+        fingerprint, duplicate = _find_duplicate(pixel_values)
+    if fingerprint is None:
+        fingerprint = frame_fingerprint(pixel_values.numpy())
+    return embedding.tolist(), fingerprint, duplicate
+
+
+@app.post("/embed")
+async def embed_endpoint(
+    video_url: Optional[str] = Form(default=None),
+    video_file: Optional[UploadFile] = File(default=None),
+):
+    """
+    Trả về embedding đã pool của encoder VideoMAE (đầu vào của head phân loại) và
+    fingerprint frame của video; kèm kết quả đã biết nếu video gần trùng một video cũ.
+    """
+    if not video_url and not video_file:
+        raise HTTPException(status_code=400, detail="Cần truyền video_url hoặc video_file.")
+    if video_url and video_file:
+        raise HTTPException(status_code=400, detail="Chỉ chọn một trong video_url hoặc video_file.")
+
+    buffer = None
+    try:
+        async with _get_pool().admit():
+            await _ensure_components_loaded()
+            if app.state.embedding_model is None:
+                raise HTTPException(status_code=501, detail=f"Backend {app.state.backend} không hỗ trợ /embed.")
+            if video_url:
+                buffer, _ = await _fetch_video(video_url)
+                video_source = buffer
+            else:
+                assert video_file is not None
+                video_source, _ = await _read_upload_file(video_file)
 
-        result = predict_from_path(temp_path, app.state.processor, app.state.model)
-        return JSONResponse(
-            {
+            from inference_service import preprocess_video
+
+            pixel_values = await app.state.pool.run(preprocess_video, video_source, app.state.processor)
+            started = time.perf_counter()
+            embedding, fingerprint, duplicate = await app.state.pool.run(_embed_clip, pixel_values)
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="embed")
+        payload = {
+            "dim": len(embedding),
+            "embedding": embedding,
+            "fingerprint": fingerprint.tobytes().hex(),
+            "near_duplicate": None,
+        }
+        if duplicate is not None:
+            result, distance = duplicate
+            payload["near_duplicate"] = {
+                "distance": distance,
                 "label": result["label_name"],
                 "label_index": result["label_index"],
-                "confidence": result["confidence"],
-                "probabilities": result["probabilities"],
-                "source": "url" if video_url else "upload",
             }
+        return JSONResponse(payload)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise _to_http_error(exc) from exc
+    finally:
+        _close_buffer(buffer)
+
+
+async def _classify_batch_item(index: int, video_url: Optional[str], video_file: Optional[UploadFile]) -> dict:
+    """
+    Xử lý một phần tử của /predict/batch; lỗi được trả về theo từng phần tử thay vì ném ra.
+    """
+    item: dict = {"index": index}
+    if video_url:
+        item.update(source="url", video_url=video_url)
+    else:
+        assert video_file is not None
+        item.update(source="upload", filename=video_file.filename)
+
+    buffer = None
+    try:
+        if video_url:
+            buffer, content_hash = await _fetch_video(video_url)
+            video_source = buffer
+        else:
+            video_source, content_hash = await _read_upload_file(video_file)
+        result, cache_hit, batch_info = await _classify(video_source, content_hash)
+        item.update(ok=True, **_prediction_payload(result, cache_hit, batch_info))
+    except Exception as exc:
+        error = _to_http_error(exc)
+        item.update(ok=False, status_code=error.status_code, error=error.detail)
+    finally:
+        _close_buffer(buffer)
+    return item
+
+
+@app.post("/predict/batch")
+async def predict_batch_endpoint(
+    video_urls: List[str] = Form(default=[]),
+    video_files: List[UploadFile] = File(default=[]),
+):
+    """
+    Phân loại nhiều video trong một request (danh sách video_urls và/hoặc nhiều video_files).
+    Các video được tải + decode song song và đi qua model theo batch; kết quả/lỗi trả về theo từng phần tử.
+    """
+    urls = [url for url in video_urls if url]
+    files = [f for f in video_files if f is not None and f.filename]
+    total = len(urls) + len(files)
+    if total == 0:
+        raise HTTPException(status_code=400, detail="Cần truyền ít nhất một video_urls hoặc video_files.")
+    if total > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tối đa {MAX_BATCH_ITEMS} video mỗi request (nhận {total}).",
         )
+
+    try:
+        async with _get_pool().admit(slots=total):
+            await _ensure_components_loaded()
+            tasks = [_classify_batch_item(i, url, None) for i, url in enumerate(urls)]
+            tasks += [_classify_batch_item(len(urls) + i, None, f) for i, f in enumerate(files)]
+            results = await asyncio.gather(*tasks)
     except HTTPException:
         raise
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-    except requests.RequestException as exc:
-        raise HTTPException(status_code=502, detail=f"Lỗi tải video: {exc}") from exc
-    except FileNotFoundError as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
-    except Exception as exc:  # pragma: no cover
-        raise HTTPException(status_code=500, detail=f"Lỗi nội bộ: {exc}") from exc
+    except Exception as exc:
+        raise _to_http_error(exc) from exc
+
+    succeeded = sum(1 for item in results if item["ok"])
+    return JSONResponse(
+        {
+            "count": total,
+            "succeeded": succeeded,
+            "failed": total - succeeded,
+            "results": results,
+        }
+    )
+
+
+class _SegmentStream:
+    """
+    Một stream /predict/segments: producer decode + preprocess các đoạn trên executor
+    riêng (không chiếm thread của pool dùng chung) và đẩy vào hàng đợi giới hạn.
+    `close()` dừng producer rồi giải phóng slot admission + buffer; gọi được nhiều lần.
+    """
+
+    def __init__(self, video_source: BinaryIO, window_seconds: float, resources: AsyncExitStack) -> None:
+        self.video_source = video_source
+        self.window_seconds = window_seconds
+        self.resources = resources
+        # Hàng đợi giới hạn: decode tạm dừng khi model/client chậm hơn
+        self.segments: asyncio.Queue = asyncio.Queue(maxsize=SEGMENT_PREFETCH)
+        self.stop = threading.Event()
+        self.pending: deque = deque()
+        self.producer: Optional[asyncio.Future] = None
+        self._closed = False
+
+    def start(self) -> None:
+        from inference_service import iter_video_segments
+
+        loop = asyncio.get_running_loop()
+
+        def _put(item) -> None:
+            asyncio.run_coroutine_threadsafe(self.segments.put(item), loop).result()
+
+        def _produce() -> None:
+            try:
+                if self.stop.is_set():
+                    # Stream đã đóng trong lúc chờ executor
+                    return
+                for segment in iter_video_segments(self.video_source, app.state.processor, self.window_seconds):
+                    if self.stop.is_set():
+                        break
+                    _put(segment)
+            except Exception as exc:
+                _put(exc)
+            finally:
+                _put(None)
+
+        self.producer = loop.run_in_executor(_get_segment_executor(), _produce)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.stop.set()
+        for _, _, _, task in self.pending:
+            task.cancel()
+        # Giải phóng producer nếu nó đang chờ chỗ trống trong hàng đợi
+        while self.producer is not None and not self.producer.done():
+            try:
+                self.segments.get_nowait()
+            except asyncio.QueueEmpty:
+                await asyncio.sleep(0.01)
+        await self.resources.aclose()
+
+
+class _SegmentStreamingResponse(StreamingResponse):
+    """StreamingResponse luôn đóng stream khi kết thúc, kể cả khi client ngắt trước khi đọc body."""
+
+    def __init__(self, stream: _SegmentStream, **kwargs) -> None:
+        super().__init__(_stream_segments(stream), **kwargs)
+        self.stream = stream
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.stream.close()
+
+
+def _get_segment_executor() -> ThreadPoolExecutor:
+    executor = getattr(app.state, "segment_executor", None)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=SEGMENT_STREAMS, thread_name_prefix="segments")
+        app.state.segment_executor = executor
+    return executor
+
+
+async def _stream_segments(stream: _SegmentStream) -> AsyncIterator[bytes]:
+    """
+    Đưa từng đoạn đã preprocess vào batcher và trả về NDJSON theo thứ tự thời gian
+    ngay khi mỗi đoạn có kết quả.
+    """
+    from inference_service import format_prediction
+
+    count = 0
+    prob_sums: dict = {}
+    pending = stream.pending
+
+    def _line(index: int, start: float, end: float, probs) -> bytes:
+        result = format_prediction(probs)
+        for name, value in result["probabilities"].items():
+            prob_sums[name] = prob_sums.get(name, 0.0) + value
+        payload = {
+            "segment": index,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "label": result["label_name"],
+            "label_index": result["label_index"],
+            "confidence": result["confidence"],
+            "probabilities": result["probabilities"],
+        }
+        return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+    stream.start()
+    try:
+        while True:
+            item = await stream.segments.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            start, end, pixel_values = item
+            pending.append((count, start, end, asyncio.ensure_future(app.state.batcher.submit(pixel_values))))
+            count += 1
+            while pending and pending[0][3].done():
+                index, seg_start, seg_end, task = pending.popleft()
+                probs, _ = task.result()
+                yield _line(index, seg_start, seg_end, probs)
+        while pending:
+            index, seg_start, seg_end, task = pending.popleft()
+            probs, _ = await task
+            yield _line(index, seg_start, seg_end, probs)
+
+        summary: dict = {"done": True, "segments": count}
+        if count:
+            summary["mean_probabilities"] = {name: total / count for name, total in prob_sums.items()}
+        yield (json.dumps(summary, ensure_ascii=False) + "\n").encode("utf-8")
+    except Exception as exc:
+        # Header đã gửi đi nên lỗi được báo bằng một dòng NDJSON cuối cùng
+        error = _to_http_error(exc)
+        yield (json.dumps({"done": False, "error": error.detail}, ensure_ascii=False) + "\n").encode("utf-8")
     finally:
-        _cleanup_file(temp_path)
+        await stream.close()
+
 
+@app.post("/predict/segments")
+async def predict_segments_endpoint(
+    video_url: Optional[str] = Form(default=None),
+    video_file: Optional[UploadFile] = File(default=None),
+    window_seconds: float = Form(default=4.0),
+):
+    """
+    Suy luận theo cửa sổ trượt cho video dài: chia video thành các đoạn `window_seconds`
+    giây và stream timeline nhãn/xác suất từng đoạn dạng NDJSON (application/x-ndjson).
+    """
+    if not video_url and not video_file:
+        raise HTTPException(status_code=400, detail="Cần truyền video_url hoặc video_file.")
+    if video_url and video_file:
+        raise HTTPException(status_code=400, detail="Chỉ chọn một trong video_url hoặc video_file.")
+    if not 0 < window_seconds <= MAX_SEGMENT_WINDOW_S:
+        raise HTTPException(
+            status_code=400,
+            detail=f"window_seconds phải trong khoảng (0, {MAX_SEGMENT_WINDOW_S:g}].",
+        )
+
+    # Slot admission + buffer được giữ tới khi stream kết thúc (giải phóng bởi _SegmentStream.close)
+    resources = AsyncExitStack()
+    try:
+        await resources.enter_async_context(_get_pool().admit())
+        await _ensure_components_loaded()
+        if video_url:
+            buffer, _ = await _download_video(video_url)
+        else:
+            assert video_file is not None
+            buffer, _ = await _read_upload_file(video_file, detach=True)
+        resources.callback(_close_buffer, buffer)
+    except HTTPException:
+        await resources.aclose()
+        raise
+    except Exception as exc:
+        await resources.aclose()
+        raise _to_http_error(exc) from exc
 
+    return _SegmentStreamingResponse(
+        _SegmentStream(buffer, window_seconds, resources),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,163 @@
+"""
+Micro-batching cho inference: gom pixel_values từ nhiều request đồng thời
+thành một forward pass duy nhất.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+
+@dataclass
+class BatchInfo:
+    """Thông tin batch mà một request đã được xếp vào."""
+
+    batch_size: int
+    queue_ms: float
+
+
+@dataclass
+class _PendingItem:
+    pixel_values: torch.Tensor
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """
+    Scheduler gom request theo batch với thời gian chờ giới hạn.
+
+    Mỗi request gọi `submit(pixel_values)` với tensor shape (1, T, C, H, W).
+    Worker nền lấy request đầu tiên trong hàng đợi, chờ thêm tối đa
+    `max_wait_ms` (hoặc tới khi đủ `max_batch_size`), ghép các tensor cùng shape
+    rồi chạy `run_batch` một lần và trả lại từng hàng xác suất cho request tương ứng.
+    Forward pass chạy trên một thread riêng để không chặn event loop.
+    `on_batch(batch_size, forward_seconds)` (tuỳ chọn) được gọi sau mỗi forward pass.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[torch.Tensor], torch.Tensor],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        on_batch: Optional[Callable[[int, float], None]] = None,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size phải >= 1.")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.on_batch = on_batch
+        self._queue: Optional[asyncio.Queue[_PendingItem]] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._batches = 0
+        self._items = 0
+        self._queue_ms_total = 0.0
+        self._last_batch_size = 0
+
+    async def start(self) -> None:
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="videomae-forward")
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("Batcher đã dừng."))
+            self._queue = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def submit(self, pixel_values: torch.Tensor) -> Tuple[torch.Tensor, BatchInfo]:
+        """
+        Đưa một clip vào hàng đợi, chờ kết quả xác suất (num_labels,) và thông tin batch.
+        """
+        if self._queue is None:
+            await self.start()
+        assert self._queue is not None
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingItem(pixel_values=pixel_values, future=future))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": (self._items / self._batches) if self._batches else 0.0,
+            "avg_queue_ms": (self._queue_ms_total / self._items) if self._items else 0.0,
+            "last_batch_size": self._last_batch_size,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    async def _collect(self) -> List[_PendingItem]:
+        assert self._queue is not None
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Chỉ ghép được các clip cùng shape (T, C, H, W)
+            groups: dict = {}
+            for item in batch:
+                groups.setdefault(tuple(item.pixel_values.shape[1:]), []).append(item)
+            for items in groups.values():
+                await self._run_group(items)
+
+    async def _run_group(self, items: List[_PendingItem]) -> None:
+        # Import lười: batcher chỉ chạy sau khi model (và torch) đã được load
+        import torch
+
+        started = time.perf_counter()
+        try:
+            stacked = torch.cat([item.pixel_values for item in items], dim=0)
+            loop = asyncio.get_running_loop()
+            probs = await loop.run_in_executor(self._executor, self.run_batch, stacked)
+        except Exception as exc:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+
+        forward_s = time.perf_counter() - started
+        self._batches += 1
+        self._last_batch_size = len(items)
+        if self.on_batch is not None:
+            self.on_batch(len(items), forward_s)
+        for row, item in enumerate(items):
+            queue_ms = (started - item.enqueued_at) * 1000.0
+            self._items += 1
+            self._queue_ms_total += queue_ms
+            if not item.future.done():
+                item.future.set_result(
+                    (probs[row], BatchInfo(batch_size=len(items), queue_ms=queue_ms))
+                )
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark so sánh các cách lấy frames của extract_frames.load_video
+trên video ngắn và video dài (GOP dài).
+
+Cách dùng:
+    python bench_load_video.py                 # tự tạo video tổng hợp trong thư mục tạm
+    python bench_load_video.py video1.mp4 ...  # chạy trên video có sẵn
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import av
+import numpy as np
+
+from extract_frames import SAMPLING_STRATEGIES, load_video
+
+
+def make_synthetic_video(path, seconds, fps=30, gop=250, width=640, height=360):
+    """Tạo video tổng hợp với GOP cố định để mô phỏng video dài."""
+    container = av.open(path, mode="w")
+    try:
+        codec = "libx264" if "libx264" in av.codecs_available else "mpeg4"
+        stream = container.add_stream(codec, rate=fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = gop
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+        for i in range(int(seconds * fps)):
+            # Dịch ảnh nền theo thời gian để encoder không nén quá mức
+            img = np.roll(base, shift=i * 4, axis=1)
+            frame = av.VideoFrame.from_ndarray(img, format="rgb24")
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    finally:
+        container.close()
+    return path
+
+
+def bench(path, strategies, repeat):
+    results = {}
+    for strategy in strategies:
+        timings = []
+        shape = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            frames = load_video(path, 16, strategy=strategy)
+            timings.append(time.perf_counter() - start)
+            shape = frames.shape
+        results[strategy] = (min(timings), float(np.median(timings)), shape)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="*", help="Video cần benchmark (mặc định: tạo video tổng hợp)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi strategy")
+    parser.add_argument("--short-seconds", type=float, default=5)
+    parser.add_argument("--long-seconds", type=float, default=120)
+    parser.add_argument("--gop", type=int, default=250, help="GOP của video tổng hợp")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        videos = list(args.videos)
+        if not videos:
+            print("Đang tạo video tổng hợp...")
+            videos = [
+                make_synthetic_video(os.path.join(tmpdir, "short.mp4"), args.short_seconds, gop=args.gop),
+                make_synthetic_video(os.path.join(tmpdir, "long.mp4"), args.long_seconds, gop=args.gop),
+            ]
+
+        for path in videos:
+            print("\n" + "=" * 60)
+            print(f"Video: {path}")
+            print("=" * 60)
+            results = bench(path, SAMPLING_STRATEGIES, args.repeat)
+            baseline = results["seek"][1]
+            print(f"{'strategy':<12}{'min (ms)':>12}{'median (ms)':>14}{'vs seek':>10}  shape")
+            for strategy, (best, median, shape) in results.items():
+                print(f"{strategy:<12}{best * 1000:>12.1f}{median * 1000:>14.1f}{baseline / median:>9.2f}x  {shape}")
+
+
+if __name__ == "__main__":
+    main()
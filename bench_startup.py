@@ -0,0 +1,121 @@
+"""
+Đo thời gian cold start của service: import app, process start -> liveness (/health),
+-> readiness (/ready) và -> kết quả /predict đầu tiên (time-to-first-prediction).
+
+Mỗi lần chạy khởi động một process uvicorn mới (cache kết quả tắt để request
+thực sự chạy model).
+
+Cách dùng:
+    python bench_startup.py demo.mp4
+    python bench_startup.py demo.mp4 --runs 5 --wait-ready
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+
+def measure_import(python):
+    """Thời gian `import app` trong một interpreter mới (giây)."""
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    output = subprocess.run([python, "-c", code], check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(client, url, deadline, expect_status=200):
+    while time.perf_counter() < deadline:
+        try:
+            response = client.get(url)
+            if response.status_code == expect_status:
+                return response
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"Hết thời gian chờ {url}")
+
+
+def run_once(python, video, timeout, wait_ready, steady_requests):
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, VIDEOMAE_CACHE_MAX_MB="0", VIDEOMAE_CACHE_DB="")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [python, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = started + timeout
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            _wait_for(client, f"{base}/health", deadline)
+            live_s = time.perf_counter() - started
+            if wait_ready:
+                _wait_for(client, f"{base}/ready", deadline)
+
+            with open(video, "rb") as f:
+                response = client.post(f"{base}/predict", files={"video_file": (os.path.basename(video), f)})
+            response.raise_for_status()
+            first_prediction_s = time.perf_counter() - started
+
+            ready = _wait_for(client, f"{base}/ready", deadline).json()
+            steady = []
+            for _ in range(steady_requests):
+                with open(video, "rb") as f:
+                    request_started = time.perf_counter()
+                    client.post(f"{base}/predict", files={"video_file": (os.path.basename(video), f)}).raise_for_status()
+                    steady.append(time.perf_counter() - request_started)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        "live_s": live_s,
+        "first_prediction_s": first_prediction_s,
+        "startup": ready.get("startup") or {},
+        "steady_s": float(np.median(steady)) if steady else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", help="Video dùng cho request /predict")
+    parser.add_argument("--runs", type=int, default=3, help="Số lần khởi động lại service")
+    parser.add_argument("--timeout", type=float, default=600, help="Thời gian chờ tối đa mỗi lần (giây)")
+    parser.add_argument("--wait-ready", action="store_true", help="Chờ /ready trước khi gửi request đầu tiên")
+    parser.add_argument("--steady-requests", type=int, default=3, help="Số request đo latency ổn định")
+    args = parser.parse_args()
+
+    python = sys.executable
+    imports = [measure_import(python) for _ in range(args.runs)]
+    print(f"import app:                {np.median(imports):8.3f} s")
+
+    runs = [run_once(python, args.video, args.timeout, args.wait_ready, args.steady_requests) for _ in range(args.runs)]
+    print(f"start -> /health:          {np.median([r['live_s'] for r in runs]):8.3f} s")
+    for key, label in (
+        ("import_s", "import torch/transformers:"),
+        ("model_load_s", "load model:"),
+        ("ready_s", "startup -> /ready:"),
+    ):
+        values = [r["startup"][key] for r in runs if key in r["startup"]]
+        if values:
+            print(f"{label:<26} {np.median(values):8.3f} s")
+    print(f"start -> first prediction: {np.median([r['first_prediction_s'] for r in runs]):8.3f} s")
+    steady = [r["steady_s"] for r in runs if r["steady_s"] is not None]
+    if steady:
+        print(f"steady-state /predict:     {np.median(steady):8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Inference dạng cascade: một model rẻ (vd. INT8 từ `quantize_model.py`, hoặc model distill
+ít frame / độ phân giải thấp hơn) chạy trước; chỉ video có độ tin cậy thấp hơn ngưỡng
+mới được chạy lại bằng model đầy đủ.
+
+Video được decode một lần (số frame và độ phân giải của stage lớn hơn); mỗi stage lấy
+số frame của mình (`num_frames` trong config.json) và chạy processor riêng. Khi hai
+stage có cùng input (cùng preprocessor_config.json và số frame, như model INT8) thì
+pixel_values được dùng lại.
+
+Chọn ngưỡng trên một phần tập có nhãn sao cho accuracy giảm không quá `--max-accuracy-drop`
+so với chỉ dùng model đầy đủ, rồi báo cáo trên phần giữ lại (`--holdout-fraction`, `--seed`):
+
+    python cascade.py calibrate ./videomae_int8 ./videomae_finetuned_final --data-dir dataset
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from fast_preprocess import PROCESSOR_CONFIG_NAME
+from inference_service import (
+    apply_processor,
+    decode_size,
+    decode_video,
+    format_prediction,
+    load_inference_components,
+    predict_batch,
+)
+
+STAGES = ("cheap", "full")
+
+
+def stage_num_frames(model_path: str, default: int = 16) -> int:
+    """Số frame model nhận (`num_frames` trong config.json)."""
+    config_path = os.path.join(model_path, "config.json")
+    if not os.path.exists(config_path):
+        return default
+    with open(config_path, "r", encoding="utf-8") as f:
+        return int(json.load(f).get("num_frames", default))
+
+
+def same_input(cheap_path: str, full_path: str) -> bool:
+    """Hai model nhận cùng pixel_values: cùng số frame và cùng cấu hình processor."""
+    if stage_num_frames(cheap_path) != stage_num_frames(full_path):
+        return False
+    configs = []
+    for path in (cheap_path, full_path):
+        config_path = os.path.join(path, PROCESSOR_CONFIG_NAME)
+        if not os.path.exists(config_path):
+            return False
+        with open(config_path, "r", encoding="utf-8") as f:
+            configs.append(json.load(f))
+    return configs[0] == configs[1]
+
+
+def _subsample(frames: np.ndarray, num_frames: int) -> np.ndarray:
+    if len(frames) == num_frames:
+        return frames
+    indices = np.linspace(0, len(frames) - 1, num_frames).round().astype(int)
+    return frames[indices]
+
+
+@dataclass
+class CascadeStage:
+    processor: Any
+    model: Any
+    num_frames: int = 16
+
+
+@dataclass
+class CascadeInputs:
+    """Input của một video cho cả hai stage; input của stage đầy đủ chỉ được tạo khi cần."""
+
+    cheap: torch.Tensor
+    frames: Optional[np.ndarray] = None
+    full_stage: Optional[CascadeStage] = None
+    _full: Optional[torch.Tensor] = field(default=None, repr=False)
+
+    def full(self) -> torch.Tensor:
+        if self._full is None:
+            assert self.frames is not None and self.full_stage is not None
+            self._full = apply_processor(_subsample(self.frames, self.full_stage.num_frames), self.full_stage.processor)
+            self.frames = None
+        return self._full
+
+
+class Cascade:
+    """
+    Args:
+        cheap: stage chạy trước cho mọi video
+        full: stage chạy khi độ tin cậy của stage rẻ < `threshold`
+        threshold: độ tin cậy (xác suất lớn nhất) tối thiểu để nhận kết quả của stage rẻ
+        shared_input: hai stage dùng chung pixel_values (xem `same_input`)
+    """
+
+    def __init__(self, cheap: CascadeStage, full: CascadeStage, threshold: float = 0.95, shared_input: bool = False) -> None:
+        self.cheap = cheap
+        self.full = full
+        self.threshold = threshold
+        self.shared_input = shared_input
+        self.num_frames = max(cheap.num_frames, full.num_frames)
+        self._counts = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def prepare(self, video: Any, stats: Optional[Dict[str, float]] = None) -> CascadeInputs:
+        """Decode một lần ở độ phân giải của stage đầy đủ và tạo input cho stage rẻ."""
+        started = time.perf_counter()
+        frames = decode_video(video, self.num_frames, size=decode_size(self.full.processor), stats=stats)
+        decoded = time.perf_counter()
+        cheap = apply_processor(_subsample(frames, self.cheap.num_frames), self.cheap.processor)
+        if stats is not None:
+            stats["decode_s"] = decoded - started
+            stats["preprocess_s"] = time.perf_counter() - decoded
+        if self.shared_input:
+            return CascadeInputs(cheap=cheap, _full=cheap)
+        return CascadeInputs(cheap=cheap, frames=frames, full_stage=self.full)
+
+    def accept(self, probs: torch.Tensor) -> bool:
+        """Kết quả stage rẻ đủ tin cậy để trả về luôn."""
+        return float(probs.max()) >= self.threshold
+
+    def record(self, stage: str) -> None:
+        with self._lock:
+            self._counts[stage] += 1
+
+    def predict(self, video: Any) -> Dict[str, Any]:
+        """Phân loại một video (đồng bộ), kết quả có thêm `stage` đã trả lời."""
+        inputs = self.prepare(video)
+        probs = predict_batch(inputs.cheap, self.cheap.model)[0]
+        stage = "cheap"
+        if not self.accept(probs):
+            probs = predict_batch(inputs.full(), self.full.model)[0]
+            stage = "full"
+        self.record(stage)
+        return dict(format_prediction(probs), stage=stage)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            "threshold": self.threshold,
+            "shared_input": self.shared_input,
+            **counts,
+            "escalation_rate": counts["full"] / total if total else None,
+        }
+
+
+def load_cascade(cheap_path: str, full_path: str, threshold: float = 0.95, backend: Optional[str] = None) -> Cascade:
+    cheap_processor, cheap_model = load_inference_components(cheap_path, backend=backend)
+    full_processor, full_model = load_inference_components(full_path, backend=backend)
+    return Cascade(
+        CascadeStage(cheap_processor, cheap_model, stage_num_frames(cheap_path)),
+        CascadeStage(full_processor, full_model, stage_num_frames(full_path)),
+        threshold=threshold,
+        shared_input=same_input(cheap_path, full_path),
+    )
+
+
+def cascade_accuracy(confidence: np.ndarray, cheap_correct: np.ndarray, full_correct: np.ndarray, threshold: float) -> Tuple[float, float]:
+    """(accuracy, tỉ lệ chuyển lên stage đầy đủ) của cascade với `threshold`."""
+    accepted = confidence >= threshold
+    return float(np.where(accepted, cheap_correct, full_correct).mean()), float(1.0 - accepted.mean())
+
+
+def choose_threshold(
+    confidence: np.ndarray,
+    cheap_correct: np.ndarray,
+    full_correct: np.ndarray,
+    max_accuracy_drop: float = 0.01,
+) -> float:
+    """
+    Ngưỡng thấp nhất (ít video phải chạy model đầy đủ nhất) mà accuracy cascade không thấp
+    hơn accuracy của model đầy đủ quá `max_accuracy_drop`. Luôn tồn tại: ngưỡng lớn hơn mọi
+    độ tin cậy tương đương chỉ dùng model đầy đủ.
+    """
+    full_accuracy = float(full_correct.mean())
+    never = float(np.nextafter(max(1.0, float(confidence.max())), np.inf))
+    for threshold in sorted(set(confidence.tolist())):
+        accuracy, _ = cascade_accuracy(confidence, cheap_correct, full_correct, threshold)
+        if full_accuracy - accuracy <= max_accuracy_drop:
+            return float(threshold)
+    return never
+
+
+def calibrate(
+    cheap_path: str,
+    full_path: str,
+    data_dir: str = "dataset",
+    max_accuracy_drop: float = 0.01,
+    max_videos: Optional[int] = None,
+    holdout_fraction: float = 0.5,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    Chạy cả hai stage trên mọi video có nhãn, chia video thành tập hiệu chỉnh và tập
+    giữ lại (`stratified_split` theo nhãn với `seed`), chọn ngưỡng bằng `choose_threshold`
+    trên tập hiệu chỉnh rồi báo accuracy, tỉ lệ chuyển stage và latency trên tập giữ lại
+    (`holdout_fraction=0` = báo cáo trên chính tập hiệu chỉnh, lạc quan hơn thực tế).
+    """
+    from dataset_manifest import scan_videos, stratified_split
+
+    videos = scan_videos(data_dir)[:max_videos]
+    if not videos:
+        raise FileNotFoundError(f"Không tìm thấy video nào trong {data_dir}/positive hoặc {data_dir}/negative")
+    calib_entries, holdout_entries = stratified_split(
+        [{"path": path, "label": label} for path, label in videos], holdout_fraction, seed
+    )
+    cascade = load_cascade(cheap_path, full_path)
+
+    def _run(entries: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, float]]:
+        confidence: List[float] = []
+        cheap_correct: List[bool] = []
+        full_correct: List[bool] = []
+        latency = {stage: 0.0 for stage in STAGES}
+        for entry in entries:
+            path, label = entry["path"], entry["label"]
+            try:
+                inputs = cascade.prepare(path)
+            except ValueError as exc:
+                print(f"⚠️ Bỏ qua {path}: {exc}")
+                continue
+            started = time.perf_counter()
+            cheap_probs = predict_batch(inputs.cheap, cascade.cheap.model)[0]
+            latency["cheap"] += time.perf_counter() - started
+            started = time.perf_counter()
+            full_probs = predict_batch(inputs.full(), cascade.full.model)[0]
+            latency["full"] += time.perf_counter() - started
+            confidence.append(float(cheap_probs.max()))
+            cheap_correct.append(int(torch.argmax(cheap_probs)) == label)
+            full_correct.append(int(torch.argmax(full_probs)) == label)
+        return np.array(confidence), np.array(cheap_correct), np.array(full_correct), latency
+
+    calib_conf, calib_cheap_ok, calib_full_ok, calib_latency = _run(calib_entries)
+    if not len(calib_conf):
+        raise ValueError("Không đọc được video nào để hiệu chỉnh.")
+    threshold = choose_threshold(calib_conf, calib_cheap_ok, calib_full_ok, max_accuracy_drop)
+    if holdout_entries:
+        conf, cheap_ok, full_ok, latency = _run(holdout_entries)
+        if not len(conf):
+            raise ValueError("Không đọc được video nào trong tập giữ lại.")
+    else:
+        conf, cheap_ok, full_ok, latency = calib_conf, calib_cheap_ok, calib_full_ok, calib_latency
+    accuracy, escalation = cascade_accuracy(conf, cheap_ok, full_ok, threshold)
+    count = len(conf)
+    cheap_ms = latency["cheap"] / count * 1000
+    full_ms = latency["full"] / count * 1000
+    return {
+        "videos": len(calib_conf) + (count if holdout_entries else 0),
+        "calibration_videos": len(calib_conf),
+        "holdout_videos": count if holdout_entries else 0,
+        "seed": seed,
+        "threshold": threshold,
+        "calibration_accuracy": cascade_accuracy(calib_conf, calib_cheap_ok, calib_full_ok, threshold)[0],
+        "cheap_accuracy": float(cheap_ok.mean()),
+        "full_accuracy": float(full_ok.mean()),
+        "cascade_accuracy": accuracy,
+        "escalation_rate": escalation,
+        "cheap_latency_ms": cheap_ms,
+        "full_latency_ms": full_ms,
+        "cascade_latency_ms": cheap_ms + escalation * full_ms,
+        "curve": [
+            {"threshold": t, **dict(zip(("accuracy", "escalation_rate"), cascade_accuracy(conf, cheap_ok, full_ok, t)))}
+            for t in (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99)
+        ],
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cascade model rẻ -> model đầy đủ theo độ tin cậy")
+    sub = parser.add_subparsers(dest="command", required=True)
+    calib = sub.add_parser("calibrate", help="Chọn ngưỡng độ tin cậy trên dataset có nhãn")
+    calib.add_argument("cheap_path", help="Thư mục model rẻ (vd. ./videomae_int8)")
+    calib.add_argument("full_path", help="Thư mục model đầy đủ")
+    calib.add_argument("--data-dir", default="dataset", help="Thư mục chứa positive/ và negative/")
+    calib.add_argument("--max-videos", type=int, default=None)
+    calib.add_argument("--max-accuracy-drop", type=float, default=0.01,
+                       help="Accuracy được phép giảm tối đa so với chỉ dùng model đầy đủ")
+    calib.add_argument("--holdout-fraction", type=float, default=0.5,
+                       help="Tỉ lệ video giữ lại để báo cáo (ngưỡng chỉ chọn trên phần còn lại)")
+    calib.add_argument("--seed", type=int, default=42, help="Seed chia tập hiệu chỉnh / tập giữ lại")
+    calib.add_argument("--output", default=None, help="Ghi báo cáo JSON ra file này")
+    args = parser.parse_args(argv)
+
+    report = calibrate(
+        args.cheap_path, args.full_path, args.data_dir, args.max_accuracy_drop, args.max_videos,
+        args.holdout_fraction, args.seed,
+    )
+    print(
+        f"Số video: {report['videos']} (hiệu chỉnh {report['calibration_videos']}, giữ lại {report['holdout_videos']})"
+    )
+    if report["holdout_videos"]:
+        print("Các số liệu dưới đây tính trên tập giữ lại")
+    print(f"Accuracy   rẻ: {report['cheap_accuracy']:.2%}   đầy đủ: {report['full_accuracy']:.2%}")
+    print(f"Latency    rẻ: {report['cheap_latency_ms']:.1f} ms   đầy đủ: {report['full_latency_ms']:.1f} ms")
+    print("Ngưỡng   accuracy   chuyển stage")
+    for point in report["curve"]:
+        print(f"{point['threshold']:6.2f}   {point['accuracy']:8.2%}   {point['escalation_rate']:12.2%}")
+    if report["threshold"] > 1.0:
+        print(f"❌ Không có ngưỡng nào giữ accuracy giảm <= {args.max_accuracy_drop:.2%}; không nên bật cascade")
+    else:
+        print(
+            f"✓ Ngưỡng đề xuất: {report['threshold']:.4f} -> accuracy {report['cascade_accuracy']:.2%}, "
+            f"{report['escalation_rate']:.2%} video chạy model đầy đủ, ~{report['cascade_latency_ms']:.1f} ms/video"
+        )
+        print(f"  VIDEOMAE_CASCADE_MODEL_PATH={args.cheap_path} VIDEOMAE_CASCADE_THRESHOLD={report['threshold']:.4f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
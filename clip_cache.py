@@ -0,0 +1,302 @@
+"""
+Cache clip đã decode cho fine-tune: decode mỗi video đúng một lần thành các shard
+uint8 `.npy` (memory-mapped) + file index, để các epoch sau chỉ đọc từ đĩa/page cache
+thay vì mở lại mp4, seek và resize.
+
+Mỗi clip được lưu ở kích thước sau resize + center crop của processor
+(T, crop_h, crop_w, 3), nên ClipPreprocessor chỉ còn bước rescale + normalize
+và kết quả giống hệt khi decode trực tiếp.
+
+    python clip_cache.py build --data-dir dataset --output clip_cache --workers 4
+    python clip_cache.py bench clip_cache --data-dir dataset
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from fast_preprocess import ClipPreprocessor
+
+INDEX_NAME = "index.json"
+DEFAULT_PROCESSOR = "MCG-NJU/videomae-base"
+
+
+def _center_crop(frames: np.ndarray, crop_h: int, crop_w: int) -> np.ndarray:
+    """Center crop giống ClipPreprocessor (cùng cách làm tròn vị trí)."""
+    height, width = frames.shape[1:3]
+    top = max(0, (height - crop_h) // 2)
+    left = max(0, (width - crop_w) // 2)
+    return frames[:, top:top + crop_h, left:left + crop_w]
+
+
+def _decode_clip(path: str, num_frames: int, size: Any, crop: Tuple[int, int]) -> np.ndarray:
+    from extract_frames import load_video
+
+    frames = _center_crop(load_video(path, num_frames, size=size), *crop)
+    if frames.shape[1:3] != crop:
+        raise ValueError(f"Frame nhỏ hơn crop {crop}: {frames.shape[1:3]}")
+    return np.ascontiguousarray(frames)
+
+
+def _try_decode(args: Tuple[str, int, Any, Tuple[int, int]]) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    try:
+        return _decode_clip(*args), None
+    except Exception as exc:
+        return None, str(exc)
+
+
+def build_clip_cache(
+    video_paths: Sequence[str],
+    labels: Sequence[int],
+    processor: Any,
+    output_dir: str,
+    num_frames: int = 16,
+    shard_size: int = 128,
+    workers: int = 0,
+) -> Dict[str, Any]:
+    """
+    Decode toàn bộ video (song song trên `workers` process) vào các shard
+    `shard_XXXXX.npy` shape (n, T, crop_h, crop_w, 3) và ghi `index.json`.
+    Video lỗi được ghi vào mục "failed" của index thay vì dừng cả quá trình.
+    """
+    from inference_service import decode_size
+
+    fast = processor if isinstance(processor, ClipPreprocessor) else ClipPreprocessor.from_processor(processor)
+    if not fast.do_center_crop:
+        raise ValueError("Clip cache cần processor có center crop để mọi clip cùng kích thước.")
+    crop = (fast.crop_size["height"], fast.crop_size["width"])
+    size = decode_size(processor)
+    os.makedirs(output_dir, exist_ok=True)
+
+    index: Dict[str, Any] = {
+        "num_frames": num_frames,
+        "height": crop[0],
+        "width": crop[1],
+        "decode_size": size,
+        "shards": [],
+        "items": [],
+        "failed": [],
+    }
+    jobs = [(path, num_frames, size, crop) for path in video_paths]
+    workers = workers or os.cpu_count() or 1
+    shard: Optional[np.ndarray] = None
+    filled = 0
+
+    def _close_shard() -> None:
+        nonlocal shard
+        if shard is not None:
+            shard.flush()
+            index["shards"][-1]["count"] = filled
+            shard = None
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for (path, label), (clip, error) in zip(zip(video_paths, labels), executor.map(_try_decode, jobs, chunksize=4)):
+            if clip is None:
+                print(f"⚠️ Bỏ qua {path}: {error}")
+                index["failed"].append({"path": path, "error": error})
+                continue
+            if shard is None or filled == shard_size:
+                _close_shard()
+                name = f"shard_{len(index['shards']):05d}.npy"
+                shard = np.lib.format.open_memmap(
+                    os.path.join(output_dir, name),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(shard_size, num_frames, crop[0], crop[1], 3),
+                )
+                index["shards"].append({"file": name, "count": 0})
+                filled = 0
+            shard[filled] = clip
+            stat = os.stat(path)
+            index["items"].append(
+                {
+                    "path": path,
+                    "label": int(label),
+                    "shard": len(index["shards"]) - 1,
+                    "offset": filled,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                }
+            )
+            filled += 1
+        _close_shard()
+
+    with open(os.path.join(output_dir, INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    return index
+
+
+class ClipShardDataset(Dataset):
+    """
+    Dataset đọc clip từ cache đã build (không decode video).
+
+    Args:
+        cache_dir: thư mục chứa index.json và các shard
+        processor: processor của model (chỉ dùng bước rescale + normalize)
+        video_paths: chỉ lấy các video này, theo đúng thứ tự (vd. tập train/val);
+            None = mọi video trong cache
+        num_frames: số frame mỗi clip mà caller cần (None = không kiểm tra)
+
+    Ném ValueError khi cache không còn khớp: video đã sửa/xoá từ lúc build (size, mtime),
+    processor resize/crop khác, hoặc số frame khác `num_frames`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        processor: Any,
+        video_paths: Optional[Sequence[str]] = None,
+        num_frames: Optional[int] = None,
+    ) -> None:
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.num_frames = index["num_frames"]
+        self._shard_files = [shard["file"] for shard in index["shards"]]
+        by_path = {item["path"]: item for item in index["items"]}
+        if video_paths is None:
+            self.items: List[Dict[str, Any]] = list(index["items"])
+        else:
+            missing = [path for path in video_paths if path not in by_path]
+            if missing:
+                raise KeyError(
+                    f"{len(missing)} video chưa có trong clip cache {cache_dir} (vd. {missing[0]}); "
+                    "hãy chạy lại `python clip_cache.py build`."
+                )
+            self.items = [by_path[path] for path in video_paths]
+        self.labels = [item["label"] for item in self.items]
+        self.preprocessor = processor if isinstance(processor, ClipPreprocessor) else ClipPreprocessor.from_processor(processor)
+        self._check_fresh(index, processor, num_frames)
+        # Mở shard lười trong từng worker của DataLoader
+        self._shards: Dict[int, np.ndarray] = {}
+
+    def _check_fresh(self, index: Dict[str, Any], processor: Any, num_frames: Optional[int]) -> None:
+        from inference_service import decode_size
+
+        rebuild = f"hãy chạy lại `python clip_cache.py build --output {self.cache_dir}`."
+        if num_frames is not None and num_frames != self.num_frames:
+            raise ValueError(f"Clip cache {self.cache_dir} có {self.num_frames} frame/clip, cần {num_frames}; {rebuild}")
+        cached_size = index.get("decode_size")
+        cached_size = tuple(cached_size) if isinstance(cached_size, list) else cached_size
+        crop = (self.preprocessor.crop_size["height"], self.preprocessor.crop_size["width"])
+        if cached_size != decode_size(processor) or (index["height"], index["width"]) != crop:
+            raise ValueError(
+                f"Clip cache {self.cache_dir} được build với processor khác "
+                f"(resize {cached_size}, crop {index['height']}x{index['width']}); {rebuild}"
+            )
+        stale = []
+        for item in self.items:
+            try:
+                stat = os.stat(item["path"])
+            except OSError:
+                stale.append(item["path"])
+                continue
+            if stat.st_size != item["size"] or stat.st_mtime_ns != item["mtime_ns"]:
+                stale.append(item["path"])
+        if stale:
+            raise ValueError(
+                f"{len(stale)} video đã thay đổi hoặc bị xoá từ khi build clip cache {self.cache_dir} "
+                f"(vd. {stale[0]}); {rebuild}"
+            )
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _shard(self, shard_id: int) -> np.ndarray:
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            path = os.path.join(self.cache_dir, self._shard_files[shard_id])
+            shard = np.load(path, mmap_mode="r")
+            self._shards[shard_id] = shard
+        return shard
+
+    def clip(self, idx: int) -> torch.Tensor:
+        """Clip uint8 (T, H, W, 3) trỏ thẳng vào vùng mmap của shard (không copy)."""
+        item = self.items[idx]
+        with warnings.catch_warnings():
+            # Shard mở chỉ đọc; clip chỉ được đọc để tạo pixel_values mới
+            warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+            return torch.from_numpy(self._shard(item["shard"])[item["offset"]])
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        return {
+            "pixel_values": self.preprocessor(self.clip(idx))[0],
+            "labels": torch.tensor(self.items[idx]["label"], dtype=torch.long),
+        }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Không pickle các memmap đã mở khi gửi dataset sang worker (spawn)
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+
+def _epoch_seconds(dataset: Dataset) -> float:
+    started = time.perf_counter()
+    for idx in range(len(dataset)):
+        dataset[idx]
+    return time.perf_counter() - started
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    from transformers import AutoProcessor
+
+    from dataset_manifest import scan_videos
+    from videomae_finetune import VideoDataset
+
+    parser = argparse.ArgumentParser(description="Cache clip uint8 (memory-mapped) cho fine-tune")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Decode dataset một lần vào các shard")
+    build.add_argument("--data-dir", default="dataset", help="Thư mục chứa positive/ và negative/")
+    build.add_argument("--output", default="clip_cache")
+    build.add_argument("--processor", default=DEFAULT_PROCESSOR, help="Model/thư mục để lấy processor")
+    build.add_argument("--num-frames", type=int, default=16)
+    build.add_argument("--shard-size", type=int, default=128, help="Số clip mỗi shard")
+    build.add_argument("--workers", type=int, default=0, help="Số process decode (0 = số CPU)")
+    bench = sub.add_parser("bench", help="So sánh thời gian một epoch: decode trực tiếp vs clip cache")
+    bench.add_argument("cache_dir")
+    bench.add_argument("--data-dir", default="dataset")
+    bench.add_argument("--processor", default=DEFAULT_PROCESSOR)
+    args = parser.parse_args(argv)
+
+    processor = AutoProcessor.from_pretrained(args.processor)
+    videos = scan_videos(args.data_dir)
+    video_paths = [path for path, _ in videos]
+    labels = [label for _, label in videos]
+
+    if args.command == "build":
+        started = time.perf_counter()
+        index = build_clip_cache(
+            video_paths, labels, processor, args.output,
+            num_frames=args.num_frames, shard_size=args.shard_size, workers=args.workers,
+        )
+        print(
+            f"✓ Đã cache {len(index['items'])} clip vào {len(index['shards'])} shard "
+            f"({len(index['failed'])} lỗi) trong {time.perf_counter() - started:.1f}s"
+        )
+        return 0
+
+    cached = ClipShardDataset(args.cache_dir, processor)
+    paths = [item["path"] for item in cached.items]
+    direct = VideoDataset(paths, cached.labels, processor, cached.num_frames)
+    direct_s = _epoch_seconds(direct)
+    cached_s = _epoch_seconds(cached)
+    print(f"Số clip: {len(cached)}")
+    print(f"Decode trực tiếp: {direct_s:8.2f} s/epoch  ({len(direct) / direct_s:7.1f} clip/s)")
+    print(f"Clip cache:       {cached_s:8.2f} s/epoch  ({len(cached) / cached_s:7.1f} clip/s)")
+    print(f"Tăng tốc: x{direct_s / cached_s:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
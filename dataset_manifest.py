@@ -0,0 +1,274 @@
+"""
+Manifest của dataset: metadata của từng video (số frame, fps, độ phân giải, thời lượng,
+kích thước file, mtime) được dò song song một lần và lưu vào file JSON.
+
+Với `validate=True`, mỗi video còn được decode thử đúng các frame mà training lấy mẫu;
+video không mở được, không có frame hoặc bị cắt cụt được ghi vào `quarantine.json`
+và bị loại khỏi train/val thay vì được thay bằng clip toàn số 0 mỗi epoch.
+
+Các lần chạy sau chỉ dò lại file mới hoặc đã thay đổi (so sánh size + mtime);
+training đọc manifest để chia train/val theo nhãn (stratified, có seed) mà không
+phải mở lại các video.
+
+    python dataset_manifest.py --data-dir dataset --workers 8
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+LABEL_FOLDERS = (("positive", 0), ("negative", 1))
+MANIFEST_NAME = "manifest.json"
+QUARANTINE_NAME = "quarantine.json"
+MANIFEST_VERSION = 1
+# Video bị cách ly khi quá nửa số frame lấy mẫu không decode được
+MAX_MISSING_FRAME_RATIO = 0.5
+VALIDATE_SIZE = 64
+
+
+def scan_videos(data_dir: str) -> List[Tuple[str, int]]:
+    """Liệt kê (đường dẫn, nhãn) của video trong <data_dir>/positive (0) và <data_dir>/negative (1)."""
+    videos = []
+    for folder, label in LABEL_FOLDERS:
+        root = Path(data_dir) / folder
+        if not root.is_dir():
+            continue
+        for path in sorted(root.iterdir()):
+            if path.is_file() and path.suffix.lower() in VIDEO_EXTENSIONS:
+                videos.append((str(path), label))
+    return videos
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """Đọc metadata của container (không decode frame): số frame, fps, độ phân giải, thời lượng."""
+    import cv2
+
+    info: Dict[str, Any] = {
+        "frame_count": 0,
+        "fps": 0.0,
+        "width": 0,
+        "height": 0,
+        "duration": 0.0,
+        "readable": False,
+        "error": None,
+    }
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            info["error"] = "Không thể mở video"
+            return info
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = float(cap.get(cv2.CAP_PROP_FPS) or 0.0)
+        info.update(
+            frame_count=max(frame_count, 0),
+            fps=fps,
+            width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            duration=frame_count / fps if fps > 0 and frame_count > 0 else 0.0,
+        )
+        if frame_count <= 0:
+            info["error"] = "Video không có frames"
+        else:
+            info["readable"] = True
+    finally:
+        cap.release()
+    return info
+
+
+def validate_video(path: str, num_frames: int = 16) -> Dict[str, Any]:
+    """
+    Decode thử `num_frames` frame giống lúc training (ở độ phân giải nhỏ cho rẻ),
+    trả về {"valid", "validate_error", "decode_s"}.
+    """
+    import time
+
+    from extract_frames import load_video
+
+    stats: Dict[str, Any] = {}
+    error = None
+    started = time.perf_counter()
+    try:
+        frames = load_video(path, num_frames, size=VALIDATE_SIZE, stats=stats)
+        # Chỉ tính frame không đọc/decode được; video ngắn hợp lệ lặp frame nhưng không bị cách ly
+        missing = num_frames - len(frames) + stats.get("failed_frames", 0)
+        if missing > num_frames * MAX_MISSING_FRAME_RATIO:
+            error = f"Video bị cắt cụt/hỏng: {missing}/{num_frames} frames không decode được"
+    except Exception as exc:
+        error = str(exc) or type(exc).__name__
+    return {"valid": error is None, "validate_error": error, "decode_s": time.perf_counter() - started}
+
+
+def _inspect(path: str, validate: bool, num_frames: int) -> Dict[str, Any]:
+    info = probe_video(path)
+    if validate:
+        if info["readable"]:
+            info.update(validate_video(path, num_frames))
+        else:
+            info.update(valid=False, validate_error=info["error"], decode_s=0.0)
+    return info
+
+
+def is_usable(entry: Dict[str, Any]) -> bool:
+    """Video đọc được và (nếu đã kiểm tra) decode được."""
+    return bool(entry.get("readable")) and entry.get("valid", True)
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Any]:
+    if not os.path.exists(manifest_path):
+        return {"version": MANIFEST_VERSION, "videos": []}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "videos": []}
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, Any], manifest_path: str) -> None:
+    """Ghi manifest qua file tạm rồi đổi tên, để không bao giờ để lại file ghi dở."""
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def build_manifest(
+    data_dir: str,
+    manifest_path: Optional[str] = None,
+    workers: int = 0,
+    validate: bool = False,
+    num_frames: int = 16,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Cập nhật manifest của `data_dir`: chỉ dò (song song trên `workers` process) các video
+    mới hoặc có size/mtime khác lần trước, bỏ các video đã bị xoá.
+    Với `validate=True` các video đó còn được decode thử, và danh sách video không dùng
+    được được ghi vào quarantine.json cạnh manifest.
+    Trả về (manifest, thống kê {probed, reused, removed, quarantined, validate_s, time_lost_s}).
+    """
+    manifest_path = manifest_path or os.path.join(data_dir, MANIFEST_NAME)
+    previous = {entry["path"]: entry for entry in load_manifest(manifest_path)["videos"]}
+
+    entries: List[Dict[str, Any]] = []
+    to_probe: List[Dict[str, Any]] = []
+    for path, label in scan_videos(data_dir):
+        stat = os.stat(path)
+        old = previous.get(path)
+        unchanged = old is not None and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns
+        if unchanged and (not validate or "valid" in old):
+            entry = dict(old, label=label)
+        else:
+            entry = {"path": path, "label": label, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            to_probe.append(entry)
+        entries.append(entry)
+
+    if to_probe:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(to_probe))) as executor:
+            paths = [entry["path"] for entry in to_probe]
+            inspected = executor.map(
+                _inspect, paths, [validate] * len(paths), [num_frames] * len(paths), chunksize=8
+            )
+            for entry, info in zip(to_probe, inspected):
+                entry.update(info)
+
+    seen = {entry["path"] for entry in entries}
+    manifest = {"version": MANIFEST_VERSION, "data_dir": data_dir, "videos": entries}
+    save_manifest(manifest, manifest_path)
+
+    quarantined = [entry for entry in entries if not is_usable(entry)]
+    if validate:
+        save_manifest(
+            {
+                "version": MANIFEST_VERSION,
+                "videos": [
+                    {
+                        "path": entry["path"],
+                        "size": entry["size"],
+                        "mtime_ns": entry["mtime_ns"],
+                        "error": entry.get("validate_error") or entry.get("error"),
+                        "decode_s": entry.get("decode_s", 0.0),
+                    }
+                    for entry in quarantined
+                ],
+            },
+            os.path.join(os.path.dirname(manifest_path) or ".", QUARANTINE_NAME),
+        )
+    stats = {
+        "probed": len(to_probe),
+        "reused": len(entries) - len(to_probe),
+        "removed": sum(1 for path in previous if path not in seen),
+        "quarantined": len(quarantined),
+        # Thời gian decode thử trong lần chạy này
+        "validate_s": sum(entry.get("decode_s", 0.0) for entry in to_probe),
+        # Thời gian mỗi epoch sẽ mất cho các video hỏng nếu không bị loại
+        "time_lost_s": sum(entry.get("decode_s", 0.0) for entry in quarantined),
+    }
+    return manifest, stats
+
+
+def stratified_split(
+    entries: Sequence[Dict[str, Any]],
+    val_fraction: float = 0.2,
+    seed: int = 42,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Chia train/val giữ nguyên tỉ lệ nhãn: mỗi nhãn được xáo trộn với `seed`
+    rồi lấy `val_fraction` làm tập val (ít nhất 1 video nếu nhãn có >= 2 video).
+    """
+    rng = random.Random(seed)
+    by_label: Dict[int, List[Dict[str, Any]]] = {}
+    for entry in sorted(entries, key=lambda e: e["path"]):
+        by_label.setdefault(entry["label"], []).append(entry)
+
+    train: List[Dict[str, Any]] = []
+    val: List[Dict[str, Any]] = []
+    for label in sorted(by_label):
+        group = by_label[label]
+        rng.shuffle(group)
+        n_val = int(round(len(group) * val_fraction))
+        if val_fraction > 0 and len(group) >= 2:
+            n_val = min(max(n_val, 1), len(group) - 1)
+        val.extend(group[:n_val])
+        train.extend(group[n_val:])
+    rng.shuffle(train)
+    return train, val
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tạo/cập nhật manifest metadata của dataset video")
+    parser.add_argument("--data-dir", default="dataset", help="Thư mục chứa positive/ và negative/")
+    parser.add_argument("--manifest", default=None, help=f"File manifest (mặc định: <data-dir>/{MANIFEST_NAME})")
+    parser.add_argument("--workers", type=int, default=0, help="Số process dò metadata (0 = số CPU)")
+    parser.add_argument("--validate", action="store_true", help="Decode thử từng video và ghi quarantine.json")
+    args = parser.parse_args(argv)
+
+    manifest, stats = build_manifest(args.data_dir, args.manifest, args.workers, validate=args.validate)
+    videos = manifest["videos"]
+    unreadable = [entry for entry in videos if not is_usable(entry)]
+    total_duration = sum(entry["duration"] for entry in videos)
+    print(f"✓ Manifest: {len(videos)} video ({stats['probed']} dò mới, {stats['reused']} dùng lại, {stats['removed']} đã xoá)")
+    for folder, label in LABEL_FOLDERS:
+        print(f"  - {folder}: {sum(1 for entry in videos if entry['label'] == label)} video")
+    print(f"  - Tổng thời lượng: {total_duration / 60:.1f} phút")
+    if unreadable:
+        print(f"⚠️ {len(unreadable)} video không dùng được:")
+        for entry in unreadable:
+            print(f"    {entry['path']}: {entry.get('validate_error') or entry['error']}")
+    if args.validate:
+        print(
+            f"  - Decode thử: {stats['validate_s']:.1f}s; "
+            f"video bị cách ly tốn {stats['time_lost_s']:.1f}s decode vô ích mỗi epoch nếu không bị loại"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
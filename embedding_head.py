@@ -0,0 +1,330 @@
+"""
+Fine-tune chỉ phần head phân loại trên embedding đã tính sẵn của encoder VideoMAE (đóng băng).
+
+Encoder chạy đúng một lần trên dataset; embedding đã pool (đầu vào của `model.classifier`)
+được lưu thành mảng float16 `embeddings.npy` + `embeddings.json` (đường dẫn, nhãn).
+Sau đó head Linear (hoặc MLP nhỏ) được train trực tiếp trên mảng này trong vài giây
+và export thành thư mục model load được bằng `load_inference_components`:
+
+    python embedding_head.py extract ./videomae_finetuned_final --data-dir dataset --output embeddings
+    python embedding_head.py train embeddings --output ./videomae_head
+    python embedding_head.py train embeddings --output ./videomae_head_mlp --mlp-hidden 256
+
+Head Linear được ghi thẳng vào `classifier` của checkpoint; head MLP được lưu riêng
+(`head.json` + `head.pt`) và gắn lại lúc load.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+
+EMBEDDINGS_NAME = "embeddings.npy"
+EMBEDDINGS_INDEX_NAME = "embeddings.json"
+HEAD_CONFIG_NAME = "head.json"
+HEAD_WEIGHTS_NAME = "head.pt"
+
+
+def pooled_embedding(model: nn.Module, pixel_values: torch.Tensor) -> torch.Tensor:
+    """
+    Embedding (B, hidden_size) của VideoMAEForVideoClassification đúng như đầu vào của
+    `model.classifier`: trung bình các token + fc_norm, hoặc token đầu nếu model không dùng mean pooling.
+    """
+    sequence_output = model.videomae(pixel_values)[0]
+    if getattr(model, "fc_norm", None) is not None:
+        return model.fc_norm(sequence_output.mean(1))
+    return sequence_output[:, 0]
+
+
+def build_head(hidden_size: int, mlp_hidden: int = 0, dropout: float = 0.1, num_labels: int = 2) -> nn.Module:
+    """Head Linear (`mlp_hidden=0`) hoặc MLP một lớp ẩn."""
+    if mlp_hidden <= 0:
+        return nn.Linear(hidden_size, num_labels)
+    return nn.Sequential(
+        nn.Linear(hidden_size, mlp_hidden),
+        nn.GELU(),
+        nn.Dropout(dropout),
+        nn.Linear(mlp_hidden, num_labels),
+    )
+
+
+def has_custom_head(model_path: str) -> bool:
+    return os.path.isfile(os.path.join(model_path, HEAD_CONFIG_NAME))
+
+
+def attach_head(model: nn.Module, model_path: str) -> nn.Module:
+    """Thay `model.classifier` bằng head MLP đã export vào `model_path`."""
+    with open(os.path.join(model_path, HEAD_CONFIG_NAME), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    head = build_head(config["hidden_size"], config["mlp_hidden"], config["dropout"], config["num_labels"])
+    head.load_state_dict(torch.load(os.path.join(model_path, HEAD_WEIGHTS_NAME), map_location="cpu"))
+    model.classifier = head
+    return model
+
+
+class _ClipDataset(Dataset):
+    """(chỉ số, pixel_values) của từng video; pixel_values=None nếu video không decode được."""
+
+    def __init__(self, video_paths: Sequence[str], processor: Any, num_frames: int, clip_cache: Optional[str] = None) -> None:
+        self.video_paths = list(video_paths)
+        self.processor = processor
+        self.num_frames = num_frames
+        self.cached = None
+        if clip_cache:
+            from clip_cache import ClipShardDataset
+
+            self.cached = ClipShardDataset(clip_cache, processor, self.video_paths, num_frames)
+
+    def __len__(self) -> int:
+        return len(self.video_paths)
+
+    def __getitem__(self, idx: int) -> Tuple[int, Optional[torch.Tensor]]:
+        if self.cached is not None:
+            return idx, self.cached[idx]["pixel_values"]
+        from inference_service import preprocess_video
+
+        try:
+            return idx, preprocess_video(self.video_paths[idx], self.processor, self.num_frames)[0]
+        except Exception as exc:
+            print(f"⚠️ Bỏ qua {self.video_paths[idx]}: {exc}")
+            return idx, None
+
+
+def _collate(batch: List[Tuple[int, Optional[torch.Tensor]]]) -> Tuple[List[int], Optional[torch.Tensor]]:
+    batch = [(idx, clip) for idx, clip in batch if clip is not None]
+    if not batch:
+        return [], None
+    return [idx for idx, _ in batch], torch.stack([clip for _, clip in batch])
+
+
+def extract_embeddings(
+    model_path: str,
+    data_dir: str = "dataset",
+    output_dir: str = "embeddings",
+    num_frames: int = 16,
+    batch_size: int = 8,
+    workers: int = 0,
+    clip_cache: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Chạy encoder (inference mode) trên mọi video dùng được trong manifest của `data_dir`,
+    ghi embedding float16 (N, hidden_size) và index vào `output_dir`. Trả về index.
+    """
+    from transformers import AutoModelForVideoClassification, AutoProcessor
+
+    from dataset_manifest import build_manifest, is_usable
+    from fast_preprocess import ClipPreprocessor
+
+    manifest, _ = build_manifest(data_dir, validate=True, num_frames=num_frames)
+    entries = [entry for entry in manifest["videos"] if is_usable(entry)]
+    if not entries:
+        raise FileNotFoundError(f"Không tìm thấy video nào trong {data_dir}/positive hoặc {data_dir}/negative")
+
+    processor = ClipPreprocessor.from_processor(AutoProcessor.from_pretrained(model_path))
+    model = AutoModelForVideoClassification.from_pretrained(model_path)
+    model.eval()
+    hidden_size = model.config.hidden_size
+
+    loader = DataLoader(
+        _ClipDataset([entry["path"] for entry in entries], processor, num_frames, clip_cache),
+        batch_size=batch_size,
+        num_workers=workers,
+        collate_fn=_collate,
+    )
+    embeddings = np.zeros((len(entries), hidden_size), dtype=np.float16)
+    done = np.zeros(len(entries), dtype=bool)
+    started = time.perf_counter()
+    with torch.inference_mode():
+        for indices, pixel_values in loader:
+            if pixel_values is None:
+                continue
+            embeddings[indices] = pooled_embedding(model, pixel_values).float().numpy().astype(np.float16)
+            done[indices] = True
+            print(f"   {int(done.sum())}/{len(entries)} video", end="\r")
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, EMBEDDINGS_NAME), embeddings[done])
+    index = {
+        "model_path": os.path.abspath(model_path) if os.path.exists(model_path) else model_path,
+        "num_frames": num_frames,
+        "hidden_size": hidden_size,
+        "extract_s": time.perf_counter() - started,
+        "items": [
+            {"path": entry["path"], "label": entry["label"], "size": entry["size"], "mtime_ns": entry["mtime_ns"]}
+            for entry, ok in zip(entries, done)
+            if ok
+        ],
+        "failed": [entry["path"] for entry, ok in zip(entries, done) if not ok],
+    }
+    with open(os.path.join(output_dir, EMBEDDINGS_INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    return index
+
+
+def load_embeddings(embeddings_dir: str) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Embedding float32 (N, hidden_size) và index tương ứng."""
+    with open(os.path.join(embeddings_dir, EMBEDDINGS_INDEX_NAME), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    embeddings = np.load(os.path.join(embeddings_dir, EMBEDDINGS_NAME)).astype(np.float32)
+    return embeddings, index
+
+
+def _accuracy(head: nn.Module, features: torch.Tensor, labels: torch.Tensor) -> float:
+    if len(labels) == 0:
+        return float("nan")
+    with torch.no_grad():
+        return float((head(features).argmax(dim=-1) == labels).float().mean())
+
+
+def train_head(
+    embeddings_dir: str,
+    mlp_hidden: int = 0,
+    epochs: int = 300,
+    lr: float = 1e-3,
+    weight_decay: float = 1e-4,
+    dropout: float = 0.1,
+    val_fraction: float = 0.2,
+    seed: int = 42,
+) -> Tuple[nn.Module, Dict[str, Any]]:
+    """
+    Train head trên toàn bộ embedding mỗi bước (full batch, AdamW), chia train/val
+    giống `videomae_finetune` (stratified, cùng seed) và giữ trạng thái có val accuracy tốt nhất.
+    """
+    from dataset_manifest import stratified_split
+
+    embeddings, index = load_embeddings(embeddings_dir)
+    row = {item["path"]: i for i, item in enumerate(index["items"])}
+    train, val = stratified_split(index["items"], val_fraction, seed)
+
+    def _tensors(items: List[Dict[str, Any]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        rows = [row[item["path"]] for item in items]
+        return torch.from_numpy(embeddings[rows]), torch.tensor([item["label"] for item in items], dtype=torch.long)
+
+    train_x, train_y = _tensors(train)
+    val_x, val_y = _tensors(val)
+
+    torch.manual_seed(seed)
+    head = build_head(index["hidden_size"], mlp_hidden, dropout)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=weight_decay)
+    loss_fn = nn.CrossEntropyLoss()
+    best: Tuple[float, int, Dict[str, torch.Tensor]] = (-1.0, 0, {})
+    started = time.perf_counter()
+    for epoch in range(1, epochs + 1):
+        head.train()
+        optimizer.zero_grad()
+        loss = loss_fn(head(train_x), train_y)
+        loss.backward()
+        optimizer.step()
+        head.eval()
+        score = _accuracy(head, val_x, val_y) if len(val_y) else _accuracy(head, train_x, train_y)
+        if score > best[0]:
+            best = (score, epoch, {name: value.clone() for name, value in head.state_dict().items()})
+    head.load_state_dict(best[2])
+    head.eval()
+    return head, {
+        "model_path": index["model_path"],
+        "train_videos": len(train),
+        "val_videos": len(val),
+        "train_accuracy": _accuracy(head, train_x, train_y),
+        "val_accuracy": _accuracy(head, val_x, val_y),
+        "best_epoch": best[1],
+        "train_s": time.perf_counter() - started,
+    }
+
+
+def export_model(model_path: str, head: nn.Module, output_dir: str) -> str:
+    """
+    Ghép encoder của `model_path` với head đã train và lưu vào `output_dir`
+    (config + processor + weights như model fine-tune thông thường).
+    """
+    from transformers import AutoModelForVideoClassification, AutoProcessor
+
+    model = AutoModelForVideoClassification.from_pretrained(model_path)
+    model.config.num_labels = 2
+    hidden_size = model.config.hidden_size
+    if isinstance(head, nn.Linear):
+        model.classifier = head
+    else:
+        # Checkpoint giữ một Linear giữ chỗ để from_pretrained không báo thiếu weights;
+        # load_inference_components thay nó bằng head MLP từ head.json + head.pt
+        model.classifier = nn.Linear(hidden_size, 2)
+        os.makedirs(output_dir, exist_ok=True)
+        torch.save(head.state_dict(), os.path.join(output_dir, HEAD_WEIGHTS_NAME))
+        with open(os.path.join(output_dir, HEAD_CONFIG_NAME), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "hidden_size": hidden_size,
+                    "mlp_hidden": head[0].out_features,
+                    "dropout": head[2].p,
+                    "num_labels": 2,
+                },
+                f,
+                indent=2,
+            )
+    model.save_pretrained(output_dir)
+    AutoProcessor.from_pretrained(model_path).save_pretrained(output_dir)
+    return output_dir
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train head phân loại trên embedding của encoder VideoMAE đóng băng")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    extract = sub.add_parser("extract", help="Chạy encoder một lần, lưu embedding float16")
+    extract.add_argument("model_path", help="Model/thư mục model dùng làm encoder")
+    extract.add_argument("--data-dir", default="dataset", help="Thư mục chứa positive/ và negative/")
+    extract.add_argument("--output", default="embeddings")
+    extract.add_argument("--num-frames", type=int, default=16)
+    extract.add_argument("--batch-size", type=int, default=8)
+    extract.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Số process decode video")
+    extract.add_argument("--clip-cache", default=os.environ.get("VIDEOMAE_CLIP_CACHE") or None,
+                         help="Đọc clip từ clip cache thay vì decode video")
+
+    train = sub.add_parser("train", help="Train head từ embedding và export model")
+    train.add_argument("embeddings_dir")
+    train.add_argument("--output", default="./videomae_head", help="Thư mục lưu model đã ghép head")
+    train.add_argument("--mlp-hidden", type=int, default=0, help="Số unit lớp ẩn (0 = head Linear)")
+    train.add_argument("--epochs", type=int, default=300)
+    train.add_argument("--lr", type=float, default=1e-3)
+    train.add_argument("--weight-decay", type=float, default=1e-4)
+    train.add_argument("--dropout", type=float, default=0.1)
+    train.add_argument("--val-fraction", type=float, default=0.2)
+    train.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.command == "extract":
+        index = extract_embeddings(
+            args.model_path, args.data_dir, args.output,
+            num_frames=args.num_frames, batch_size=args.batch_size,
+            workers=args.workers, clip_cache=args.clip_cache,
+        )
+        print(
+            f"✓ Đã lưu embedding của {len(index['items'])} video ({len(index['failed'])} lỗi) "
+            f"vào {args.output} trong {index['extract_s']:.1f}s"
+        )
+        return 0
+
+    head, report = train_head(
+        args.embeddings_dir, args.mlp_hidden, args.epochs, args.lr,
+        args.weight_decay, args.dropout, args.val_fraction, args.seed,
+    )
+    print(f"✓ Train head xong trong {report['train_s']:.2f}s (epoch tốt nhất: {report['best_epoch']})")
+    print(f"Accuracy   train: {report['train_accuracy']:.2%} ({report['train_videos']} video)   "
+          f"val: {report['val_accuracy']:.2%} ({report['val_videos']} video)")
+    path = export_model(report["model_path"], head, args.output)
+    with open(os.path.join(path, "head_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Đã lưu model: {path} (VIDEOMAE_MODEL_PATH={path})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
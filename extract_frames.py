@@ -1,55 +1,566 @@
+import av
 import cv2
 import numpy as np
 
-def load_video(path, num_frames=16):
+SAMPLING_STRATEGIES = ("auto", "seek", "sequential", "keyframe", "timestamp")
+
+# Số packet tối đa đọc khi dò cấu trúc keyframe (chỉ demux, không decode)
+_PROBE_MAX_PACKETS = 600
+
+
+def load_video(path, num_frames=16, strategy="auto", size=None, stats=None):
     """
     Trích xuất frames từ video
     
     Args:
         path: Đường dẫn đến file video
         num_frames: Số lượng frames cần trích xuất (mặc định 16)
+        strategy: Cách lấy frames
+            - "auto": chọn cách rẻ nhất dựa trên khoảng cách keyframe (GOP)
+            - "seek": seek tới từng frame (mỗi lần seek decode lại từ keyframe trước đó)
+            - "sequential": đọc tuần tự một lượt, chỉ retrieve() các frame cần lấy
+            - "keyframe": seek tới keyframe gần nhất với mỗi vị trí (chỉ decode keyframe)
+            - "timestamp": lấy theo thời gian, dùng khi CAP_PROP_FRAME_COUNT không đúng
+        size: Kích thước resize ngay lúc decode
+            - None: giữ nguyên độ phân giải gốc
+            - int: cạnh ngắn bằng `size`, giữ tỉ lệ khung hình
+            - (height, width): resize về đúng kích thước này
+        stats: dict (tuỳ chọn) để nhận thông tin decode: source_height, source_width, strategy,
+            repeated_frames (số vị trí phải lặp lại frame trước), failed_frames (số vị trí
+            không đọc/decode được; video ngắn hơn num_frames lặp frame nhưng không bị tính là lỗi)
     
     Returns:
-        numpy array chứa các frames
+        numpy array uint8 shape (num_frames, H, W, 3) chứa các frames (RGB)
     """
+    if strategy not in SAMPLING_STRATEGIES:
+        raise ValueError(f"strategy không hợp lệ: {strategy} (chọn một trong {SAMPLING_STRATEGIES})")
+    
     # Mở video bằng OpenCV
     cap = cv2.VideoCapture(path)
     
     if not cap.isOpened():
         raise ValueError(f"Không thể mở video: {path}")
     
-    # Lấy tổng số frames
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    if total_frames == 0:
+    try:
+        # Lấy tổng số frames
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        
+        clip = _ClipBuffer(num_frames, size)
+        layout = None
+        if strategy in ("auto", "keyframe", "timestamp"):
+            layout = _probe_layout(path)
+        if strategy == "auto":
+            strategy = _choose_strategy(total_frames, fps, num_frames, layout)
+        
+        if strategy == "timestamp":
+            _read_by_timestamp(cap, clip, total_frames, fps, num_frames, layout)
+        else:
+            if total_frames <= 0:
+                raise ValueError(f"Video không có frames: {path}")
+            # Tính các vị trí frames cần lấy (rải đều)
+            indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
+            if strategy == "sequential":
+                _read_sequential(cap, clip, indices)
+            elif strategy == "keyframe":
+                _read_keyframes(cap, clip, indices, layout)
+            else:
+                _read_with_seek(cap, clip, indices, total_frames)
+    finally:
         cap.release()
+    
+    if clip.count == 0:
         raise ValueError(f"Video không có frames: {path}")
     
-    # Tính các vị trí frames cần lấy (rải đều)
-    indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
+    if stats is not None:
+        clip.describe(stats)
+        stats["strategy"] = strategy
+    return clip.result()
+
+
+def _target_size(height, width, size):
+    """Tính (height, width) sau resize theo quy ước tham số `size` của load_video."""
+    if size is None:
+        return height, width
+    if isinstance(size, int):
+        if height <= width:
+            return size, max(1, int(size * width / height))
+        return max(1, int(size * height / width)), size
+    return int(size[0]), int(size[1])
+
+
+class _ClipBuffer:
+    """
+    Mảng uint8 (num_frames, H, W, 3) cấp phát một lần khi gặp frame đầu tiên.
+    Mỗi frame được resize + đổi màu ghi thẳng vào vị trí của nó, không qua list trung gian.
+    """
+    
+    def __init__(self, num_frames, size=None):
+        self.num_frames = num_frames
+        self.size = size
+        self.frames = None
+        self.count = 0
+        self.repeated = 0
+        self.failed = 0
+        self.source_size = None
+    
+    def _allocate(self, height, width):
+        self.source_size = (height, width)
+        out_h, out_w = _target_size(height, width, self.size)
+        self.frames = np.empty((self.num_frames, out_h, out_w, 3), dtype=np.uint8)
+    
+    def add_bgr(self, frame):
+        """Thêm một frame BGR từ OpenCV."""
+        if self.count >= self.num_frames:
+            return
+        if self.frames is None:
+            self._allocate(frame.shape[0], frame.shape[1])
+        slot = self.frames[self.count]
+        if frame.shape[:2] != slot.shape[:2]:
+            # Thu nhỏ dùng INTER_AREA (ít răng cưa), phóng to dùng INTER_LINEAR
+            shrinking = slot.shape[0] * slot.shape[1] < frame.shape[0] * frame.shape[1]
+            interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+            cv2.resize(frame, (slot.shape[1], slot.shape[0]), dst=slot, interpolation=interpolation)
+            # Chuyển BGR -> RGB tại chỗ trên frame đã thu nhỏ
+            cv2.cvtColor(slot, cv2.COLOR_BGR2RGB, dst=slot)
+        else:
+            # Chuyển từ BGR sang RGB (OpenCV dùng BGR, model cần RGB)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=slot)
+        self.count += 1
+    
+    def add_av(self, frame):
+        """Thêm một av.VideoFrame: swscale resize + chuyển sang RGB trong cùng một bước."""
+        if self.count >= self.num_frames:
+            return
+        if self.frames is None:
+            self._allocate(frame.height, frame.width)
+        slot = self.frames[self.count]
+        slot[...] = frame.to_ndarray(width=slot.shape[1], height=slot.shape[0], format="rgb24")
+        self.count += 1
+    
+    def repeat_last(self, failed=False):
+        """
+        Lặp lại frame gần nhất: khi nhiều vị trí rơi vào cùng một frame (video ngắn hơn
+        num_frames), hoặc với `failed=True` khi không đọc/decode được frame tại vị trí cần lấy.
+        """
+        if 0 < self.count < self.num_frames:
+            self.frames[self.count] = self.frames[self.count - 1]
+            self.count += 1
+            self.repeated += 1
+            if failed:
+                self.failed += 1
+    
+    def fill(self):
+        """Điền các vị trí còn thiếu (video ngắn hơn metadata / bị cắt cụt) bằng frame cuối đã đọc được."""
+        while 0 < self.count < self.num_frames:
+            self.repeat_last(failed=True)
+    
+    def describe(self, stats):
+        """
+        Ghi độ phân giải gốc, số frame phải lặp lại và số frame không decode được
+        (tập con của số frame lặp lại) vào dict `stats`.
+        """
+        if self.source_size is not None:
+            stats["source_height"], stats["source_width"] = self.source_size
+        stats["repeated_frames"] = self.repeated
+        stats["failed_frames"] = self.failed
+    
+    def result(self):
+        return self.frames[:self.count]
+
+
+def _probe_layout(path):
+    """
+    Dò nhanh cấu trúc video bằng PyAV: chỉ demux các packet đầu (không decode)
+    để ước lượng khoảng cách keyframe, kèm duration/fps từ header container.
+    
+    Returns:
+        dict với các khoá gop, keyframes, duration_s, fps (hoặc None nếu không dò được)
+    """
+    try:
+        container = av.open(path)
+    except av.error.FFmpegError:
+        return None
+    
+    try:
+        if not container.streams.video:
+            return None
+        return _probe_stream_layout(container, container.streams.video[0])
+    except av.error.FFmpegError:
+        return None
+    finally:
+        container.close()
+
+
+def _probe_stream_layout(container, stream):
+    """Phần dò của `_probe_layout` trên container đã mở (vị trí đọc bị thay đổi)."""
+    fps = float(stream.average_rate) if stream.average_rate else 0.0
+    duration_s = None
+    if stream.duration and stream.time_base:
+        duration_s = float(stream.duration * stream.time_base)
+    elif container.duration:
+        duration_s = container.duration / av.time_base
+    
+    keyframes = []
+    packet_idx = 0
+    for packet in container.demux(stream):
+        if packet.size == 0:
+            continue
+        if packet.is_keyframe:
+            keyframes.append(packet_idx)
+            if len(keyframes) >= 3:
+                break
+        packet_idx += 1
+        if packet_idx >= _PROBE_MAX_PACKETS:
+            break
+    
+    if len(keyframes) >= 2:
+        gop = max(1, (keyframes[-1] - keyframes[0]) // (len(keyframes) - 1))
+    else:
+        # Không thấy keyframe thứ hai trong cửa sổ dò: GOP ít nhất dài bằng cửa sổ
+        gop = max(1, packet_idx)
+    return {"gop": gop, "keyframes": keyframes, "duration_s": duration_s, "fps": fps}
+
+
+def _choose_strategy(total_frames, fps, num_frames, layout):
+    """
+    Chọn cách lấy frames rẻ nhất, tính theo số frame phải decode:
+    - sequential: decode từ đầu tới vị trí cuối cùng (~ total_frames)
+    - seek: mỗi vị trí decode trung bình nửa GOP tính từ keyframe trước đó
+    """
+    if layout is None:
+        return "seek" if total_frames > 0 else "sequential"
     
-    frames = []
+    # Frame count trong metadata lệch nhiều so với duration * fps → lấy theo thời gian
+    if layout["duration_s"] and layout["fps"]:
+        expected = layout["duration_s"] * layout["fps"]
+        if total_frames <= 0 or abs(total_frames - expected) > 0.1 * expected + 1:
+            return "timestamp"
+    elif total_frames <= 0:
+        return "sequential"
+    
+    gop = layout["gop"]
+    sequential_cost = total_frames * (num_frames - 1) / num_frames
+    seek_cost = num_frames * (gop / 2.0 + 1)
+    return "sequential" if sequential_cost <= seek_cost else "seek"
+
+
+def _read_with_seek(cap, clip, indices, total_frames):
+    """Cách cũ: seek tới từng vị trí."""
     for idx in indices:
         # Đặt vị trí frame
         cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
         ret, frame = cap.read()
         
         if ret:
-            # Chuyển từ BGR sang RGB (OpenCV dùng BGR, model cần RGB)
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frames.append(frame_rgb)
+            clip.add_bgr(frame)
         else:
             # Nếu không đọc được frame, lấy frame gần nhất
             cap.set(cv2.CAP_PROP_POS_FRAMES, min(idx, total_frames - 1))
             ret, frame = cap.read()
             if ret:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append(frame_rgb)
+                clip.add_bgr(frame)
+
+
+def _read_sequential(cap, clip, indices):
+    """
+    Đọc tuần tự một lượt: grab() mọi frame, chỉ retrieve() + đổi màu ở các vị trí cần lấy.
+    Nếu video ngắn hơn metadata, các vị trí còn thiếu lấy frame cuối đã đọc được.
+    """
+    target_pos = 0
+    frame_idx = 0
+    last_index = indices[-1]
+    while target_pos < len(indices) and frame_idx <= last_index:
+        if not cap.grab():
+            break
+        if frame_idx >= indices[target_pos]:
+            ret, frame = cap.retrieve()
+            if ret:
+                clip.add_bgr(frame)
+                target_pos += 1
+                # Các vị trí trùng nhau (video ngắn hơn num_frames) dùng chung một frame
+                while target_pos < len(indices) and indices[target_pos] <= frame_idx:
+                    clip.repeat_last()
+                    target_pos += 1
+        frame_idx += 1
+    clip.fill()
+
+
+def _read_keyframes(cap, clip, indices, layout):
+    """
+    Lấy keyframe gần nhất với mỗi vị trí: mỗi lần seek chỉ decode đúng một frame.
+    Frames lấy được lệch tối đa nửa GOP so với vị trí rải đều.
+    """
+    gop = layout["gop"] if layout else 1
+    snapped = [int(round(idx / gop)) * gop for idx in indices]
+    for idx in snapped:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ret, frame = cap.read()
+        if ret:
+            clip.add_bgr(frame)
+        else:
+            clip.repeat_last(failed=True)
+
+
+def _read_by_timestamp(cap, clip, total_frames, fps, num_frames, layout):
+    """
+    Lấy frames theo mốc thời gian rải đều trên duration, đọc tuần tự và dựa vào
+    CAP_PROP_POS_MSEC thay vì số thứ tự frame (dùng khi frame count sai).
+    """
+    duration_ms = None
+    if layout and layout["duration_s"]:
+        duration_ms = layout["duration_s"] * 1000.0
+    elif total_frames > 0 and fps > 0:
+        duration_ms = total_frames / fps * 1000.0
+    if not duration_ms:
+        raise ValueError("Không xác định được độ dài video để lấy frames theo thời gian")
     
-    cap.release()
+    targets = [i * duration_ms / num_frames for i in range(num_frames)]
+    target_pos = 0
+    while target_pos < num_frames:
+        if not cap.grab():
+            break
+        pos_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if pos_ms + 1e-3 < targets[target_pos]:
+            continue
+        ret, frame = cap.retrieve()
+        if not ret:
+            continue
+        clip.add_bgr(frame)
+        target_pos += 1
+        while target_pos < num_frames and targets[target_pos] <= pos_ms + 1e-3:
+            clip.repeat_last()
+            target_pos += 1
+    clip.fill()
+
+
+def load_video_from_file(fileobj, num_frames=16, size=None, stats=None):
+    """
+    Trích xuất frames từ video nằm trong bộ nhớ hoặc file-like object (PyAV),
+    không cần ghi ra file tạm.
     
-    # Chuyển thành numpy array
-    frames_array = np.array(frames)
+    Chọn cách đọc như `load_video(strategy="auto")`: dò GOP từ các packet đầu, rồi hoặc
+    decode tuần tự tới vị trí cuối (video ngắn / GOP dài), hoặc seek tới từng mốc thời gian
+    và decode từ keyframe trước đó (video dài: không phải decode cả file).
+    
+    Args:
+        fileobj: Đối tượng file-like có read()/seek() (BytesIO, SpooledTemporaryFile, ...)
+        num_frames: Số lượng frames cần trích xuất (mặc định 16)
+        size: Kích thước resize ngay lúc decode (cùng quy ước với load_video)
+        stats: dict (tuỳ chọn) để nhận thông tin decode: source_height, source_width, strategy,
+            repeated_frames, failed_frames
     
-    return frames_array
+    Returns:
+        numpy array uint8 shape (num_frames, H, W, 3) chứa các frames (RGB)
+    """
+    try:
+        container = av.open(fileobj, mode="r")
+    except av.error.FFmpegError as exc:
+        raise ValueError(f"Không thể mở video: {exc}") from exc
+    
+    try:
+        if not container.streams.video:
+            raise ValueError("Video không có stream hình ảnh")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        fps = float(stream.average_rate) if stream.average_rate else 0.0
+        
+        # Tổng số frames từ metadata, nếu thiếu thì ước lượng từ duration * fps
+        total_frames = stream.frames
+        if not total_frames and stream.duration and stream.average_rate:
+            total_frames = int(float(stream.duration * stream.time_base) * fps)
+        if not total_frames and container.duration and stream.average_rate:
+            total_frames = int(container.duration / av.time_base * fps)
+        if not total_frames:
+            raise ValueError("Video không có frames")
+        
+        try:
+            layout = _probe_stream_layout(container, stream)
+        except av.error.FFmpegError:
+            layout = None
+        strategy = _choose_strategy(total_frames, fps, num_frames, layout)
+        duration_s = layout["duration_s"] if layout else None
+        if strategy != "sequential" and not duration_s and fps > 0:
+            duration_s = total_frames / fps
+        if not duration_s:
+            strategy = "sequential"
+        
+        clip = _ClipBuffer(num_frames, size)
+        if strategy == "sequential":
+            # Quay lại đầu stream sau khi dò, decode tuần tự một lượt tới vị trí cuối
+            container.seek(stream.start_time or 0, stream=stream, backward=True, any_frame=False)
+            _decode_sequential(container, stream, clip, total_frames)
+        else:
+            # seek / keyframe / timestamp: seek tới các mốc thời gian rải đều trên duration
+            strategy = "seek"
+            _decode_at_times(container, stream, clip, [i * duration_s / num_frames for i in range(num_frames)])
+    except av.error.FFmpegError as exc:
+        raise ValueError(f"Lỗi khi decode video: {exc}") from exc
+    finally:
+        container.close()
+    
+    if clip.count == 0:
+        raise ValueError("Video không có frames")
+    
+    # Metadata có thể đếm dư frames: lấy frame gần nhất đã decode được
+    clip.fill()
+    if stats is not None:
+        clip.describe(stats)
+        stats["strategy"] = strategy
+    return clip.result()
+
+
+def _decode_sequential(container, stream, clip, total_frames):
+    """Decode tuần tự (PyAV), lấy các vị trí frame rải đều tới vị trí cuối cùng."""
+    num_frames = clip.num_frames
+    indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
+    last_index = indices[-1]
+    target_pos = 0
+    for frame_idx, frame in enumerate(container.decode(stream)):
+        if frame_idx >= indices[target_pos]:
+            clip.add_av(frame)
+            target_pos += 1
+            while target_pos < num_frames and indices[target_pos] <= frame_idx:
+                clip.repeat_last()
+                target_pos += 1
+        if target_pos >= num_frames or frame_idx >= last_index:
+            break
+
 
+def _decode_at_times(container, stream, clip, times):
+    """
+    Với mỗi mốc thời gian (giây, tính từ đầu stream): seek về keyframe trước đó rồi decode
+    tới frame đầu tiên có pts >= mốc. Mốc nằm sau frame cuối (metadata đếm dư) lấy frame
+    cuối cùng decode được; chỉ đoạn không decode được mới bị tính là lỗi.
+    """
+    time_base = float(stream.time_base)
+    start_pts = stream.start_time or 0
+    fps = float(stream.average_rate) if stream.average_rate else 25.0
+    # Chấp nhận frame sớm hơn mốc tối đa nửa frame
+    tolerance = int(0.5 / (fps * time_base))
+    
+    for t in times:
+        target = start_pts + int(round(t / time_base))
+        chosen = None
+        last = None
+        try:
+            container.seek(target, stream=stream, backward=True, any_frame=False)
+            for frame in container.decode(stream):
+                last = frame
+                if frame.pts is None or frame.pts + tolerance >= target:
+                    chosen = frame
+                    break
+        except av.error.FFmpegError:
+            last = None
+        if chosen is None:
+            chosen = last
+        if chosen is not None:
+            clip.add_av(chosen)
+        else:
+            # Không decode được đoạn này: lấy frame gần nhất
+            clip.repeat_last(failed=True)
+
+
+def iter_video_windows(source, window_seconds=4.0, num_frames=16, size=None):
+    """
+    Chia video thành các đoạn dài `window_seconds` giây (không chồng lấn) và lấy
+    `num_frames` frames rải đều trong mỗi đoạn, decode tuần tự một lượt duy nhất (PyAV).
+    
+    Args:
+        source: Đường dẫn video hoặc file-like object
+        window_seconds: Độ dài mỗi đoạn (giây)
+        num_frames: Số frames mỗi đoạn
+        size: Kích thước resize ngay lúc decode (cùng quy ước với load_video)
+    
+    Yields:
+        (start_s, end_s, frames) với frames là numpy array uint8 (num_frames, H, W, 3)
+    """
+    if window_seconds <= 0:
+        raise ValueError("window_seconds phải > 0")
+    
+    try:
+        container = av.open(source, mode="r")
+    except av.error.FFmpegError as exc:
+        raise ValueError(f"Không thể mở video: {exc}") from exc
+    
+    try:
+        if not container.streams.video:
+            raise ValueError("Video không có stream hình ảnh")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        fps = float(stream.average_rate) if stream.average_rate else 25.0
+        step = window_seconds / num_frames
+        
+        window_idx = 0
+        start = 0.0
+        clip = _ClipBuffer(num_frames, size)
+        target_pos = 0
+        last_time = 0.0
+        for frame_idx, frame in enumerate(container.decode(stream)):
+            t = frame.time if frame.time is not None else frame_idx / fps
+            last_time = t
+            # Frame thuộc đoạn sau: trả về đoạn hiện tại (nếu có frames) rồi chuyển đoạn
+            while t >= start + window_seconds:
+                if clip.count > 0:
+                    clip.fill()
+                    yield start, start + window_seconds, clip.result()
+                window_idx += 1
+                start = window_idx * window_seconds
+                clip = _ClipBuffer(num_frames, size)
+                target_pos = 0
+            
+            added = False
+            while target_pos < num_frames and t + 1e-6 >= start + target_pos * step:
+                if added:
+                    clip.repeat_last()
+                else:
+                    clip.add_av(frame)
+                    added = True
+                target_pos += 1
+        
+        # Đoạn cuối (có thể ngắn hơn window_seconds)
+        if clip.count > 0:
+            clip.fill()
+            yield start, max(last_time, start), clip.result()
+    except av.error.FFmpegError as exc:
+        raise ValueError(f"Lỗi khi decode video: {exc}") from exc
+    finally:
+        container.close()
+
+
+def load_video_at_times(fileobj, times, size=None, stats=None):
+    """
+    Lấy frames tại các mốc thời gian cho trước: với mỗi mốc seek về keyframe trước đó
+    rồi decode tới frame cần lấy. Dùng cho file chỉ có một phần dữ liệu (vd. đã tải
+    bằng HTTP Range các GOP cần thiết), nên không đọc tuần tự cả file.
+    
+    Args:
+        fileobj: Đường dẫn hoặc file-like object có read()/seek()
+        times: Danh sách mốc thời gian (giây, tính từ đầu stream)
+        size: Kích thước resize ngay lúc decode (cùng quy ước với load_video)
+        stats: dict (tuỳ chọn) để nhận thông tin decode: source_height, source_width, repeated_frames, failed_frames
+    
+    Returns:
+        numpy array uint8 shape (len(times), H, W, 3) chứa các frames (RGB)
+    """
+    try:
+        container = av.open(fileobj, mode="r")
+    except av.error.FFmpegError as exc:
+        raise ValueError(f"Không thể mở video: {exc}") from exc
+    
+    try:
+        if not container.streams.video:
+            raise ValueError("Video không có stream hình ảnh")
+        stream = container.streams.video[0]
+        clip = _ClipBuffer(len(times), size)
+        _decode_at_times(container, stream, clip, times)
+    finally:
+        container.close()
+    
+    if clip.count == 0:
+        raise ValueError("Video không có frames")
+    
+    clip.fill()
+    if stats is not None:
+        clip.describe(stats)
+    return clip.result()
@@ -0,0 +1,173 @@
+"""
+Tiền xử lý clip dạng vectorized bằng torch, thay cho việc gọi AutoProcessor
+(xử lý từng frame qua PIL/NumPy) ở mỗi request.
+
+Các tham số resize / center crop / rescale / normalize được đọc một lần từ
+config của processor đã lưu, sau đó áp dụng cho cả clip (hoặc cả batch clip)
+trong vài phép toán tensor.
+
+Kiểm tra sai số so với processor của HuggingFace:
+
+    python fast_preprocess.py ./videomae_finetuned_final [video.mp4]
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+IMAGENET_DEFAULT_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_DEFAULT_STD = [0.229, 0.224, 0.225]
+PROCESSOR_CONFIG_NAME = "preprocessor_config.json"
+
+
+def _output_size(height: int, width: int, size: Dict[str, int]) -> Tuple[int, int]:
+    """Kích thước sau resize, cùng quy ước với transformers (cạnh dài bị cắt phần lẻ)."""
+    if "shortest_edge" in size:
+        short = size["shortest_edge"]
+        if height <= width:
+            return short, int(short * width / height)
+        return int(short * height / width), short
+    return size["height"], size["width"]
+
+
+class ClipPreprocessor:
+    """
+    Bản vectorized của VideoMAEImageProcessor cho input uint8 (T, H, W, 3) hoặc (B, T, H, W, 3).
+
+    Giữ lại processor gốc (nếu có) trong `self.processor` để có thể lưu lại
+    bằng `save_pretrained` hoặc so sánh kết quả.
+    """
+
+    def __init__(self, config: Dict[str, Any], processor: Any = None) -> None:
+        self.processor = processor
+        self.do_resize = config.get("do_resize", True)
+        self.size = dict(config.get("size") or {"shortest_edge": 224})
+        self.do_center_crop = config.get("do_center_crop", True)
+        self.crop_size = dict(config.get("crop_size") or {"height": 224, "width": 224})
+        self.do_rescale = config.get("do_rescale", True)
+        self.rescale_factor = float(config.get("rescale_factor", 1 / 255))
+        self.do_normalize = config.get("do_normalize", True)
+        mean = config.get("image_mean") or IMAGENET_DEFAULT_MEAN
+        std = config.get("image_std") or IMAGENET_DEFAULT_STD
+
+        # Gộp rescale + normalize thành một phép x * scale + bias
+        scale = torch.ones(3)
+        bias = torch.zeros(3)
+        if self.do_rescale:
+            scale = scale * self.rescale_factor
+        if self.do_normalize:
+            std_t = torch.tensor(std, dtype=torch.float32)
+            scale = scale / std_t
+            bias = -torch.tensor(mean, dtype=torch.float32) / std_t
+        self._scale = scale.view(1, 3, 1, 1)
+        self._bias = bias.view(1, 3, 1, 1)
+
+    @classmethod
+    def from_processor(cls, processor: Any) -> "ClipPreprocessor":
+        image_processor = getattr(processor, "image_processor", processor)
+        keys = (
+            "do_resize", "size", "do_center_crop", "crop_size", "do_rescale",
+            "rescale_factor", "do_normalize", "image_mean", "image_std",
+        )
+        config = {key: getattr(image_processor, key) for key in keys if hasattr(image_processor, key)}
+        return cls(config, processor=processor)
+
+    @classmethod
+    def from_pretrained(cls, model_path: str) -> "ClipPreprocessor":
+        """Đọc trực tiếp preprocessor_config.json, không cần load transformers."""
+        with open(os.path.join(model_path, PROCESSOR_CONFIG_NAME), "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __call__(self, frames: Union[np.ndarray, Sequence[np.ndarray], torch.Tensor]) -> torch.Tensor:
+        """
+        Trả về pixel_values float32 shape (B, T, 3, crop_h, crop_w).
+        """
+        if isinstance(frames, torch.Tensor):
+            clips = frames
+        else:
+            clips = torch.from_numpy(np.ascontiguousarray(np.asarray(frames)))
+        if clips.ndim == 4:
+            clips = clips.unsqueeze(0)
+        if clips.ndim != 5 or clips.shape[-1] != 3:
+            raise ValueError(f"Cần frames shape (T, H, W, 3) hoặc (B, T, H, W, 3), nhận {tuple(clips.shape)}")
+
+        batch, num_frames, height, width, _ = clips.shape
+        x = clips.reshape(batch * num_frames, height, width, 3).permute(0, 3, 1, 2)
+
+        if self.do_resize:
+            out_h, out_w = _output_size(height, width, self.size)
+            if (out_h, out_w) != (height, width):
+                x = F.interpolate(x.float(), size=(out_h, out_w), mode="bilinear", antialias=True, align_corners=False)
+                # Processor gốc resize qua PIL nên kết quả được làm tròn về uint8
+                x = x.round_().clamp_(0, 255)
+
+        if self.do_center_crop:
+            crop_h, crop_w = self.crop_size["height"], self.crop_size["width"]
+            h, w = x.shape[-2:]
+            top = max(0, (h - crop_h) // 2)
+            left = max(0, (w - crop_w) // 2)
+            x = x[..., top:top + crop_h, left:left + crop_w]
+
+        x = torch.addcmul(self._bias, x.float(), self._scale)
+        return x.reshape(batch, num_frames, *x.shape[1:]).contiguous()
+
+
+def check_equivalence(processor: Any, frames: np.ndarray) -> float:
+    """
+    So sánh pixel_values của ClipPreprocessor với processor gốc, trả về sai số tuyệt đối lớn nhất.
+    """
+    fast = ClipPreprocessor.from_processor(processor)(frames)
+    try:
+        reference = processor(videos=list(frames), return_tensors="pt")["pixel_values"]
+    except TypeError:
+        reference = processor(images=list(frames), return_tensors="pt")["pixel_values"]
+    if fast.shape != reference.shape:
+        raise AssertionError(f"Khác shape: {tuple(fast.shape)} vs {tuple(reference.shape)}")
+    return float((fast - reference).abs().max().item())
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    from transformers import AutoProcessor
+
+    from extract_frames import load_video
+
+    parser = argparse.ArgumentParser(description="So sánh ClipPreprocessor với AutoProcessor của HuggingFace")
+    parser.add_argument("model_path", help="Thư mục chứa preprocessor_config.json")
+    parser.add_argument("video", nargs="?", help="Video để kiểm tra (mặc định: frames ngẫu nhiên)")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Sai số cho phép khi frames đã ở kích thước decode")
+    args = parser.parse_args(argv)
+
+    processor = AutoProcessor.from_pretrained(args.model_path)
+    fast = ClipPreprocessor.from_processor(processor)
+    shortest = fast.size.get("shortest_edge", fast.size.get("height", 224))
+
+    if args.video:
+        full_res = load_video(args.video, 16)
+        decoded = load_video(args.video, 16, size=shortest)
+    else:
+        rng = np.random.default_rng(0)
+        full_res = rng.integers(0, 256, size=(16, 360, 640, 3), dtype=np.uint8)
+        decoded = rng.integers(0, 256, size=(16, shortest, shortest * 16 // 9, 3), dtype=np.uint8)
+
+    # Frames đã resize lúc decode (đường chạy của service): phải khớp gần như tuyệt đối
+    diff_decoded = check_equivalence(processor, decoded)
+    # Frames độ phân giải gốc: chỉ khác nhau do bộ lọc resize torch vs PIL
+    diff_full = check_equivalence(processor, full_res)
+    print(f"max |fast - hf| (frames kích thước decode): {diff_decoded:.6f}")
+    print(f"max |fast - hf| (frames độ phân giải gốc):  {diff_full:.6f}")
+    if diff_decoded > args.atol:
+        print(f"❌ Sai số vượt quá atol={args.atol}")
+        return 1
+    print("✓ ClipPreprocessor khớp với processor gốc")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
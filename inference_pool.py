@@ -0,0 +1,73 @@
+"""
+Worker pool có giới hạn cho phần việc nặng CPU (decode + preprocess)
+kèm hàng đợi admission để từ chối sớm khi quá tải.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable
+
+
+class QueueFullError(RuntimeError):
+    """Hàng đợi admission đã đầy, request nên được thử lại sau `retry_after` giây."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Service đang quá tải, vui lòng thử lại sau.")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Executor riêng cho inference, tách khỏi event loop của uvicorn.
+
+    - `max_workers`: số job decode/preprocess chạy song song.
+    - `max_pending`: số request được nhận cùng lúc (đang chạy + đang chờ);
+      vượt quá sẽ ném `QueueFullError` ngay thay vì xếp hàng thêm.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, retry_after_s: int = 1) -> None:
+        if max_workers < 1 or max_pending < 1:
+            raise ValueError("max_workers và max_pending phải >= 1.")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after_s = retry_after_s
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="videomae-infer")
+        self._pending = 0
+        self._rejected = 0
+
+    @asynccontextmanager
+    async def admit(self, slots: int = 1) -> AsyncIterator[None]:
+        """
+        Giữ `slots` slot admission trong suốt vòng đời request
+        (request batch chiếm một slot cho mỗi video, tối đa `max_pending`).
+        """
+        slots = max(1, min(slots, self.max_pending))
+        if self._pending + slots > self.max_pending:
+            self._rejected += 1
+            raise QueueFullError(self.retry_after_s)
+        self._pending += slots
+        try:
+            yield
+        finally:
+            self._pending -= slots
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Chạy `fn` trên executor của pool và chờ kết quả.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "rejected": self._rejected,
+        }
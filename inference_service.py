@@ -4,50 +4,223 @@ Tiện ích dùng chung để load model và chạy inference VideoMAE.
 from __future__ import annotations
 
 import os
-from typing import Dict, Tuple
+import time
+import warnings
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
 
 import torch
 from transformers import AutoProcessor, AutoModelForVideoClassification
 
-from extract_frames import load_video
+from embedding_head import attach_head, has_custom_head, pooled_embedding
+from extract_frames import iter_video_windows, load_video, load_video_at_times, load_video_from_file
+from fast_preprocess import ClipPreprocessor
+from quantize_model import is_quantized_model, load_quantized_model
+from shared_weights import default_num_threads, load_shared_model, worker_count
+
+if TYPE_CHECKING:
+    from onnx_backend import OnnxVideoClassifier
+    from remote_video import PartialVideo
+
+VideoModel = Union[AutoModelForVideoClassification, "OnnxVideoClassifier"]
 
 LABELS = {0: "POSITIVE (Tích cực)", 1: "NEGATIVE (Tiêu cực)"}
 DEFAULT_MODEL_PATH = os.environ.get("VIDEOMAE_MODEL_PATH", "./videomae_finetuned_final")
+FAST_PREPROCESS = os.environ.get("VIDEOMAE_FAST_PREPROCESS", "1") != "0"
+# "torch" (mặc định) hoặc "onnx" (ONNX Runtime, cần chạy `python onnx_backend.py export` trước)
+BACKEND = os.environ.get("VIDEOMAE_BACKEND", "torch").lower()
+ONNX_THREADS = int(os.environ.get("VIDEOMAE_ONNX_THREADS", "0"))
+BACKENDS = ("torch", "onnx")
+# Map chung model.safetensors giữa các worker thay vì mỗi worker giữ một bản weights
+SHARED_WEIGHTS = os.environ.get("VIDEOMAE_SHARED_WEIGHTS", "0") == "1"
+# Số thread intra-op mỗi worker (0 = tự chia số core theo số worker nếu biết)
+TORCH_THREADS = int(os.environ.get("VIDEOMAE_TORCH_THREADS", "0"))
+
+
+def worker_num_threads() -> int:
+    """
+    Số thread intra-op cho process hiện tại: VIDEOMAE_TORCH_THREADS nếu đặt, chia đều
+    số core cho các worker khi biết số worker (WEB_CONCURRENCY hoặc `--workers`),
+    0 = giữ mặc định của thư viện.
+    """
+    if TORCH_THREADS > 0:
+        return TORCH_THREADS
+    if worker_count() is not None:
+        return default_num_threads()
+    if SHARED_WEIGHTS:
+        # Shared weights thường đi với nhiều worker: mỗi worker dùng mọi core sẽ tranh CPU lẫn nhau
+        warnings.warn(
+            "VIDEOMAE_SHARED_WEIGHTS=1 nhưng không xác định được số worker; mỗi worker dùng mọi core. "
+            "Hãy đặt WEB_CONCURRENCY hoặc VIDEOMAE_TORCH_THREADS.",
+            RuntimeWarning,
+        )
+    return 0
 
 
-def load_inference_components(model_path: str | None = None) -> Tuple[AutoProcessor, AutoModelForVideoClassification]:
+def load_inference_components(
+    model_path: str | None = None,
+    backend: str | None = None,
+) -> Tuple[Union[ClipPreprocessor, AutoProcessor], VideoModel]:
     """
     Load processor + model một lần để tái sử dụng.
+    Mặc định processor được bọc trong ClipPreprocessor (tiền xử lý vectorized),
+    đặt VIDEOMAE_FAST_PREPROCESS=0 để dùng AutoProcessor gốc.
+    `backend` (mặc định VIDEOMAE_BACKEND) chọn PyTorch hoặc ONNX Runtime;
+    cả hai đều được gọi dạng `model(pixel_values=...).logits`.
     """
     path = model_path or DEFAULT_MODEL_PATH
+    backend = (backend or BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn một trong {', '.join(BACKENDS)})")
     if not os.path.exists(path):
         raise FileNotFoundError(
             f"Không tìm thấy model tại {path}. Hãy chạy videomae_finetune.py trước."
         )
+    num_threads = worker_num_threads()
+    if num_threads:
+        torch.set_num_threads(num_threads)
     processor = AutoProcessor.from_pretrained(path)
-    model = AutoModelForVideoClassification.from_pretrained(path)
+    if FAST_PREPROCESS:
+        processor = ClipPreprocessor.from_processor(processor)
+    if backend == "onnx":
+        from onnx_backend import OnnxVideoClassifier, onnx_model_path
+
+        onnx_path = onnx_model_path(path)
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(
+                f"Không tìm thấy {onnx_path}. Hãy chạy `python onnx_backend.py export {path}` trước."
+            )
+        return processor, OnnxVideoClassifier(onnx_path, intra_op_threads=ONNX_THREADS or num_threads)
+    # Cả ba cách load đều ghép head MLP train từ embedding
+    # (`python embedding_head.py train --mlp-hidden ...`) nếu có head.json + head.pt
+    if is_quantized_model(path):
+        # Thư mục tạo bởi `python quantize_model.py quantize` (Linear INT8)
+        model = load_quantized_model(path)
+    elif SHARED_WEIGHTS:
+        model = load_shared_model(path)
+    else:
+        model = AutoModelForVideoClassification.from_pretrained(path)
+        if has_custom_head(path):
+            model = attach_head(model, path)
     model.eval()
     return processor, model
 
 
-def predict_from_path(
-    video_path: str,
-    processor: AutoProcessor,
-    model: AutoModelForVideoClassification,
-) -> Dict[str, float | str | int | Dict[str, float]]:
+def decode_size(processor: Union[ClipPreprocessor, AutoProcessor]) -> Optional[Union[int, Tuple[int, int]]]:
     """
-    Chạy inference trên một video và trả về nhãn/kết quả xác suất.
+    Lấy kích thước resize của processor để resize ngay lúc decode
+    (cạnh ngắn `shortest_edge` hoặc đúng `height` x `width`).
+    """
+    image_processor = getattr(processor, "image_processor", processor)
+    size = getattr(image_processor, "size", None) or {}
+    if "shortest_edge" in size:
+        return int(size["shortest_edge"])
+    if "height" in size and "width" in size:
+        return int(size["height"]), int(size["width"])
+    return None
+
+
+def decode_video(
+    video: Union[str, BinaryIO, "PartialVideo"],
+    num_frames: int = 16,
+    size: Optional[Union[int, Tuple[int, int]]] = None,
+    stats: Optional[Dict[str, float]] = None,
+) -> np.ndarray:
+    """
+    Decode `num_frames` frames uint8 (T, H, W, 3) từ đường dẫn, file-like object
+    hoặc `remote_video.PartialVideo` (xem `preprocess_video`).
+    """
+    if isinstance(video, str):
+        return load_video(video, num_frames, size=size, stats=stats)
+    if hasattr(video, "times"):
+        return load_video_at_times(video.file, video.times, size=size, stats=stats)
+    return load_video_from_file(video, num_frames, size=size, stats=stats)
+
+
+def preprocess_video(
+    video: Union[str, BinaryIO, "PartialVideo"],
+    processor: Union[ClipPreprocessor, AutoProcessor],
+    num_frames: int = 16,
+    stats: Optional[Dict[str, float]] = None,
+) -> torch.Tensor:
+    """
+    Trích xuất frames và chạy processor, trả về tensor pixel_values shape (1, T, C, H, W).
+
+    `video` là đường dẫn file (decode bằng OpenCV), file-like object
+    trong bộ nhớ (decode bằng PyAV, không cần file tạm), hoặc `remote_video.PartialVideo`
+    (chỉ có các GOP cần thiết, frames lấy tại `video.times`).
+    Nếu truyền `stats`, hàm ghi thêm decode_s, preprocess_s và độ phân giải gốc.
     """
-    frames = load_video(video_path)
+    started = time.perf_counter()
+    frames = decode_video(video, num_frames, size=decode_size(processor), stats=stats)
+    decoded = time.perf_counter()
+    pixel_values = apply_processor(frames, processor)
+    if stats is not None:
+        stats["decode_s"] = decoded - started
+        stats["preprocess_s"] = time.perf_counter() - decoded
+    return pixel_values
+
+
+def apply_processor(
+    frames: np.ndarray,
+    processor: Union[ClipPreprocessor, AutoProcessor],
+) -> torch.Tensor:
+    """
+    Chạy processor trên frames (T, H, W, 3), trả về pixel_values (1, T, C, H, W).
+    """
+    if isinstance(processor, ClipPreprocessor):
+        return processor(frames)
     try:
         inputs = processor(videos=list(frames), return_tensors="pt")
     except TypeError:
         inputs = processor(images=list(frames), return_tensors="pt")
+    return inputs["pixel_values"]
+
+
+def iter_video_segments(
+    video: Union[str, BinaryIO],
+    processor: Union[ClipPreprocessor, AutoProcessor],
+    window_seconds: float = 4.0,
+    num_frames: int = 16,
+) -> Iterator[Tuple[float, float, torch.Tensor]]:
+    """
+    Chia video dài thành các đoạn `window_seconds` giây (decode một lượt),
+    yield (start_s, end_s, pixel_values) cho từng đoạn ngay khi decode xong.
+    """
+    size = decode_size(processor)
+    for start, end, frames in iter_video_windows(video, window_seconds, num_frames, size=size):
+        yield start, end, apply_processor(frames, processor)
 
+
+def predict_batch(
+    pixel_values: torch.Tensor,
+    model: VideoModel,
+) -> torch.Tensor:
+    """
+    Chạy một forward pass trên batch pixel_values (B, T, C, H, W), trả về xác suất (B, num_labels).
+    """
     with torch.no_grad():
-        logits = model(**inputs).logits
+        logits = model(pixel_values=pixel_values).logits
+    return torch.softmax(logits, dim=-1)
 
-    probs = torch.softmax(logits, dim=-1)[0]
+
+def embed_batch(
+    pixel_values: torch.Tensor,
+    model: torch.nn.Module,
+) -> torch.Tensor:
+    """
+    Embedding đã pool (B, hidden_size) của encoder, tức đầu vào của `model.classifier`.
+    Chỉ dùng được với model PyTorch (không dùng được với backend ONNX).
+    """
+    with torch.no_grad():
+        return pooled_embedding(model, pixel_values)
+
+
+def format_prediction(probs: torch.Tensor) -> Dict[str, float | str | int | Dict[str, float]]:
+    """
+    Chuyển vector xác suất của một video thành dict kết quả.
+    """
     pred_idx = int(torch.argmax(probs).item())
     confidence = float(probs[pred_idx].item())
 
@@ -62,3 +235,14 @@ def predict_from_path(
     }
 
 
+def predict_from_path(
+    video_path: str,
+    processor: Union[ClipPreprocessor, AutoProcessor],
+    model: VideoModel,
+) -> Dict[str, float | str | int | Dict[str, float]]:
+    """
+    Chạy inference trên một video và trả về nhãn/kết quả xác suất.
+    """
+    pixel_values = preprocess_video(video_path, processor)
+    probs = predict_batch(pixel_values, model)[0]
+    return format_prediction(probs)
@@ -0,0 +1,295 @@
+"""
+Metrics dạng Prometheus text (exposition format 0.0.4) cho service, không cần thêm thư viện.
+
+Gồm Counter / Gauge / Histogram có label, một registry chung và các metric
+dùng trong app: latency theo từng stage, bytes nhận, độ phân giải frame gốc,
+số request đang xử lý / đang chờ và RSS của process.
+"""
+from __future__ import annotations
+
+import math
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: cần đúng các label {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:  # pragma: no cover - lớp con cài đặt
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        """Giá trị được tính lại mỗi lần scrape: hàm trả về {label values: giá trị}."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                items = list(self._function().items())
+            except Exception:
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} đã được đăng ký.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes() -> float:
+    """RSS hiện tại của process (đọc /proc, fallback về max RSS của getrusage)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return float(pages * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError, IndexError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về byte
+        return float(maxrss if os.uname().sysname == "Darwin" else maxrss * 1024)
+
+
+def memory_usage(pid: str = "self") -> Dict[str, int]:
+    """
+    RSS, PSS và phần bộ nhớ dùng chung (byte) của một process, đọc từ /proc/<pid>/smaps_rollup
+    (Linux >= 4.14). PSS chia đều các page dùng chung cho số process cùng map chúng.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared"}
+    usage = {"rss": 0, "pss": 0, "shared": 0}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            key = parts[0].rstrip(":") if parts else ""
+            if key in fields and len(parts) >= 2:
+                usage[fields[key]] += int(parts[1]) * 1024
+    return usage
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "videomae_stage_seconds",
+    "Thời gian từng stage của pipeline inference (giây).",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "videomae_request_seconds",
+    "Tổng thời gian xử lý request (giây).",
+    labelnames=("endpoint",),
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "videomae_requests_total",
+    "Số request theo endpoint và status code.",
+    labelnames=("endpoint", "status"),
+)
+BYTES_RECEIVED = REGISTRY.counter(
+    "videomae_bytes_received_total",
+    "Tổng số byte video nhận được.",
+    labelnames=("source",),
+)
+FRAME_HEIGHT = REGISTRY.histogram(
+    "videomae_decoded_frame_height_pixels",
+    "Chiều cao frame gốc của video đã decode (pixel).",
+    buckets=(144, 240, 360, 480, 720, 1080, 1440, 2160, 4320),
+)
+FRAME_WIDTH = REGISTRY.histogram(
+    "videomae_decoded_frame_width_pixels",
+    "Chiều rộng frame gốc của video đã decode (pixel).",
+    buckets=(256, 426, 640, 854, 1280, 1920, 2560, 3840, 7680),
+)
+BATCH_SIZE = REGISTRY.histogram(
+    "videomae_batch_size",
+    "Số clip trong mỗi forward pass.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "videomae_cache_lookups_total",
+    "Số lần tra cache kết quả.",
+    labelnames=("result",),
+)
+DEDUP_LOOKUPS = REGISTRY.counter(
+    "videomae_near_duplicate_lookups_total",
+    "Số lần tra index near-duplicate (fingerprint frame) sau khi cache theo nội dung miss "
+    "(skipped = clip quá ít chi tiết, không tra).",
+    labelnames=("result",),
+)
+CASCADE_STAGE = REGISTRY.counter(
+    "videomae_cascade_stage_total",
+    "Số video được trả lời bởi từng stage của cascade (cheap = model rẻ đủ tin cậy, full = chuyển lên model đầy đủ).",
+    labelnames=("stage",),
+)
+INFLIGHT = REGISTRY.gauge(
+    "videomae_inflight",
+    "Số request/clip đang xử lý hoặc đang chờ, theo hàng đợi.",
+    labelnames=("queue",),
+)
+PROCESS_RSS = REGISTRY.gauge(
+    "process_resident_memory_bytes",
+    "Resident set size của process (byte).",
+)
+PROCESS_RSS.set_function(lambda: {(): process_rss_bytes()})
+PROCESS_PSS = REGISTRY.gauge(
+    "process_proportional_memory_bytes",
+    "Proportional set size của process (byte), phần dùng chung được chia cho các worker.",
+)
+PROCESS_PSS.set_function(lambda: {(): float(memory_usage()["pss"])})
+PROCESS_SHARED = REGISTRY.gauge(
+    "process_shared_memory_bytes",
+    "Bộ nhớ resident dùng chung với process khác (byte), vd. weights mmap.",
+)
+PROCESS_SHARED.set_function(lambda: {(): float(memory_usage()["shared"])})
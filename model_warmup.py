@@ -0,0 +1,96 @@
+"""
+Compile model cho các shape cố định (B, 16, 3, 224, 224) và chạy warmup lúc startup,
+để các request đầu tiên sau deploy không phải trả chi phí khởi tạo lười
+(chọn kernel, cấp phát bộ nhớ, compile graph).
+
+Chế độ compile (VIDEOMAE_COMPILE):
+- "none": giữ nguyên model
+- "trace": torch.jit.trace một graph cho mỗi batch size, shape khác chạy eager
+- "compile": torch.compile, graph được tạo trong lúc warmup
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import torch
+
+COMPILE_MODES = ("none", "trace", "compile")
+
+
+@dataclass
+class LogitsOutput:
+    """Output cùng dạng với output của model HuggingFace (chỉ có `logits`)."""
+
+    logits: torch.Tensor
+
+
+def input_shape(processor: Any, num_frames: int = 16) -> Tuple[int, int, int, int]:
+    """Shape (T, C, H, W) của một clip sau preprocess, theo crop_size của processor."""
+    image_processor = getattr(processor, "image_processor", processor)
+    crop = getattr(image_processor, "crop_size", None) or {}
+    return num_frames, 3, int(crop.get("height", 224)), int(crop.get("width", 224))
+
+
+class TracedVideoClassifier:
+    """
+    Một graph TorchScript cho mỗi batch size đã trace; shape chưa trace chạy model gốc.
+    Gọi dạng `model(pixel_values=...).logits` như model HuggingFace.
+    """
+
+    def __init__(self, model: torch.nn.Module, clip_shape: Tuple[int, int, int, int], batch_sizes: Sequence[int]) -> None:
+        self.model = model
+        self._graphs: Dict[Tuple[int, ...], torch.jit.ScriptModule] = {}
+        with torch.no_grad():
+            for batch_size in batch_sizes:
+                example = torch.zeros(batch_size, *clip_shape)
+                graph = torch.jit.trace(model, (example,), strict=False, check_trace=False)
+                self._graphs[tuple(example.shape)] = torch.jit.freeze(graph)
+
+    def eval(self) -> "TracedVideoClassifier":
+        return self
+
+    def __call__(self, pixel_values: torch.Tensor) -> Any:
+        graph = self._graphs.get(tuple(pixel_values.shape))
+        if graph is None:
+            return self.model(pixel_values=pixel_values)
+        return LogitsOutput(logits=graph(pixel_values)["logits"])
+
+
+def compile_model(
+    model: Any,
+    mode: str,
+    clip_shape: Tuple[int, int, int, int],
+    batch_sizes: Sequence[int],
+) -> Any:
+    """Trả về model đã trace/compile theo `mode` (chỉ áp dụng cho model PyTorch)."""
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"VIDEOMAE_COMPILE không hợp lệ: {mode} (chọn một trong {', '.join(COMPILE_MODES)})")
+    if mode == "none" or not isinstance(model, torch.nn.Module):
+        return model
+    if mode == "trace":
+        return TracedVideoClassifier(model, clip_shape, batch_sizes)
+    return torch.compile(model)
+
+
+def warmup(
+    model: Any,
+    clip_shape: Tuple[int, int, int, int],
+    batch_sizes: Sequence[int],
+    steps: int,
+) -> Optional[float]:
+    """
+    Chạy `steps` forward với input tổng hợp cho mỗi batch size, trả về thời gian (giây)
+    hoặc None nếu không warmup.
+    """
+    if steps <= 0 or not batch_sizes:
+        return None
+    from inference_service import predict_batch
+
+    started = time.perf_counter()
+    for batch_size in batch_sizes:
+        pixel_values = torch.randn(batch_size, *clip_shape)
+        for _ in range(steps):
+            predict_batch(pixel_values, model)
+    return time.perf_counter() - started
@@ -0,0 +1,184 @@
+"""
+Index near-duplicate cho service: nhận ra video đã phân loại trước đó dù bytes khác
+(encode lại, đổi độ phân giải, cắt viền, upload lại) để trả lại nhãn cũ mà không chạy model.
+
+Mỗi video được tóm tắt bằng fingerprint cảm nhận (dHash) của vài frame lấy từ chính
+pixel_values đã tiền xử lý: 4 frame x 8 x 8 bit = 256 bit (32 byte). Tìm kiếm là brute
+force khoảng cách Hamming bằng NumPy trên toàn bộ index, đủ nhanh cho vài trăm nghìn video.
+Index giới hạn số phần tử (bỏ video cũ nhất khi đầy) và có thể lưu ra file `.npz`.
+
+Frame đen, một màu hoặc gần như tĩnh cho dHash toàn bit 0 (hoặc bit nhiễu), nên mọi video
+như vậy đều "trùng" nhau; `is_informative` loại các clip đó trước khi tra/thêm vào index.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+FINGERPRINT_FRAMES = 4
+# dHash: so sánh các cặp ô kề nhau trên lưới 8 hàng x 9 cột
+HASH_ROWS = 8
+HASH_COLS = 9
+FINGERPRINT_BITS = FINGERPRINT_FRAMES * HASH_ROWS * (HASH_COLS - 1)
+FINGERPRINT_BYTES = FINGERPRINT_BITS // 8
+# Bỏ viền mỗi cạnh trước khi hash để chịu được letterbox / cắt viền nhẹ
+CROP_MARGIN = 0.1
+# Chênh lệch trung bình tối thiểu giữa hai ô kề nhau để một frame có ích cho dHash
+# (trên pixel_values đã normalize ImageNet, std ~0.225: 0.03 ~ 2 mức xám / 255)
+MIN_CELL_GRADIENT = 0.03
+# Số frame (trong FINGERPRINT_FRAMES) phải đạt ngưỡng trên; cho phép một frame đen (fade-in)
+MIN_INFORMATIVE_FRAMES = FINGERPRINT_FRAMES - 1
+
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def _block_mean(images: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Thu nhỏ (N, H, W) về (N, rows, cols) bằng trung bình từng ô."""
+    height, width = images.shape[1:]
+    row_edges = (np.arange(rows) * height) // rows
+    col_edges = (np.arange(cols) * width) // cols
+    sums = np.add.reduceat(np.add.reduceat(images, row_edges, axis=1), col_edges, axis=2)
+    row_counts = np.diff(np.append(row_edges, height))
+    col_counts = np.diff(np.append(col_edges, width))
+    return sums / (row_counts[:, None] * col_counts[None, :])
+
+
+def _hash_cells(pixel_values: Any) -> np.ndarray:
+    """Lưới (FINGERPRINT_FRAMES, HASH_ROWS, HASH_COLS) ảnh xám đã bỏ viền mà dHash so sánh."""
+    clip = np.asarray(pixel_values, dtype=np.float32)
+    if clip.ndim == 5:
+        clip = clip[0]
+    frames = np.linspace(0, clip.shape[0] - 1, FINGERPRINT_FRAMES).round().astype(int)
+    gray = clip[frames].mean(axis=1)
+    height, width = gray.shape[1:]
+    top, left = int(height * CROP_MARGIN), int(width * CROP_MARGIN)
+    gray = gray[:, top:height - top, left:width - left]
+    return _block_mean(gray, HASH_ROWS, HASH_COLS)
+
+
+def frame_fingerprint(pixel_values: Any) -> np.ndarray:
+    """
+    Fingerprint 32 byte của clip pixel_values (1, T, C, H, W) hoặc (T, C, H, W):
+    dHash trên ảnh xám của FINGERPRINT_FRAMES frame trải đều trong clip.
+    """
+    small = _hash_cells(pixel_values)
+    return np.packbits(small[:, :, 1:] > small[:, :, :-1])
+
+
+def is_informative(pixel_values: Any) -> bool:
+    """
+    False khi clip có quá ít chi tiết để fingerprint phân biệt được (frame đen, một màu,
+    letterbox gần như trống): ít nhất MIN_INFORMATIVE_FRAMES frame phải có chênh lệch trung bình
+    giữa các ô kề nhau >= MIN_CELL_GRADIENT.
+    """
+    small = _hash_cells(pixel_values)
+    energy = np.abs(np.diff(small, axis=2)).mean(axis=(1, 2))
+    return int((energy >= MIN_CELL_GRADIENT).sum()) >= MIN_INFORMATIVE_FRAMES
+
+
+class NearDuplicateIndex:
+    """
+    Index fingerprint -> xác suất dự đoán của các video đã phân loại.
+
+    Args:
+        max_items: số video tối đa; khi đầy, video được thêm sớm nhất bị thay thế
+        max_distance: khoảng cách Hamming tối đa (trên FINGERPRINT_BITS bit) để coi là trùng
+        path: file `.npz` để nạp lúc khởi tạo và lưu lại (None = chỉ trong bộ nhớ)
+        model_fingerprint: phiên bản model; index đã lưu của model khác bị bỏ qua
+        save_every: tự lưu ra `path` sau mỗi số lần thêm này
+    """
+
+    def __init__(
+        self,
+        max_items: int = 50000,
+        max_distance: int = 16,
+        path: Optional[str] = None,
+        model_fingerprint: str = "",
+        save_every: int = 100,
+    ) -> None:
+        self.max_items = max_items
+        self.max_distance = max_distance
+        self.path = path
+        self.model_fingerprint = model_fingerprint
+        self.save_every = save_every
+        self._fingerprints = np.zeros((max_items, FINGERPRINT_BYTES), dtype=np.uint8)
+        self._probs: Optional[np.ndarray] = None
+        self._size = 0
+        self._next = 0
+        self._dirty = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def lookup(self, fingerprint: np.ndarray) -> Optional[Tuple[np.ndarray, int]]:
+        """(xác suất, khoảng cách) của video gần nhất nếu trong ngưỡng, ngược lại None."""
+        with self._lock:
+            if self._size:
+                distances = _POPCOUNT[np.bitwise_xor(self._fingerprints[:self._size], fingerprint)].sum(axis=1)
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    self._hits += 1
+                    return self._probs[best].copy(), int(distances[best])
+            self._misses += 1
+            return None
+
+    def add(self, fingerprint: np.ndarray, probs: np.ndarray) -> None:
+        probs = np.asarray(probs, dtype=np.float32)
+        with self._lock:
+            if self._probs is None:
+                self._probs = np.zeros((self.max_items, probs.shape[-1]), dtype=np.float32)
+            self._fingerprints[self._next] = fingerprint
+            self._probs[self._next] = probs
+            self._next = (self._next + 1) % self.max_items
+            self._size = min(self._size + 1, self.max_items)
+            self._dirty += 1
+            should_save = self.path is not None and self._dirty >= self.save_every
+        if should_save:
+            self.save()
+
+    def save(self) -> None:
+        """Ghi index (cũ nhất trước) qua file tạm rồi đổi tên."""
+        if not self.path:
+            return
+        with self._lock:
+            if self._probs is None:
+                return
+            order = (self._next - self._size + np.arange(self._size)) % self.max_items
+            fingerprints = self._fingerprints[order]
+            probs = self._probs[order]
+            self._dirty = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, fingerprints=fingerprints, probs=probs, model_fingerprint=np.array(self.model_fingerprint))
+        os.replace(tmp_path, self.path)
+
+    def _load(self, path: str) -> None:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["model_fingerprint"]) != self.model_fingerprint:
+                return
+            fingerprints = data["fingerprints"][-self.max_items:]
+            probs = data["probs"][-self.max_items:]
+        count = len(fingerprints)
+        if count == 0:
+            return
+        self._fingerprints[:count] = fingerprints
+        self._probs = np.zeros((self.max_items, probs.shape[1]), dtype=np.float32)
+        self._probs[:count] = probs
+        self._size = count
+        self._next = count % self.max_items
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": self._size,
+            "max_items": self.max_items,
+            "max_distance": self.max_distance,
+            "hits": self._hits,
+            "misses": self._misses,
+            "path": self.path,
+        }
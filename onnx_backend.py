@@ -0,0 +1,177 @@
+"""
+Backend ONNX Runtime cho inference VideoMAE trên CPU.
+
+Export model đã fine-tune sang ONNX (trục batch động) rồi kiểm tra logits
+so với PyTorch:
+
+    python onnx_backend.py export ./videomae_finetuned_final
+    python onnx_backend.py check ./videomae_finetuned_final --atol 1e-3
+
+Service dùng backend này khi đặt VIDEOMAE_BACKEND=onnx
+(số thread intra-op chỉnh bằng VIDEOMAE_ONNX_THREADS).
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+
+ONNX_MODEL_NAME = "model.onnx"
+DEFAULT_OPSET = 17
+
+
+@dataclass
+class OnnxOutput:
+    """Output cùng dạng với output của model HuggingFace (chỉ có `logits`)."""
+
+    logits: torch.Tensor
+
+
+def onnx_model_path(model_path: str) -> str:
+    return os.path.join(model_path, ONNX_MODEL_NAME)
+
+
+def _load_torch_model(model_path: str) -> torch.nn.Module:
+    """Model PyTorch giống lúc serve, kể cả head MLP đã train bằng embedding_head.py."""
+    from transformers import AutoModelForVideoClassification
+
+    from embedding_head import attach_head, has_custom_head
+
+    model = AutoModelForVideoClassification.from_pretrained(model_path)
+    if has_custom_head(model_path):
+        model = attach_head(model, model_path)
+    model.eval()
+    return model
+
+
+def export_onnx(
+    model_path: str,
+    output_path: Optional[str] = None,
+    opset: int = DEFAULT_OPSET,
+    num_frames: Optional[int] = None,
+) -> str:
+    """
+    Export AutoModelForVideoClassification sang ONNX với input `pixel_values`
+    (batch, T, 3, H, W) có trục batch động, output `logits` (batch, num_labels).
+    Head MLP (head.json + head.pt của embedding_head.py) được ghép trước khi export.
+    """
+    model = _load_torch_model(model_path)
+    config = model.config
+    frames = num_frames or getattr(config, "num_frames", 16)
+    image_size = getattr(config, "image_size", 224)
+    dummy = torch.zeros(1, frames, getattr(config, "num_channels", 3), image_size, image_size)
+
+    output_path = output_path or onnx_model_path(model_path)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy,),
+            output_path,
+            input_names=["pixel_values"],
+            output_names=["logits"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    return output_path
+
+
+class OnnxVideoClassifier:
+    """
+    Bọc một onnxruntime.InferenceSession để dùng thay model PyTorch:
+    `model(pixel_values=...)` trả về object có `.logits` (torch.Tensor).
+
+    Args:
+        onnx_path: file .onnx đã export
+        intra_op_threads: số thread cho một phép toán (0 = mặc định của ONNX Runtime)
+        inter_op_threads: số thread chạy song song giữa các node
+    """
+
+    def __init__(self, onnx_path: str, intra_op_threads: int = 0, inter_op_threads: int = 1) -> None:
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def eval(self) -> "OnnxVideoClassifier":
+        return self
+
+    def __call__(self, pixel_values: torch.Tensor) -> OnnxOutput:
+        inputs = np.ascontiguousarray(pixel_values.detach().cpu().numpy(), dtype=np.float32)
+        (logits,) = self.session.run(None, {self._input_name: inputs})
+        return OnnxOutput(logits=torch.from_numpy(logits))
+
+
+def check_parity(
+    model_path: str,
+    onnx_path: Optional[str] = None,
+    batch_size: int = 2,
+    seed: int = 0,
+) -> float:
+    """
+    Chạy cùng một batch pixel_values ngẫu nhiên qua PyTorch và ONNX Runtime,
+    trả về sai số tuyệt đối lớn nhất giữa hai bộ logits.
+    Dùng batch > 1 để kiểm tra luôn trục batch động.
+    """
+    model = _load_torch_model(model_path)
+    config = model.config
+    generator = torch.Generator().manual_seed(seed)
+    pixel_values = torch.randn(
+        batch_size,
+        getattr(config, "num_frames", 16),
+        getattr(config, "num_channels", 3),
+        getattr(config, "image_size", 224),
+        getattr(config, "image_size", 224),
+        generator=generator,
+    )
+    with torch.no_grad():
+        reference = model(pixel_values=pixel_values).logits
+    onnx_logits = OnnxVideoClassifier(onnx_path or onnx_model_path(model_path))(pixel_values=pixel_values).logits
+    if onnx_logits.shape != reference.shape:
+        raise AssertionError(f"Khác shape: {tuple(onnx_logits.shape)} vs {tuple(reference.shape)}")
+    return float((onnx_logits - reference).abs().max().item())
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export VideoMAE sang ONNX và kiểm tra logits")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Export model sang ONNX")
+    export.add_argument("model_path", help="Thư mục model đã fine-tune")
+    export.add_argument("--output", help=f"File .onnx (mặc định: <model_path>/{ONNX_MODEL_NAME})")
+    export.add_argument("--opset", type=int, default=DEFAULT_OPSET)
+
+    check = sub.add_parser("check", help="So sánh logits ONNX Runtime với PyTorch")
+    check.add_argument("model_path", help="Thư mục model đã fine-tune")
+    check.add_argument("--onnx", help=f"File .onnx (mặc định: <model_path>/{ONNX_MODEL_NAME})")
+    check.add_argument("--batch-size", type=int, default=2)
+    check.add_argument("--atol", type=float, default=1e-3, help="Sai số logits cho phép")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        path = export_onnx(args.model_path, args.output, opset=args.opset)
+        print(f"✓ Đã export ONNX: {path}")
+        return 0
+
+    diff = check_parity(args.model_path, args.onnx, batch_size=args.batch_size)
+    print(f"max |onnx - torch| (logits, batch={args.batch_size}): {diff:.6f}")
+    if diff > args.atol:
+        print(f"❌ Sai số vượt quá atol={args.atol}")
+        return 1
+    print("✓ Logits ONNX Runtime khớp với PyTorch")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
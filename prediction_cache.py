@@ -0,0 +1,143 @@
+"""
+Cache kết quả dự đoán theo nội dung video (sha256 của bytes) + phiên bản model.
+
+Gồm 2 tầng:
+- LRU trong bộ nhớ, giới hạn theo tổng số byte.
+- (Tuỳ chọn) SQLite trên đĩa để giữ kết quả qua các lần restart.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".onnx")
+
+
+def model_fingerprint(model_path: str) -> str:
+    """
+    Tính fingerprint cho model: nội dung config + tên/kích thước/mtime các file weights.
+    Không đọc toàn bộ weights nên đủ rẻ để gọi lúc startup.
+    """
+    digest = hashlib.sha256()
+    root = Path(model_path)
+    files = sorted(p for p in root.rglob("*") if p.is_file()) if root.is_dir() else [root]
+    for path in files:
+        rel = str(path.relative_to(root)) if root.is_dir() else path.name
+        if path.suffix == ".json":
+            digest.update(rel.encode())
+            digest.update(path.read_bytes())
+        elif path.suffix in WEIGHT_SUFFIXES:
+            stat = path.stat()
+            digest.update(f"{rel}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def cache_key(content_sha256: str, fingerprint: str) -> str:
+    return f"{fingerprint}:{content_sha256}"
+
+
+class PredictionCache:
+    """
+    Cache 2 tầng cho kết quả `predict_from_path`.
+
+    Tầng SQLite là I/O chặn: caller trong event loop nên gọi `get`/`put` qua thread khi
+    `has_disk` (xem app.py). Truy vấn đĩa không giữ lock của tầng bộ nhớ nên hit trong bộ nhớ
+    ở thread khác không phải chờ.
+
+    Args:
+        max_bytes: ngân sách bộ nhớ cho tầng LRU (0 = tắt tầng bộ nhớ)
+        db_path: đường dẫn file SQLite cho tầng đĩa (None = tắt)
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, db_path: Optional[str] = None) -> None:
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @property
+    def has_disk(self) -> bool:
+        return self._db is not None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+        row = None
+        with self._db_lock:
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value, len(row[0]))
+            self._hits += 1
+            self._disk_hits += 1
+            return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, value, len(payload))
+        with self._db_lock:
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                    (key, payload, time.time()),
+                )
+                self._db.commit()
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "disk": self.db_path,
+        }
+
+    def _remember(self, key: str, value: Dict[str, Any], size: int) -> None:
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
@@ -0,0 +1,179 @@
+"""
+Lượng tử hoá INT8 (dynamic) các lớp Linear của VideoMAE để chạy nhanh hơn trên CPU.
+
+Tạo model INT8 từ model đã fine-tune, rồi so sánh với bản fp32 trên dataset có nhãn:
+
+    python quantize_model.py quantize ./videomae_finetuned_final ./videomae_int8
+    python quantize_model.py evaluate ./videomae_finetuned_final ./videomae_int8 --data-dir dataset
+
+`evaluate` trả về exit code 1 nếu tỉ lệ dự đoán trùng nhau giữa fp32 và INT8
+thấp hơn `--min-agreement`. Thư mục INT8 load được trực tiếp bằng
+`load_inference_components` (VIDEOMAE_MODEL_PATH=./videomae_int8).
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from typing import Dict, Optional, Sequence
+
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModelForVideoClassification, AutoProcessor
+
+from embedding_head import HEAD_CONFIG_NAME, HEAD_WEIGHTS_NAME, attach_head, has_custom_head
+
+QUANTIZATION_CONFIG_NAME = "quantization.json"
+QUANTIZED_WEIGHTS_NAME = "quantized_model.pt"
+
+
+def is_quantized_model(model_path: str) -> bool:
+    return os.path.isfile(os.path.join(model_path, QUANTIZATION_CONFIG_NAME))
+
+
+def _quantize_linear(model: nn.Module) -> nn.Module:
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_model(model_path: str, output_path: str) -> str:
+    """
+    Lượng tử hoá dynamic INT8 các lớp Linear (attention, MLP, classifier) và lưu
+    config + processor + state_dict INT8 vào `output_path`.
+    Head MLP (head.json + head.pt) được ghép trước khi lượng tử hoá và chép sang `output_path`
+    để load_quantized_model dựng lại đúng kiến trúc.
+    """
+    model = AutoModelForVideoClassification.from_pretrained(model_path)
+    custom_head = has_custom_head(model_path)
+    if custom_head:
+        model = attach_head(model, model_path)
+    model.eval()
+    quantized = _quantize_linear(model)
+
+    os.makedirs(output_path, exist_ok=True)
+    if custom_head:
+        for name in (HEAD_CONFIG_NAME, HEAD_WEIGHTS_NAME):
+            shutil.copyfile(os.path.join(model_path, name), os.path.join(output_path, name))
+    model.config.save_pretrained(output_path)
+    AutoProcessor.from_pretrained(model_path).save_pretrained(output_path)
+    torch.save(quantized.state_dict(), os.path.join(output_path, QUANTIZED_WEIGHTS_NAME))
+    with open(os.path.join(output_path, QUANTIZATION_CONFIG_NAME), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "method": "dynamic",
+                "dtype": "qint8",
+                "modules": ["Linear"],
+                "source_model": os.path.abspath(model_path),
+                "torch_version": torch.__version__,
+            },
+            f,
+            indent=2,
+        )
+    return output_path
+
+
+def load_quantized_model(model_path: str) -> nn.Module:
+    """
+    Dựng lại kiến trúc từ config, lượng tử hoá cùng cách rồi nạp state_dict INT8.
+    """
+    config = AutoConfig.from_pretrained(model_path)
+    model = AutoModelForVideoClassification.from_config(config)
+    if has_custom_head(model_path):
+        model = attach_head(model, model_path)
+    model.eval()
+    quantized = _quantize_linear(model)
+    state_dict = torch.load(os.path.join(model_path, QUANTIZED_WEIGHTS_NAME), map_location="cpu")
+    quantized.load_state_dict(state_dict)
+    quantized.eval()
+    return quantized
+
+
+def evaluate(
+    fp32_path: str,
+    int8_path: str,
+    data_dir: str = "dataset",
+    max_videos: Optional[int] = None,
+) -> Dict[str, float]:
+    """
+    Chạy cả hai model trên cùng pixel_values của từng video, trả về accuracy,
+    latency forward trung bình (ms) và tỉ lệ dự đoán trùng nhau.
+    """
+    from dataset_manifest import scan_videos
+    from inference_service import load_inference_components, predict_batch, preprocess_video
+
+    videos = scan_videos(data_dir)[:max_videos]
+    if not videos:
+        raise FileNotFoundError(f"Không tìm thấy video nào trong {data_dir}/positive hoặc {data_dir}/negative")
+
+    processor, fp32_model = load_inference_components(fp32_path, backend="torch")
+    _, int8_model = load_inference_components(int8_path, backend="torch")
+
+    correct = {"fp32": 0, "int8": 0}
+    latency = {"fp32": 0.0, "int8": 0.0}
+    agree = 0
+    evaluated = 0
+    for path, label in videos:
+        try:
+            pixel_values = preprocess_video(path, processor)
+        except ValueError as exc:
+            print(f"⚠️ Bỏ qua {path}: {exc}")
+            continue
+        preds = {}
+        for name, model in (("fp32", fp32_model), ("int8", int8_model)):
+            started = time.perf_counter()
+            probs = predict_batch(pixel_values, model)[0]
+            latency[name] += time.perf_counter() - started
+            preds[name] = int(torch.argmax(probs).item())
+            correct[name] += int(preds[name] == label)
+        agree += int(preds["fp32"] == preds["int8"])
+        evaluated += 1
+
+    if evaluated == 0:
+        raise ValueError("Không đọc được video nào để đánh giá.")
+    return {
+        "videos": evaluated,
+        "fp32_accuracy": correct["fp32"] / evaluated,
+        "int8_accuracy": correct["int8"] / evaluated,
+        "fp32_latency_ms": latency["fp32"] / evaluated * 1000,
+        "int8_latency_ms": latency["int8"] / evaluated * 1000,
+        "agreement": agree / evaluated,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lượng tử hoá INT8 VideoMAE và kiểm tra độ chính xác")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    quantize = sub.add_parser("quantize", help="Tạo model INT8 từ model fp32")
+    quantize.add_argument("model_path", help="Thư mục model fp32 đã fine-tune")
+    quantize.add_argument("output_path", help="Thư mục lưu model INT8")
+
+    check = sub.add_parser("evaluate", help="So sánh fp32 và INT8 trên dataset có nhãn")
+    check.add_argument("fp32_path")
+    check.add_argument("int8_path")
+    check.add_argument("--data-dir", default="dataset", help="Thư mục chứa positive/ và negative/")
+    check.add_argument("--max-videos", type=int, default=None)
+    check.add_argument("--min-agreement", type=float, default=0.98, help="Tỉ lệ dự đoán trùng nhau tối thiểu")
+    args = parser.parse_args(argv)
+
+    if args.command == "quantize":
+        path = quantize_model(args.model_path, args.output_path)
+        print(f"✓ Đã lưu model INT8: {path}")
+        return 0
+
+    report = evaluate(args.fp32_path, args.int8_path, args.data_dir, args.max_videos)
+    print(f"Số video: {report['videos']}")
+    print(f"Accuracy   fp32: {report['fp32_accuracy']:.2%}   int8: {report['int8_accuracy']:.2%}")
+    print(f"Latency    fp32: {report['fp32_latency_ms']:.1f} ms   int8: {report['int8_latency_ms']:.1f} ms")
+    print(f"Agreement: {report['agreement']:.2%}")
+    if report["agreement"] < args.min_agreement:
+        print(f"❌ Agreement thấp hơn ngưỡng {args.min_agreement:.2%}")
+        return 1
+    print("✓ Model INT8 đạt ngưỡng agreement")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
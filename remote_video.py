@@ -0,0 +1,429 @@
+"""
+Đọc một phần video MP4 từ xa bằng HTTP Range.
+
+Thay vì tải toàn bộ file, chỉ tải:
+1. Box `moov` (index của container: offset/kích thước từng sample, vị trí keyframe).
+2. Các khoảng byte chứa GOP của những frame sẽ được lấy mẫu.
+
+Phần còn lại của file không được tải; `SparseFile` trả về byte 0 cho các vùng đó.
+Khi server không hỗ trợ Range, file không phải MP4 hoặc index không đọc được,
+`fetch_partial_video` ném `RangeFetchUnavailable` để caller quay về tải toàn bộ.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import io
+import re
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from video_fetcher import VideoFetcher
+
+HEAD_BYTES = 64 * 1024
+# Hai khoảng byte cách nhau ít hơn ngưỡng này được gộp thành một request
+MERGE_GAP_BYTES = 512 * 1024
+# Tải thêm vài sample sau frame cần lấy để decoder có đủ dữ liệu khi có B-frame
+REORDER_LOOKAHEAD = 8
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class RangeFetchUnavailable(Exception):
+    """Không thể tải từng phần (server không hỗ trợ Range hoặc container không phù hợp)."""
+
+
+@dataclass
+class Mp4VideoIndex:
+    """Index của track video trong MP4 (các mảng theo thứ tự decode của sample)."""
+
+    timescale: int
+    offsets: List[int]
+    sizes: List[int]
+    pts: List[int]
+    sync_samples: List[int]
+
+    @property
+    def sample_count(self) -> int:
+        return len(self.sizes)
+
+    def keyframe_before(self, sample: int) -> int:
+        pos = bisect.bisect_right(self.sync_samples, sample) - 1
+        return self.sync_samples[pos] if pos >= 0 else 0
+
+
+@dataclass
+class PartialVideo:
+    """Video đã tải từng phần: file thưa + các mốc thời gian cần lấy frame."""
+
+    file: "SparseFile"
+    times: List[float]
+    fetched_bytes: int
+    total_bytes: int
+    content_key: str
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SparseFile(io.RawIOBase):
+    """
+    File-like chỉ đọc có kích thước `size`, chứa dữ liệu ở các khoảng đã tải;
+    các vùng chưa tải đọc ra byte 0.
+    """
+
+    def __init__(self, size: int, segments: Dict[int, bytes]) -> None:
+        super().__init__()
+        self._size = size
+        self._starts = sorted(segments)
+        self._segments = segments
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        length = min(len(view), max(0, self._size - self._pos))
+        if length == 0:
+            return 0
+        view[:length] = bytes(length)
+        end = self._pos + length
+        # Chép dữ liệu của các khoảng đã tải giao với [pos, end)
+        idx = max(0, bisect.bisect_right(self._starts, self._pos) - 1)
+        while idx < len(self._starts) and self._starts[idx] < end:
+            seg_start = self._starts[idx]
+            data = self._segments[seg_start]
+            lo = max(seg_start, self._pos)
+            hi = min(seg_start + len(data), end)
+            if lo < hi:
+                view[lo - self._pos:hi - self._pos] = data[lo - seg_start:hi - seg_start]
+            idx += 1
+        self._pos = end
+        return length
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int, int]]:
+    """Duyệt các box MP4 trong data[start:end], yield (type, offset, header_size, size)."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset, header, size
+        offset += size
+
+
+def _find_child(data: bytes, parent: Tuple[int, int], box_type: bytes) -> Optional[Tuple[int, int]]:
+    """Tìm box con đầu tiên có kiểu `box_type`, trả về (offset nội dung, offset kết thúc)."""
+    start, end = parent
+    for child_type, offset, header, size in _iter_boxes(data, start, end):
+        if child_type == box_type:
+            return offset + header, offset + size
+    return None
+
+
+def _full_box_entries(data: bytes, box: Tuple[int, int]) -> Tuple[int, int]:
+    """Bỏ qua version/flags của full box, trả về (số entry, offset entry đầu tiên)."""
+    start, _ = box
+    count = struct.unpack(">I", data[start + 4:start + 8])[0]
+    return count, start + 8
+
+
+def parse_moov(moov: bytes) -> Mp4VideoIndex:
+    """
+    Đọc index của track video đầu tiên từ nội dung box moov (bao gồm cả header).
+    moov cắt cụt hoặc hỏng (số entry không khớp, buffer ngắn) ném `RangeFetchUnavailable`
+    để caller quay về tải toàn bộ file.
+    """
+    try:
+        return _parse_moov(moov)
+    except (struct.error, IndexError, ValueError) as exc:
+        raise RangeFetchUnavailable(f"moov không hợp lệ: {exc}") from exc
+
+
+def _parse_moov(moov: bytes) -> Mp4VideoIndex:
+    moov_body = (8, len(moov))
+    for box_type, offset, header, size in _iter_boxes(moov, *moov_body):
+        if box_type != b"trak":
+            continue
+        trak = (offset + header, offset + size)
+        mdia = _find_child(moov, trak, b"mdia")
+        if mdia is None:
+            continue
+        hdlr = _find_child(moov, mdia, b"hdlr")
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        mdhd = _find_child(moov, mdia, b"mdhd")
+        minf = _find_child(moov, mdia, b"minf")
+        stbl = _find_child(moov, minf, b"stbl") if minf else None
+        if mdhd is None or stbl is None:
+            raise RangeFetchUnavailable("Track video thiếu mdhd/stbl.")
+        return _parse_stbl(moov, mdhd, stbl)
+    raise RangeFetchUnavailable("Không tìm thấy track video trong moov.")
+
+
+def _parse_stbl(data: bytes, mdhd: Tuple[int, int], stbl: Tuple[int, int]) -> Mp4VideoIndex:
+    version = data[mdhd[0]]
+    timescale_offset = mdhd[0] + (20 if version == 1 else 12)
+    timescale = struct.unpack(">I", data[timescale_offset:timescale_offset + 4])[0]
+
+    # stsz: kích thước từng sample
+    stsz = _find_child(data, stbl, b"stsz")
+    if stsz is None:
+        raise RangeFetchUnavailable("Không hỗ trợ MP4 thiếu stsz (vd. stz2).")
+    uniform, count = struct.unpack(">II", data[stsz[0] + 4:stsz[0] + 12])
+    if uniform:
+        sizes = [uniform] * count
+    else:
+        sizes = list(struct.unpack(f">{count}I", data[stsz[0] + 12:stsz[0] + 12 + 4 * count]))
+
+    # stco/co64: offset của từng chunk
+    stco = _find_child(data, stbl, b"stco")
+    if stco is not None:
+        n, pos = _full_box_entries(data, stco)
+        chunk_offsets = list(struct.unpack(f">{n}I", data[pos:pos + 4 * n]))
+    else:
+        co64 = _find_child(data, stbl, b"co64")
+        if co64 is None:
+            raise RangeFetchUnavailable("Thiếu stco/co64.")
+        n, pos = _full_box_entries(data, co64)
+        chunk_offsets = list(struct.unpack(f">{n}Q", data[pos:pos + 8 * n]))
+
+    # stsc: số sample trong mỗi chunk -> offset của từng sample
+    stsc = _find_child(data, stbl, b"stsc")
+    if stsc is None:
+        raise RangeFetchUnavailable("Thiếu stsc.")
+    n, pos = _full_box_entries(data, stsc)
+    runs = [struct.unpack(">III", data[pos + 12 * i:pos + 12 * i + 12]) for i in range(n)]
+    offsets: List[int] = []
+    sample = 0
+    for i, (first_chunk, per_chunk, _) in enumerate(runs):
+        last_chunk = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(per_chunk):
+                if sample >= count:
+                    break
+                offsets.append(offset)
+                offset += sizes[sample]
+                sample += 1
+    if len(offsets) != count:
+        raise RangeFetchUnavailable("Index MP4 không nhất quán (stsc/stsz).")
+
+    # stts (+ ctts): thời điểm hiển thị của từng sample
+    stts = _find_child(data, stbl, b"stts")
+    if stts is None:
+        raise RangeFetchUnavailable("Thiếu stts.")
+    n, pos = _full_box_entries(data, stts)
+    dts: List[int] = []
+    current = 0
+    for i in range(n):
+        run, delta = struct.unpack(">II", data[pos + 8 * i:pos + 8 * i + 8])
+        for _ in range(run):
+            dts.append(current)
+            current += delta
+    dts = (dts + [current] * count)[:count]
+    pts = list(dts)
+    ctts = _find_child(data, stbl, b"ctts")
+    if ctts is not None:
+        ctts_version = data[ctts[0]]
+        n, pos = _full_box_entries(data, ctts)
+        sample = 0
+        for i in range(n):
+            run, delta = struct.unpack(">II", data[pos + 8 * i:pos + 8 * i + 8])
+            if ctts_version == 1 and delta >= 2 ** 31:
+                delta -= 2 ** 32
+            for _ in range(run):
+                if sample < count:
+                    pts[sample] += delta
+                sample += 1
+
+    # stss: keyframe (không có stss nghĩa là mọi sample đều là keyframe)
+    stss = _find_child(data, stbl, b"stss")
+    if stss is not None:
+        n, pos = _full_box_entries(data, stss)
+        # Bỏ entry trỏ ra ngoài số sample để plan_ranges không nhận keyframe không tồn tại
+        sync_samples = [s - 1 for s in struct.unpack(f">{n}I", data[pos:pos + 4 * n]) if 0 < s <= count] or [0]
+    else:
+        sync_samples = list(range(count))
+
+    return Mp4VideoIndex(timescale=timescale, offsets=offsets, sizes=sizes, pts=pts, sync_samples=sync_samples)
+
+
+def plan_ranges(index: Mp4VideoIndex, num_frames: int) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """
+    Chọn các sample cần lấy và tính các khoảng byte [start, end) cần tải:
+    từ keyframe trước mỗi sample tới sample đó (cộng thêm vài sample cho B-frame).
+
+    Mốc lấy mẫu rải đều theo thời gian hiển thị (pts) như `load_video` khi tải toàn bộ file;
+    với mỗi mốc chọn frame đang hiển thị tại đó (pts lớn nhất không vượt mốc). Khi có B-frame,
+    thứ tự decode khác thứ tự hiển thị nên không thể chọn theo chỉ số sample.
+    """
+    count = index.sample_count
+    if count == 0:
+        raise RangeFetchUnavailable("Video không có frames.")
+    display_order = sorted(range(count), key=index.pts.__getitem__)
+    display_pts = [index.pts[s] for s in display_order]
+    first_pts, last_pts = display_pts[0], display_pts[-1]
+    # Frame cuối cũng hiển thị trong một khoảng: cộng thời lượng trung bình một frame
+    duration = (last_pts - first_pts) * count / (count - 1) if count > 1 else 0
+    targets = []
+    for i in range(num_frames):
+        pos = bisect.bisect_right(display_pts, first_pts + i * duration / num_frames) - 1
+        targets.append(display_order[max(pos, 0)])
+    ranges = []
+    for target in targets:
+        first = index.keyframe_before(target)
+        last = min(count - 1, target + REORDER_LOOKAHEAD)
+        start = min(index.offsets[first:last + 1])
+        end = max(index.offsets[s] + index.sizes[s] for s in range(first, last + 1))
+        ranges.append((start, end))
+    return targets, merge_ranges(ranges, MERGE_GAP_BYTES)
+
+
+def merge_ranges(ranges: Sequence[Tuple[int, int]], gap: int = MERGE_GAP_BYTES) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def _get_range(fetcher: VideoFetcher, url: str, start: int, end: int) -> Tuple[bytes, int]:
+    """
+    Tải byte [start, end] (bao gồm end), trả về (dữ liệu, kích thước file).
+    Server trả khoảng khác khoảng đã xin hoặc gửi nhiều byte hơn bị coi là không hỗ trợ Range:
+    dừng đọc ngay thay vì giữ cả body trong bộ nhớ.
+    """
+    expected = end - start + 1
+    async with fetcher.host_slot(url):
+        async with fetcher.client.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as response:
+            # Kiểm tra trước khi đọc body: server bỏ qua Range sẽ trả về cả file (200),
+            # lỗi với request Range (403, 416, ...) cũng quay về tải toàn bộ
+            if response.status_code != 206:
+                raise RangeFetchUnavailable(f"Server không trả về 206 cho HTTP Range (HTTP {response.status_code}).")
+            match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+            if match is None or match.group(3) == "*":
+                raise RangeFetchUnavailable("Thiếu Content-Range hợp lệ.")
+            if int(match.group(1)) != start or int(match.group(2)) > end:
+                raise RangeFetchUnavailable("Server trả về khoảng byte khác khoảng đã yêu cầu.")
+            content_length = response.headers.get("Content-Length")
+            if content_length is not None and int(content_length) > expected:
+                raise RangeFetchUnavailable("Content-Length lớn hơn khoảng byte đã yêu cầu.")
+            chunks = []
+            received = 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received > expected:
+                    raise RangeFetchUnavailable("Server gửi nhiều byte hơn khoảng đã yêu cầu.")
+                chunks.append(chunk)
+    return b"".join(chunks), int(match.group(3))
+
+
+async def fetch_partial_video(
+    fetcher: VideoFetcher,
+    url: str,
+    num_frames: int = 16,
+    min_size: int = 0,
+) -> PartialVideo:
+    """
+    Tải index + các GOP cần thiết của một MP4 từ xa.
+
+    Ném `RangeFetchUnavailable` khi cần quay về tải toàn bộ file (server không hỗ trợ
+    Range, không phải MP4, file nhỏ hơn `min_size`, hoặc phần cần tải gần bằng cả file).
+    """
+    head, total_size = await _get_range(fetcher, url, 0, HEAD_BYTES - 1)
+    fetcher._check_size(total_size)
+    if total_size < min_size:
+        raise RangeFetchUnavailable("File nhỏ, tải toàn bộ sẽ nhanh hơn.")
+    segments: Dict[int, bytes] = {0: head}
+
+    # Duyệt các box cấp cao nhất để tìm moov (có thể nằm sau mdat)
+    moov_range = None
+    offset = 0
+    while offset < total_size:
+        if offset + 16 <= len(head):
+            header = head[offset:offset + 16]
+        else:
+            header, _ = await _get_range(fetcher, url, offset, min(offset + 15, total_size - 1))
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack(">I4s", header[:8])
+        if size == 1 and len(header) >= 16:
+            size = struct.unpack(">Q", header[8:16])[0]
+        elif size == 0:
+            size = total_size - offset
+        if offset == 0 and box_type != b"ftyp":
+            raise RangeFetchUnavailable("Không phải file MP4/MOV.")
+        if size < 8:
+            raise RangeFetchUnavailable("Box MP4 không hợp lệ.")
+        if box_type == b"moov":
+            moov_range = (offset, offset + size)
+            break
+        offset += size
+    if moov_range is None:
+        raise RangeFetchUnavailable("Không tìm thấy moov.")
+
+    if moov_range[1] <= len(head):
+        moov = head[moov_range[0]:moov_range[1]]
+    else:
+        moov, _ = await _get_range(fetcher, url, moov_range[0], moov_range[1] - 1)
+        segments[moov_range[0]] = moov
+    index = parse_moov(moov)
+    if any(offset + size > total_size for offset, size in zip(index.offsets, index.sizes)):
+        raise RangeFetchUnavailable("Index MP4 trỏ ra ngoài file.")
+
+    targets, ranges = plan_ranges(index, num_frames)
+    needed = sum(end - start for start, end in ranges)
+    if needed >= 0.8 * total_size:
+        raise RangeFetchUnavailable("Các GOP cần thiết gần bằng cả file, tải toàn bộ.")
+
+    results = await asyncio.gather(*(_get_range(fetcher, url, start, end - 1) for start, end in ranges))
+    for (start, _), (data, _) in zip(ranges, results):
+        segments[start] = data
+    fetched = sum(len(data) for data in segments.values())
+
+    # Mốc thời gian hiển thị của các frame cần lấy, tính từ frame hiển thị đầu tiên
+    first_pts = min(index.pts)
+    times = [(index.pts[t] - first_pts) / index.timescale for t in targets]
+    # moov chứa offset/kích thước mọi sample nên đủ làm khoá cache theo nội dung
+    content_key = hashlib.sha256(moov + str(total_size).encode()).hexdigest()
+    return PartialVideo(
+        file=SparseFile(total_size, segments),
+        times=times,
+        fetched_bytes=fetched,
+        total_bytes=total_size,
+        content_key=content_key,
+    )
+
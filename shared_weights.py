@@ -0,0 +1,178 @@
+"""
+Chia sẻ một bản weights giữa nhiều worker uvicorn bằng mmap file safetensors.
+
+Mỗi worker map file `model.safetensors` ở chế độ chỉ đọc; tensor của model trỏ thẳng
+vào các page đó (không copy), nên page cache của kernel được dùng chung giữa các
+worker thay vì mỗi worker giữ một bản weights riêng.
+
+    # chỉ cần nếu model được lưu dạng pytorch_model.bin
+    python shared_weights.py convert ./videomae_finetuned_final
+
+    VIDEOMAE_SHARED_WEIGHTS=1 uvicorn app:app --workers 4
+
+    # RSS / PSS của từng worker (PSS chia phần dùng chung cho số process dùng nó)
+    python shared_weights.py report <pid của uvicorn master>
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import sys
+import warnings
+from typing import Dict, List, Optional, Sequence
+
+import torch
+
+from metrics import memory_usage
+
+SAFETENSORS_NAME = "model.safetensors"
+
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def worker_count() -> Optional[int]:
+    """
+    Số worker của server nếu biết: WEB_CONCURRENCY, hoặc `--workers N` / `-w N` trên dòng lệnh
+    uvicorn/gunicorn (`uvicorn --workers` không đặt WEB_CONCURRENCY; worker spawn nhận lại
+    sys.argv của process cha). None khi không xác định được.
+    """
+    value = os.environ.get("WEB_CONCURRENCY")
+    # `python -m uvicorn` có argv[0] là .../uvicorn/__main__.py
+    program = os.path.join(*os.path.normpath(sys.argv[0]).split(os.sep)[-2:]) if sys.argv and sys.argv[0] else ""
+    if not value and ("uvicorn" in program or "gunicorn" in program):
+        args = sys.argv[1:]
+        for i, arg in enumerate(args):
+            if arg.startswith("--workers="):
+                value = arg.split("=", 1)[1]
+            elif arg in ("--workers", "-w") and i + 1 < len(args):
+                value = args[i + 1]
+    try:
+        return max(1, int(value)) if value else None
+    except ValueError:
+        return None
+
+
+def default_num_threads() -> int:
+    """
+    Số thread intra-op cho mỗi worker: chia đều số core cho số worker (`worker_count`, mặc định 1).
+    """
+    workers = worker_count() or 1
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Đọc header safetensors và tạo tensor chỉ đọc trỏ vào vùng mmap của file.
+    Vùng map được giữ sống bởi chính các tensor.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = 8 + header_size
+    tensors: Dict[str, torch.Tensor] = {}
+    with warnings.catch_warnings():
+        # Buffer chỉ đọc là chủ đích: weights không bao giờ bị ghi lúc inference
+        warnings.filterwarnings("ignore", message="The given buffer is not writable")
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            dtype = _DTYPES.get(info["dtype"])
+            if dtype is None:
+                raise ValueError(f"Không hỗ trợ dtype {info['dtype']} của tensor {name}")
+            start, end = info["data_offsets"]
+            count = (end - start) // torch.empty((), dtype=dtype).element_size()
+            tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + start)
+            tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def load_shared_model(model_path: str) -> torch.nn.Module:
+    """
+    Dựng model từ config rồi gán (không copy) các tensor mmap vào parameter/buffer.
+    Các weights khởi tạo ngẫu nhiên ban đầu được giải phóng ngay sau khi gán.
+    Head MLP (head.json + head.pt) thay Linear giữ chỗ sau khi nạp; head nhỏ nên không cần mmap.
+    """
+    from transformers import AutoConfig, AutoModelForVideoClassification
+
+    from embedding_head import attach_head, has_custom_head
+
+    weights_path = os.path.join(model_path, SAFETENSORS_NAME)
+    if not os.path.exists(weights_path):
+        raise FileNotFoundError(
+            f"Không tìm thấy {weights_path}. Hãy chạy `python shared_weights.py convert {model_path}` trước."
+        )
+    config = AutoConfig.from_pretrained(model_path)
+    model = AutoModelForVideoClassification.from_config(config)
+    model.load_state_dict(mmap_safetensors(weights_path), strict=True, assign=True)
+    if has_custom_head(model_path):
+        model = attach_head(model, model_path)
+    model.eval()
+    return model
+
+
+def convert(model_path: str) -> str:
+    """Lưu lại weights của model dưới dạng model.safetensors trong cùng thư mục."""
+    from safetensors.torch import save_file
+    from transformers import AutoModelForVideoClassification
+
+    model = AutoModelForVideoClassification.from_pretrained(model_path)
+    state_dict = {name: tensor.contiguous() for name, tensor in model.state_dict().items()}
+    path = os.path.join(model_path, SAFETENSORS_NAME)
+    save_file(state_dict, path, metadata={"format": "pt"})
+    return path
+
+
+def _children(pid: int) -> List[int]:
+    children: List[int] = []
+    task_dir = f"/proc/{pid}/task"
+    for tid in os.listdir(task_dir):
+        try:
+            with open(f"{task_dir}/{tid}/children", "r") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return children
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Weights dùng chung giữa các worker (mmap safetensors)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert_cmd = sub.add_parser("convert", help="Lưu weights thành model.safetensors")
+    convert_cmd.add_argument("model_path")
+    report_cmd = sub.add_parser("report", help="RSS/PSS của master và từng worker")
+    report_cmd.add_argument("pid", type=int, help="PID của process uvicorn master")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        print(f"✓ Đã lưu {convert(args.model_path)}")
+        return 0
+
+    mb = 1024 * 1024
+    print(f"{'pid':>8} {'rss_mb':>10} {'pss_mb':>10} {'shared_mb':>10}")
+    total_pss = 0
+    for pid in [args.pid] + _children(args.pid):
+        usage = memory_usage(str(pid))
+        total_pss += usage["pss"]
+        print(f"{pid:>8} {usage['rss'] / mb:>10.1f} {usage['pss'] / mb:>10.1f} {usage['shared'] / mb:>10.1f}")
+    print(f"Tổng PSS: {total_pss / mb:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
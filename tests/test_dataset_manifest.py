@@ -0,0 +1,35 @@
+"""Kiểm tra validate_video không cách ly video ngắn hợp lệ."""
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("av")
+
+from dataset_manifest import validate_video  # noqa: E402
+from extract_frames import load_video  # noqa: E402
+
+
+def _write_clip(path, num_frames, size=(64, 48), fps=8.0):
+    width, height = size
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        pytest.skip("OpenCV không có encoder mp4v")
+    for i in range(num_frames):
+        frame = np.full((height, width, 3), i * 30 % 256, dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+
+
+def test_short_valid_clip_is_not_quarantined(tmp_path):
+    path = tmp_path / "short.mp4"
+    _write_clip(path, num_frames=6)
+
+    stats = {}
+    frames = load_video(str(path), 16, size=32, stats=stats)
+    assert len(frames) == 16
+    # 6 frame được lặp để đủ 16 vị trí nhưng không frame nào bị tính là lỗi decode
+    assert stats["repeated_frames"] > 0
+    assert stats["failed_frames"] == 0
+
+    result = validate_video(str(path), num_frames=16)
+    assert result["valid"], result["validate_error"]
@@ -0,0 +1,50 @@
+"""Kiểm tra load_video_from_file chọn seek cho video dài và lấy đúng các frame như load_video."""
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("av")
+
+from extract_frames import load_video, load_video_from_file  # noqa: E402
+
+
+def _write_ramp(path, num_frames, size=(64, 48), fps=8.0):
+    """Clip mà độ sáng frame thứ i tăng dần theo i, để so frame lấy được bằng giá trị trung bình."""
+    width, height = size
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        pytest.skip("OpenCV không có encoder mp4v")
+    for i in range(num_frames):
+        value = int(i * 255 / max(num_frames - 1, 1))
+        writer.write(np.full((height, width, 3), value, dtype=np.uint8))
+    writer.release()
+
+
+def test_long_upload_is_sampled_by_seeking(tmp_path):
+    path = tmp_path / "long.mp4"
+    _write_ramp(path, num_frames=300)
+
+    stats = {}
+    frames = load_video_from_file(io.BytesIO(path.read_bytes()), 16, stats=stats)
+    reference = load_video(str(path), 16, strategy="sequential")
+
+    assert stats["strategy"] == "seek"
+    assert stats["failed_frames"] == 0
+    assert frames.shape == reference.shape
+    # Mốc theo thời gian và theo chỉ số frame có thể lệch nhau một frame (~1 mức sáng)
+    diff = np.abs(frames.reshape(16, -1).mean(axis=1) - reference.reshape(16, -1).mean(axis=1))
+    assert diff.max() < 3.0
+
+
+def test_short_upload_is_decoded_sequentially(tmp_path):
+    path = tmp_path / "short.mp4"
+    _write_ramp(path, num_frames=6)
+
+    stats = {}
+    frames = load_video_from_file(io.BytesIO(path.read_bytes()), 16, size=32, stats=stats)
+
+    assert len(frames) == 16
+    assert stats["strategy"] == "sequential"
+    assert stats["failed_frames"] == 0
@@ -0,0 +1,33 @@
+"""Kiểm tra ClipPreprocessor cho cùng pixel_values với VideoMAEImageProcessor của HuggingFace."""
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from fast_preprocess import ClipPreprocessor, check_equivalence  # noqa: E402
+
+# Frames đã resize lúc decode (đường chạy của service) chỉ còn crop + rescale + normalize
+ATOL = 1e-4
+
+
+@pytest.fixture(scope="module")
+def processor():
+    return transformers.VideoMAEImageProcessor()
+
+
+@pytest.mark.parametrize("width", [224, 398])
+def test_matches_hf_processor_at_decoded_size(processor, width):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=(16, 224, width, 3), dtype=np.uint8)
+    assert check_equivalence(processor, frames) < ATOL
+
+
+def test_batch_matches_single_clips(processor):
+    rng = np.random.default_rng(1)
+    clips = rng.integers(0, 256, size=(2, 16, 224, 398, 3), dtype=np.uint8)
+    fast = ClipPreprocessor.from_processor(processor)
+    batch = fast(clips)
+    assert batch.shape == (2, 16, 3, 224, 224)
+    for i in range(2):
+        assert torch.allclose(batch[i], fast(clips[i])[0], atol=ATOL)
@@ -0,0 +1,59 @@
+"""Kiểm tra fingerprint near-duplicate bỏ qua clip quá ít chi tiết (frame đen / một màu)."""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from near_duplicate import NearDuplicateIndex, frame_fingerprint, is_informative  # noqa: E402
+
+# pixel_values sau normalize ImageNet: (x / 255 - mean) / std
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(1, 3, 1, 1)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(1, 3, 1, 1)
+
+
+def _normalize(frames):
+    """frames (T, H, W, 3) uint8 -> pixel_values (1, T, 3, H, W)."""
+    clip = frames.astype(np.float32).transpose(0, 3, 1, 2) / 255.0
+    return ((clip - MEAN) / STD)[None]
+
+
+def _textured(seed, num_frames=16, size=64):
+    """Clip có cấu trúc thô (nhiễu khối phóng to) trôi chậm theo thời gian."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, (num_frames + 8, 8, 3)).astype(np.float32)
+    frames = [np.kron(base[i:i + 8], np.ones((size // 8, size // 8, 1))) for i in range(num_frames)]
+    return _normalize(np.stack(frames).astype(np.uint8))
+
+
+def _uniform(value, num_frames=16, size=64, noise=0, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = value + rng.integers(-noise, noise + 1, (num_frames, size, size, 3))
+    return _normalize(np.clip(frames, 0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize("value, noise", [(0, 0), (255, 0), (16, 3), (40, 3)])
+def test_low_information_clips_are_skipped(value, noise):
+    assert not is_informative(_uniform(value, noise=noise, seed=value))
+
+
+def test_mostly_black_clip_is_skipped():
+    # Fade-in: ba frame đầu đen, chỉ frame cuối có nội dung -> vẫn quá ít chi tiết
+    clip = _uniform(0)
+    clip[0, -3:] = _textured(0)[0, -3:]
+    assert not is_informative(clip)
+
+
+def test_textured_clip_matches_perturbed_copy_only(tmp_path):
+    index = NearDuplicateIndex(path=str(tmp_path / "dedup.npz"))
+    clip = _textured(0)
+    assert is_informative(clip)
+    index.add(frame_fingerprint(clip), np.array([0.9, 0.1], dtype=np.float32))
+
+    rng = np.random.default_rng(3)
+    perturbed = clip + rng.normal(0, 0.05, clip.shape).astype(np.float32)
+    match = index.lookup(frame_fingerprint(perturbed))
+    assert match is not None
+    assert np.allclose(match[0], [0.9, 0.1])
+
+    other = _textured(1)
+    assert is_informative(other)
+    assert index.lookup(frame_fingerprint(other)) is None
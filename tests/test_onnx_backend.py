@@ -0,0 +1,46 @@
+"""Kiểm tra logits của model export ONNX khớp với PyTorch (model VideoMAE nhỏ khởi tạo ngẫu nhiên)."""
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from embedding_head import HEAD_CONFIG_NAME, HEAD_WEIGHTS_NAME, build_head  # noqa: E402
+from onnx_backend import check_parity, export_onnx  # noqa: E402
+
+ATOL = 1e-4
+
+
+def _tiny_model(path, mlp_hidden=0):
+    config = transformers.VideoMAEConfig(
+        image_size=32,
+        patch_size=16,
+        num_frames=4,
+        tubelet_size=2,
+        hidden_size=32,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=64,
+        num_labels=2,
+    )
+    torch.manual_seed(0)
+    transformers.VideoMAEForVideoClassification(config).save_pretrained(str(path))
+    if mlp_hidden:
+        # Head MLP như `embedding_head.py train --mlp-hidden`
+        head = build_head(config.hidden_size, mlp_hidden, 0.1, 2)
+        torch.save(head.state_dict(), path / HEAD_WEIGHTS_NAME)
+        (path / HEAD_CONFIG_NAME).write_text(
+            json.dumps({"hidden_size": config.hidden_size, "mlp_hidden": mlp_hidden, "dropout": 0.1, "num_labels": 2})
+        )
+    return path
+
+
+@pytest.mark.parametrize("mlp_hidden", [0, 16])
+def test_onnx_logits_match_torch(tmp_path, mlp_hidden):
+    model_path = _tiny_model(tmp_path / "model", mlp_hidden)
+    onnx_path = export_onnx(str(model_path))
+    # batch 2 khác batch 1 lúc export: kiểm tra luôn trục batch động
+    assert check_parity(str(model_path), onnx_path, batch_size=2) < ATOL
@@ -0,0 +1,221 @@
+"""Kiểm tra đọc MP4 từng phần bằng HTTP Range với một server Range cục bộ."""
+import asyncio
+import io
+import re
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+
+import remote_video  # noqa: E402
+from remote_video import (  # noqa: E402
+    Mp4VideoIndex,
+    RangeFetchUnavailable,
+    SparseFile,
+    _iter_boxes,
+    fetch_partial_video,
+    merge_ranges,
+    parse_moov,
+    plan_ranges,
+)
+from video_fetcher import VideoFetcher  # noqa: E402
+
+NUM_SAMPLES = 400
+
+
+def _encode(path, faststart):
+    """MP4 (mpeg4, GOP 10) mà độ sáng frame thứ i tăng dần theo i, cộng nhiễu để frame không quá nhỏ."""
+    av = pytest.importorskip("av")
+    np = pytest.importorskip("numpy")
+    container = av.open(str(path), "w", format="mp4", options={"movflags": "faststart"} if faststart else {})
+    stream = container.add_stream("mpeg4", rate=25)
+    stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+    stream.codec_context.gop_size = 10
+    stream.bit_rate = 4_000_000
+    rng = np.random.default_rng(0)
+    for i in range(NUM_SAMPLES):
+        noise = rng.integers(-20, 21, (48, 64, 3))
+        image = np.clip(i * 255 / (NUM_SAMPLES - 1) + noise, 0, 255).astype(np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(image, format="rgb24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+    return path.read_bytes()
+
+
+def _top_level(data):
+    return {box_type: (offset, size) for box_type, offset, _, size in _iter_boxes(data)}
+
+
+def _moov(data):
+    offset, size = _top_level(data)[b"moov"]
+    return data[offset:offset + size]
+
+
+@pytest.fixture(scope="module")
+def videos(tmp_path_factory):
+    root = tmp_path_factory.mktemp("videos")
+    return {
+        "faststart.mp4": _encode(root / "faststart.mp4", faststart=True),
+        "moov_end.mp4": _encode(root / "moov_end.mp4", faststart=False),
+    }
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """
+    Phục vụ `server.files` với HTTP Range. Tiền tố đường dẫn chọn cách server cư xử sai:
+    /ignore-range/ (trả 200 cả file), /forbidden/ (416), /oversize/ (206 nhưng gửi thừa byte).
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        mode, _, name = self.path.lstrip("/").rpartition("/")
+        data = self.server.files.get(name)
+        if data is None:
+            self.send_error(404)
+            return
+        self.server.requests.append((mode, self.headers.get("Range")))
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if match is None or mode == "ignore-range":
+            self._send(200, data, {})
+            return
+        if mode == "forbidden":
+            self._send(416, b"", {"Content-Range": f"bytes */{len(data)}"})
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+        body = data[start:end + 1]
+        headers = {"Content-Range": f"bytes {start}-{end}/{len(data)}"}
+        if mode == "oversize":
+            # Không gửi Content-Length: body chỉ kết thúc khi đóng kết nối
+            self.send_response(206)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body + b"\0" * 1024)
+            self.close_connection = True
+            return
+        self._send(206, body, headers)
+
+    def _send(self, status, body, headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(videos):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    httpd.files = dict(videos)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server, name, mode="ok"):
+    return f"http://127.0.0.1:{server.server_address[1]}/{mode}/{name}"
+
+
+def _fetch(url, **kwargs):
+    async def run():
+        fetcher = VideoFetcher(max_bytes=100 * 1024 * 1024)
+        try:
+            return await fetch_partial_video(fetcher, url, **kwargs)
+        finally:
+            await fetcher.aclose()
+
+    return asyncio.run(run())
+
+
+def test_iter_boxes_and_parse_moov(videos):
+    for data in videos.values():
+        boxes = _top_level(data)
+        assert {b"ftyp", b"moov", b"mdat"} <= set(boxes)
+        index = parse_moov(_moov(data))
+        assert index.sample_count == NUM_SAMPLES
+        mdat_offset, mdat_size = boxes[b"mdat"]
+        # Mọi sample nằm trong mdat và sample đầu tiên là keyframe
+        assert all(mdat_offset <= o and o + s <= mdat_offset + mdat_size for o, s in zip(index.offsets, index.sizes))
+        assert index.sync_samples[0] == 0
+    assert _top_level(videos["faststart.mp4"])[b"moov"][0] < _top_level(videos["faststart.mp4"])[b"mdat"][0]
+    assert _top_level(videos["moov_end.mp4"])[b"moov"][0] > _top_level(videos["moov_end.mp4"])[b"mdat"][0]
+
+
+def test_plan_ranges_uses_presentation_order():
+    # Thứ tự decode I P B B P B B: pts khác chỉ số sample
+    pts = [0, 3, 1, 2, 6, 4, 5]
+    index = Mp4VideoIndex(
+        timescale=1, offsets=[i * 10 for i in range(7)], sizes=[10] * 7, pts=pts, sync_samples=[0]
+    )
+    targets, ranges = plan_ranges(index, 7)
+    assert [pts[t] for t in targets] == list(range(7))
+    assert ranges == [(0, 70)]
+
+
+def test_merge_ranges():
+    assert merge_ranges([(50, 60), (0, 10), (12, 20)], gap=2) == [(0, 20), (50, 60)]
+    assert merge_ranges([(0, 10), (5, 30)], gap=0) == [(0, 30)]
+    assert merge_ranges([], gap=0) == []
+
+
+def test_sparse_file_reads_zeros_outside_segments():
+    sparse = SparseFile(10, {2: b"abc", 7: b"xy"})
+    assert sparse.read() == b"\0\0abc\0\0xy\0"
+    sparse.seek(-4, 2)
+    assert sparse.read(3) == b"\0xy"
+    assert sparse.tell() == 9
+
+
+@pytest.mark.parametrize("name", ["faststart.mp4", "moov_end.mp4"])
+def test_fetch_partial_video_matches_full_decode(server, videos, name, monkeypatch):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("cv2")
+    from extract_frames import load_video_at_times, load_video_from_file
+
+    # File test nhỏ: không gộp các khoảng để thật sự chỉ tải một phần
+    monkeypatch.setattr(remote_video, "MERGE_GAP_BYTES", 0)
+    partial = _fetch(_url(server, name))
+    try:
+        assert partial.total_bytes == len(videos[name])
+        assert partial.fetched_bytes < 0.8 * partial.total_bytes
+        assert all(mode == "ok" and header for mode, header in server.requests)
+        stats = {}
+        frames = load_video_at_times(partial.file, partial.times, stats=stats)
+    finally:
+        partial.close()
+    assert stats["failed_frames"] == 0
+    reference = load_video_from_file(io.BytesIO(videos[name]), 16)
+    diff = np.abs(frames.reshape(16, -1).mean(axis=1) - reference.reshape(16, -1).mean(axis=1))
+    assert diff.max() < 4.0
+
+
+@pytest.mark.parametrize("mode", ["ignore-range", "forbidden", "oversize"])
+def test_misbehaving_server_falls_back(server, mode):
+    with pytest.raises(RangeFetchUnavailable):
+        _fetch(_url(server, "faststart.mp4", mode))
+
+
+def test_malformed_moov_falls_back(server, videos):
+    moov = _moov(videos["faststart.mp4"])
+    with pytest.raises(RangeFetchUnavailable):
+        parse_moov(moov[:len(moov) // 2])
+
+    # Số sample trong stsz lớn hơn bảng thật: index trỏ ra ngoài dữ liệu
+    data = bytearray(videos["faststart.mp4"])
+    stsz = bytes(data).index(b"stsz")
+    data[stsz + 12:stsz + 16] = struct.pack(">I", 10 ** 6)
+    server.files["broken.mp4"] = bytes(data)
+    with pytest.raises(RangeFetchUnavailable):
+        _fetch(_url(server, "broken.mp4"))
@@ -0,0 +1,89 @@
+"""
+Tải video từ URL bằng một httpx.AsyncClient dùng chung (connection pool, keep-alive),
+giới hạn số kết nối theo từng host và từ chối file quá lớn ngay từ Content-Length.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from typing import BinaryIO, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class PayloadTooLargeError(ValueError):
+    """Video vượt quá giới hạn kích thước cho phép."""
+
+
+class VideoFetcher:
+    """
+    Client tải video dùng chung cho toàn service.
+
+    Args:
+        max_bytes: kích thước tối đa của một video
+        connect_timeout / read_timeout: timeout kết nối và timeout giữa các lần đọc (giây)
+        max_connections: tổng số kết nối đồng thời của pool
+        max_per_host: số request đồng thời tối đa tới cùng một host
+        chunk_size: kích thước mỗi lần đọc body
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        max_connections: int = 64,
+        max_per_host: int = 8,
+        chunk_size: int = 2 * 1024 * 1024,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_per_host = max_per_host
+        self.chunk_size = chunk_size
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(connect=connect_timeout, read=read_timeout, write=read_timeout, pool=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    def host_slot(self, url: str) -> asyncio.Semaphore:
+        """Semaphore giới hạn số request đồng thời tới host của `url`."""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = asyncio.Semaphore(self.max_per_host)
+            self._host_slots[host] = slot
+        return slot
+
+    def _check_size(self, size: Optional[int]) -> None:
+        if size is not None and size > self.max_bytes:
+            limit_mb = self.max_bytes // (1024 * 1024)
+            raise PayloadTooLargeError(f"Kích thước video vượt quá giới hạn {limit_mb}MB.")
+
+    async def fetch(self, url: str, sink: BinaryIO, digest: Optional["hashlib._Hash"] = None) -> int:
+        """
+        Stream body của `url` vào `sink`, trả về số byte đã ghi.
+        Từ chối trước khi đọc body nếu Content-Length vượt quá `max_bytes`;
+        nếu truyền `digest` (vd. hashlib.sha256()) thì cập nhật hash trong lúc stream.
+        """
+        async with self.host_slot(url):
+            async with self.client.stream("GET", url) as response:
+                response.raise_for_status()
+                content_length = response.headers.get("Content-Length")
+                if content_length and content_length.isdigit():
+                    self._check_size(int(content_length))
+                total = 0
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    if not chunk:
+                        continue
+                    total += len(chunk)
+                    self._check_size(total)
+                    if digest is not None:
+                        digest.update(chunk)
+                    sink.write(chunk)
+        return total
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
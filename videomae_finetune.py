@@ -1,104 +1,132 @@
 """
 Script fine-tune VideoMAE để phân loại video tích cực/tiêu cực
 """
+import json
 import os
+import time
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset
 from transformers import (
     AutoProcessor,
     AutoModelForVideoClassification,
+    TrainerCallback,
     TrainingArguments,
     Trainer
 )
+from clip_cache import ClipShardDataset
+from dataset_manifest import MANIFEST_NAME, QUARANTINE_NAME, build_manifest, is_usable, stratified_split
 from extract_frames import load_video
+from fast_preprocess import ClipPreprocessor
+from inference_service import decode_size
 import numpy as np
-from pathlib import Path
 
-# Cấu hình
+# Model mặc định
 primary_model_name = "MCG-NJU/videomae-base-finetuned-kinetics-400"  # model fine-tuned trên Kinetics-400 (khó truy cập)
 fallback_model_name = "MCG-NJU/videomae-base"  # model base công khai
-model_name = primary_model_name
-num_frames = 16
-batch_size = 2
-learning_rate = 5e-5
-num_epochs = 3
 
-# Đường dẫn dataset
-dataset_path = "dataset"  # Thay đổi theo đường dẫn dataset của bạn
-positive_folder = os.path.join(dataset_path, "positive")
-negative_folder = os.path.join(dataset_path, "negative")
+
+def parse_args(argv=None):
+    """Tham số dòng lệnh của script training"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Fine-tune VideoMAE phân loại video Positive/Negative")
+    parser.add_argument("--model", default=primary_model_name, help="Model pre-trained (tự thử fallback nếu không tải được)")
+    parser.add_argument("--data-dir", default="dataset", help="Thư mục chứa positive/ và negative/")
+    parser.add_argument("--output-dir", default="./videomae_finetuned", help="Thư mục checkpoint")
+    parser.add_argument("--final-dir", default="./videomae_finetuned_final", help="Thư mục lưu model cuối cùng")
+    parser.add_argument("--num-frames", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=2, help="Batch size mỗi thiết bị")
+    parser.add_argument("--grad-accum", type=int, default=1, help="Số step gradient accumulation (batch hiệu dụng = batch-size x grad-accum)")
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--epochs", type=float, default=3)
+    parser.add_argument("--max-steps", type=int, default=-1, help="Dừng sau số step này (đo nhanh một cấu hình)")
+    parser.add_argument("--precision", choices=("fp32", "bf16", "fp16"), default="fp32",
+                        help="Mixed precision autocast: bf16 chạy được trên CPU, fp16 cần GPU")
+    parser.add_argument("--gradient-checkpointing", action="store_true",
+                        help="Tính lại activation của encoder lúc backward để giảm bộ nhớ")
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42, help="Seed chia train/val và training")
+    parser.add_argument("--num-workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Số process DataLoader decode/preprocess song song")
+    parser.add_argument("--prefetch-factor", type=int, default=2)
+    parser.add_argument("--clip-cache", default=os.environ.get("VIDEOMAE_CLIP_CACHE") or None,
+                        help="Thư mục clip cache (python clip_cache.py build); mặc định decode video mỗi epoch")
+    parser.add_argument("--logging-steps", type=int, default=10)
+    return parser.parse_args(argv)
 
 
 class VideoDataset(Dataset):
     """Dataset cho video classification"""
     
-    def __init__(self, video_paths, labels, processor, num_frames=16):
+    def __init__(self, video_paths, labels, processor, num_frames=16, fast_preprocess=True):
         self.video_paths = video_paths
         self.labels = labels
         self.processor = processor
         self.num_frames = num_frames
+        self.size = decode_size(processor)
+        # Mặc định tiền xử lý vectorized (cùng đường chạy với service)
+        self.fast_preprocessor = ClipPreprocessor.from_processor(processor) if fast_preprocess else None
+        # Video decode lỗi trong process worker này (không được lấy mẫu lại)
+        self.failed = set()
     
     def __len__(self):
         return len(self.video_paths)
     
-    def __getitem__(self, idx):
-        video_path = self.video_paths[idx]
-        label = self.labels[idx]
-        
+    def _preprocess(self, frames):
+        if self.fast_preprocessor is not None:
+            return {"pixel_values": self.fast_preprocessor(frames)[0]}
         try:
-            # Trích xuất frames
-            frames = load_video(video_path, self.num_frames)
-            
-            # Xử lý frames
-            try:
-                inputs = self.processor(
-                    videos=list(frames),
-                    return_tensors="pt"
-                )
-            except TypeError:
-                inputs = self.processor(
-                    images=list(frames),
-                    return_tensors="pt"
-                )
-            
-            # Loại bỏ batch dimension từ processor
-            inputs = {k: v.squeeze(0) for k, v in inputs.items()}
-            inputs['labels'] = torch.tensor(label, dtype=torch.long)
-            
-            return inputs
-        except Exception as e:
-            print(f"Lỗi khi xử lý video {video_path}: {e}")
-            # Trả về dummy data nếu có lỗi
-            dummy_frames = np.zeros((self.num_frames, 224, 224, 3), dtype=np.uint8)
+            inputs = self.processor(
+                videos=list(frames),
+                return_tensors="pt"
+            )
+        except TypeError:
+            inputs = self.processor(
+                images=list(frames),
+                return_tensors="pt"
+            )
+        # Loại bỏ batch dimension từ processor
+        return {k: v.squeeze(0) for k, v in inputs.items()}
+    
+    def __getitem__(self, idx):
+        # Video lỗi được bỏ qua: lấy video kế tiếp thay vì train trên clip toàn số 0
+        for offset in range(len(self.video_paths)):
+            current = (idx + offset) % len(self.video_paths)
+            video_path = self.video_paths[current]
+            if video_path in self.failed:
+                continue
             try:
-                inputs = self.processor(videos=list(dummy_frames), return_tensors="pt")
-            except TypeError:
-                inputs = self.processor(images=list(dummy_frames), return_tensors="pt")
-            inputs = {k: v.squeeze(0) for k, v in inputs.items()}
-            inputs['labels'] = torch.tensor(label, dtype=torch.long)
+                frames = load_video(video_path, self.num_frames, size=self.size)
+            except Exception as e:
+                # Chỉ xảy ra với video hỏng sau khi manifest được kiểm tra; không thử lại ở epoch sau
+                self.failed.add(video_path)
+                print(f"⚠️ Bỏ qua video lỗi {video_path}: {e} (chạy lại dataset_manifest.py --validate để cách ly)")
+                continue
+            inputs = self._preprocess(frames)
+            inputs['labels'] = torch.tensor(self.labels[current], dtype=torch.long)
             return inputs
+        raise RuntimeError("Không còn video nào decode được trong dataset")
 
 
-def prepare_dataset():
-    """Chuẩn bị dataset từ thư mục"""
-    video_paths = []
-    labels = []
-    
-    # Load videos tích cực (label = 0)
-    if os.path.exists(positive_folder):
-        for video_file in Path(positive_folder).glob("*.mp4"):
-            video_paths.append(str(video_file))
-            labels.append(0)  # 0 = positive
-    
-    # Load videos tiêu cực (label = 1)
-    if os.path.exists(negative_folder):
-        for video_file in Path(negative_folder).glob("*.mp4"):
-            video_paths.append(str(video_file))
-            labels.append(1)  # 1 = negative
+def prepare_dataset(dataset_path="dataset", val_fraction=0.2, split_seed=42, num_frames=16):
+    """
+    Chuẩn bị dataset từ manifest (tạo/cập nhật bằng dataset_manifest, chỉ dò lại video
+    mới hoặc đã thay đổi, video hỏng bị cách ly) và chia train/val theo nhãn với seed cố định
+    """
+    manifest_path = os.path.join(dataset_path, MANIFEST_NAME)
+    manifest, stats = build_manifest(dataset_path, manifest_path, validate=True, num_frames=num_frames)
+    print(f"   - Manifest: {stats['probed']} video dò mới, {stats['reused']} dùng lại, {stats['removed']} đã xoá")
+    entries = [entry for entry in manifest["videos"] if is_usable(entry)]
+    if stats["quarantined"]:
+        quarantine_path = os.path.join(os.path.dirname(manifest_path), QUARANTINE_NAME)
+        print(
+            f"   ⚠️ Cách ly {stats['quarantined']} video không decode được (xem {quarantine_path}); "
+            f"tránh được ~{stats['time_lost_s']:.1f}s decode vô ích mỗi epoch"
+        )
     
-    if len(video_paths) == 0:
+    if len(entries) == 0:
         raise ValueError(
-            f"Không tìm thấy video nào trong {positive_folder} hoặc {negative_folder}\n"
+            f"Không tìm thấy video nào trong {dataset_path}/positive hoặc {dataset_path}/negative\n"
             "Vui lòng tạo dataset với cấu trúc:\n"
             "dataset/\n"
             "  ├── positive/\n"
@@ -109,57 +137,168 @@ def prepare_dataset():
             "      └── ..."
         )
     
-    print(f"Tìm thấy {len(video_paths)} videos:")
+    labels = [entry["label"] for entry in entries]
+    print(f"Tìm thấy {len(entries)} videos:")
     print(f"  - Positive: {labels.count(0)} videos")
     print(f"  - Negative: {labels.count(1)} videos")
     
-    # Chia train/val (80/20)
-    split_idx = int(len(video_paths) * 0.8)
-    train_paths = video_paths[:split_idx]
-    train_labels = labels[:split_idx]
-    val_paths = video_paths[split_idx:]
-    val_labels = labels[split_idx:]
+    # Chia train/val giữ tỉ lệ positive/negative, cùng seed thì cùng cách chia
+    train, val = stratified_split(entries, val_fraction, split_seed)
+    train_paths = [entry["path"] for entry in train]
+    train_labels = [entry["label"] for entry in train]
+    val_paths = [entry["path"] for entry in val]
+    val_labels = [entry["label"] for entry in val]
     
     return train_paths, train_labels, val_paths, val_labels
 
 
 def collate_fn(batch):
-    """Custom collate function để xử lý batch"""
-    # Lấy keys từ batch đầu tiên
-    keys = batch[0].keys()
+    """Gom các mẫu {pixel_values, labels} thành batch (dùng làm data_collator của Trainer)"""
+    return {key: torch.stack([item[key] for item in batch]) for key in batch[0].keys()}
+
+
+class DataWaitCallback(TrainerCallback):
+    """
+    Đo thời gian chờ dữ liệu và thời gian tính toán của từng optimizer step.
+    
+    Với `--grad-accum N` một step gồm N micro-batch và Trainer lấy từng micro-batch từ
+    DataLoader giữa các lần forward/backward, nên không đo được bằng on_step_begin/on_step_end.
+    TimedTrainer báo đầu/cuối mỗi `training_step` (một micro-batch): thời gian chờ dữ liệu là
+    khoảng trống trước mỗi micro-batch, phần còn lại của step (forward + backward + optimizer)
+    là tính toán. Ghi từng step vào <output_dir>/step_timing.jsonl và in trung bình mỗi `logging_steps`.
+    """
     
-    # Tạo batch dictionary
-    batch_dict = {}
-    for key in keys:
-        if key == 'labels':
-            batch_dict[key] = torch.stack([item[key] for item in batch])
-        else:
-            # Stack các tensors
-            batch_dict[key] = torch.stack([item[key] for item in batch])
+    def __init__(self):
+        self.records = []
+        self._last_end = None
+        self._step_start = None
+        self._wait = 0.0
+        self._micro_batches = 0
+        self._file = None
     
-    return batch_dict
+    def _reset(self):
+        now = time.perf_counter()
+        self._last_end = now
+        self._step_start = now
+        self._wait = 0.0
+        self._micro_batches = 0
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        os.makedirs(args.output_dir, exist_ok=True)
+        self._file = open(os.path.join(args.output_dir, "step_timing.jsonl"), "a", encoding="utf-8")
+        self._reset()
+    
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        # Thời gian eval/lưu checkpoint giữa các epoch không tính là chờ dữ liệu
+        self._reset()
+    
+    def micro_batch_begin(self):
+        self._wait += time.perf_counter() - self._last_end
+        self._micro_batches += 1
+    
+    def micro_batch_end(self):
+        if torch.cuda.is_available():
+            # Kernel CUDA chạy bất đồng bộ: chờ xong để đo đúng thời gian tính toán
+            torch.cuda.synchronize()
+        self._last_end = time.perf_counter()
+    
+    def on_step_end(self, args, state, control, **kwargs):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        record = {
+            "step": state.global_step,
+            "micro_batches": self._micro_batches,
+            "data_wait_s": self._wait,
+            "compute_s": now - self._step_start - self._wait,
+        }
+        self.records.append(record)
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+        self._last_end = now
+        self._step_start = now
+        self._wait = 0.0
+        self._micro_batches = 0
+        if args.logging_steps and state.global_step % args.logging_steps == 0:
+            self._report(self.records[-int(args.logging_steps):], f"step {state.global_step}")
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.records:
+            self._report(self.records, "toàn bộ training")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    @staticmethod
+    def _report(records, title):
+        wait = sum(r["data_wait_s"] for r in records)
+        compute = sum(r["compute_s"] for r in records)
+        total = wait + compute
+        bound = "I/O (dữ liệu)" if wait > compute else "compute"
+        print(
+            f"   ⏱ {title}: chờ dữ liệu {wait / len(records):.3f}s/step, "
+            f"tính toán {compute / len(records):.3f}s/step "
+            f"({wait / total:.0%} thời gian chờ dữ liệu → bị giới hạn bởi {bound})"
+        )
 
 
-def main():
-    print("=" * 50)
-    print("VideoMAE Fine-tuning cho Positive/Negative Classification")
-    print("=" * 50)
+class TimedTrainer(Trainer):
+    """Trainer báo đầu/cuối mỗi micro-batch (`training_step`) cho DataWaitCallback."""
     
-    # Load processor và model
-    print("\n1. Đang tải processor và model...")
-    global model_name
+    def __init__(self, *args, data_wait=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data_wait = data_wait
+    
+    def training_step(self, *args, **kwargs):
+        if self.data_wait is None:
+            return super().training_step(*args, **kwargs)
+        self.data_wait.micro_batch_begin()
+        try:
+            return super().training_step(*args, **kwargs)
+        finally:
+            self.data_wait.micro_batch_end()
+
+
+def _load_model(model_name):
+    """Tải processor + model, thử fallback model công khai nếu không tải được"""
     try:
         print(f"   - Đang thử model: {model_name}")
         processor = AutoProcessor.from_pretrained(model_name)
         model = AutoModelForVideoClassification.from_pretrained(model_name)
     except Exception as load_err:
+        if model_name == fallback_model_name:
+            raise
         print(f"❌ Không thể tải model '{model_name}': {load_err}")
         print(f"   ➜ Thử fallback model '{fallback_model_name}'")
         model_name = fallback_model_name
         processor = AutoProcessor.from_pretrained(model_name)
         model = AutoModelForVideoClassification.from_pretrained(model_name)
-    
     print(f"✓ Đã tải model '{model_name}' thành công")
+    return processor, model
+
+
+def _peak_memory_mb():
+    """Bộ nhớ đỉnh của quá trình training: CUDA nếu có GPU, ngược lại max RSS của process chính"""
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / (1024 * 1024), "cuda"
+    import resource
+    
+    # Linux trả về KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "rss"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.precision == "fp16" and not torch.cuda.is_available():
+        raise ValueError("fp16 autocast cần GPU; trên CPU hãy dùng --precision bf16")
+    
+    print("=" * 50)
+    print("VideoMAE Fine-tuning cho Positive/Negative Classification")
+    print("=" * 50)
+    
+    # Load processor và model
+    print("\n1. Đang tải processor và model...")
+    processor, model = _load_model(args.model)
 
     # Thay đổi số lượng classes thành 2 (positive/negative)
     model.config.num_labels = 2
@@ -168,39 +307,46 @@ def main():
     
     # Chuẩn bị dataset
     print("\n2. Đang chuẩn bị dataset...")
-    train_paths, train_labels, val_paths, val_labels = prepare_dataset()
+    train_paths, train_labels, val_paths, val_labels = prepare_dataset(
+        args.data_dir, args.val_fraction, args.seed, args.num_frames
+    )
     
-    train_dataset = VideoDataset(train_paths, train_labels, processor, num_frames)
-    val_dataset = VideoDataset(val_paths, val_labels, processor, num_frames)
+    if args.clip_cache:
+        # Đọc clip đã decode sẵn từ các shard memory-mapped
+        train_dataset = ClipShardDataset(args.clip_cache, processor, train_paths, args.num_frames)
+        val_dataset = ClipShardDataset(args.clip_cache, processor, val_paths, args.num_frames)
+        print(f"   - Dùng clip cache: {args.clip_cache}")
+    else:
+        train_dataset = VideoDataset(train_paths, train_labels, processor, args.num_frames)
+        val_dataset = VideoDataset(val_paths, val_labels, processor, args.num_frames)
     print("✓ Đã chuẩn bị xong dataset")
     
-    # Tạo DataLoader
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        collate_fn=collate_fn
-    )
-    val_loader = DataLoader(
-        val_dataset,
-        batch_size=batch_size,
-        shuffle=False,
-        collate_fn=collate_fn
-    )
-    
     # Training arguments
     training_args = TrainingArguments(
-        output_dir="./videomae_finetuned",
-        num_train_epochs=num_epochs,
-        per_device_train_batch_size=batch_size,
-        per_device_eval_batch_size=batch_size,
-        learning_rate=learning_rate,
+        output_dir=args.output_dir,
+        num_train_epochs=args.epochs,
+        max_steps=args.max_steps,
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.batch_size,
+        gradient_accumulation_steps=args.grad_accum,
+        learning_rate=args.lr,
+        seed=args.seed,
+        # Mixed precision: autocast bf16 (CPU/GPU) hoặc fp16 (GPU)
+        bf16=args.precision == "bf16",
+        fp16=args.precision == "fp16",
+        # Không lưu activation của các layer encoder, tính lại lúc backward
+        gradient_checkpointing=args.gradient_checkpointing,
         logging_dir="./logs",
-        logging_steps=10,
+        logging_steps=args.logging_steps,
         eval_strategy="epoch",
         save_strategy="epoch",
         load_best_model_at_end=True,
         metric_for_best_model="accuracy",
+        # Trainer tự tạo DataLoader từ các tham số này (collate_fn truyền qua data_collator)
+        dataloader_num_workers=args.num_workers,
+        dataloader_pin_memory=torch.cuda.is_available(),
+        dataloader_persistent_workers=args.num_workers > 0,
+        dataloader_prefetch_factor=args.prefetch_factor if args.num_workers > 0 else None,
     )
     
     # Định nghĩa compute_metrics
@@ -212,29 +358,56 @@ def main():
     
     # Tạo Trainer
     print("\n3. Bắt đầu training...")
-    trainer = Trainer(
+    print(
+        f"   - precision={args.precision}, batch={args.batch_size} x grad_accum={args.grad_accum} "
+        f"(hiệu dụng {args.batch_size * args.grad_accum}), gradient_checkpointing={args.gradient_checkpointing}"
+    )
+    data_wait = DataWaitCallback()
+    trainer = TimedTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
+        data_collator=collate_fn,
         compute_metrics=compute_metrics,
+        callbacks=[data_wait],
+        data_wait=data_wait,
     )
     
     # Train
-    trainer.train()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    result = trainer.train()
+    peak_mb, peak_kind = _peak_memory_mb()
+    report = {
+        "precision": args.precision,
+        "batch_size": args.batch_size,
+        "grad_accum": args.grad_accum,
+        "gradient_checkpointing": args.gradient_checkpointing,
+        "samples_per_second": result.metrics.get("train_samples_per_second"),
+        "train_runtime_s": result.metrics.get("train_runtime"),
+        f"peak_memory_mb_{peak_kind}": round(peak_mb, 1),
+    }
+    print(
+        f"\n   ⏱ {report['samples_per_second']} samples/s, "
+        f"bộ nhớ đỉnh ({peak_kind}) {peak_mb:.0f} MB"
+    )
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "train_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
     
     # Lưu model
     print("\n4. Đang lưu model...")
-    trainer.save_model("./videomae_finetuned_final")
-    processor.save_pretrained("./videomae_finetuned_final")
-    print("✓ Đã lưu model tại: ./videomae_finetuned_final")
+    trainer.save_model(args.final_dir)
+    processor.save_pretrained(args.final_dir)
+    print(f"✓ Đã lưu model tại: {args.final_dir}")
     
     print("\n" + "=" * 50)
     print("Hoàn thành fine-tuning!")
     print("=" * 50)
     print("\nĐể sử dụng model đã fine-tune:")
-    print("  model = AutoModelForVideoClassification.from_pretrained('./videomae_finetuned_final')")
-    print("  processor = AutoProcessor.from_pretrained('./videomae_finetuned_final')")
+    print(f"  model = AutoModelForVideoClassification.from_pretrained('{args.final_dir}')")
+    print(f"  processor = AutoProcessor.from_pretrained('{args.final_dir}')")
 
 
 if __name__ == "__main__":